@@ -8,10 +8,15 @@ from uuid import UUID
 
 import yaml
 from fastapi import APIRouter, Header, HTTPException
-from sqlalchemy import and_, func, or_, select
+from sqlalchemy import and_, func, or_, select, update
 
 from core.database import AgentRule, ExpertComment, GroundTruthIssue, ReviewTask, TaskStatus, db_manager
-from core.semantic_check import _embed_text_expert_comment
+from core.embedding_cache import embedding_cache
+from core.expert_index import expert_comment_index
+from core.schema_cache import schema_cache
+from core.section_cache import paper_section_cache
+from core.semantic_check import embedding_service
+from core.task_writer import task_status_writer
 
 
 def _require_admin(x_admin_token: str | None) -> None:
@@ -172,6 +177,119 @@ def build_admin_router(rule_engine, layout_analyzer, semantic_checker) -> APIRou
         semantic_checker.update_rules(rule_engine.rules)
         return {"ok": True, "rule_id": rid}
 
+    @router.get("/layout_cache")
+    async def layout_cache_stats(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        cache = getattr(layout_analyzer.parser, "cache", None)
+        if cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **cache.stats()}
+
+    @router.post("/layout_cache/clear")
+    async def clear_layout_cache(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        cache = getattr(layout_analyzer.parser, "cache", None)
+        if cache is not None:
+            await asyncio.to_thread(cache.clear)
+        return {"ok": True}
+
+    @router.get("/llm_cache")
+    async def llm_cache_stats(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        cache = getattr(semantic_checker.llm_client, "cache", None)
+        if cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **(await asyncio.to_thread(cache.stats))}
+
+    @router.post("/llm_cache/clear")
+    async def clear_llm_cache(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        cache = getattr(semantic_checker.llm_client, "cache", None)
+        if cache is not None:
+            await asyncio.to_thread(cache.clear)
+        return {"ok": True}
+
+    @router.get("/embedding_cache")
+    async def embedding_cache_stats(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        return embedding_cache.stats()
+
+    @router.get("/expert_index")
+    async def expert_index_stats(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        return expert_comment_index.stats()
+
+    @router.post("/expert_index/reload")
+    async def reload_expert_index(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        expert_comment_index.invalidate()
+        ok = await expert_comment_index.load()
+        return {"ok": ok, **expert_comment_index.stats()}
+
+    @router.get("/schema_cache")
+    async def schema_cache_stats(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        return schema_cache.stats()
+
+    @router.post("/schema_cache/refresh")
+    async def refresh_schema_cache(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        return {"ok": True, **(await schema_cache.refresh())}
+
+    @router.get("/section_cache")
+    async def section_cache_stats(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        return paper_section_cache.stats()
+
+    @router.post("/section_cache/invalidate")
+    async def invalidate_section_cache(
+        payload: Dict[str, Any] | None = None,
+        x_admin_token: str | None = Header(default=None),
+    ) -> Dict[str, Any]:
+        """切片被修改后调用；不传 paper_id 时清空全部"""
+        _require_admin(x_admin_token)
+        paper_id = (payload or {}).get("paper_id")
+        if paper_id:
+            return {"ok": True, "invalidated": paper_section_cache.invalidate(str(paper_id))}
+        paper_section_cache.clear()
+        return {"ok": True, "invalidated": True}
+
+    @router.get("/task_writer")
+    async def task_writer_stats(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        return task_status_writer.stats()
+
+    @router.post("/task_writer/flush")
+    async def flush_task_writer(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        await task_status_writer.drain()
+        return {"ok": True, **task_status_writer.stats()}
+
+    @router.get("/llm_pool")
+    async def llm_pool_stats(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        registry = getattr(semantic_checker.llm_client, "registry", None)
+        if registry is None:
+            return {"enabled": False}
+        return {"enabled": True, **registry.stats()}
+
+    @router.get("/llm_routing")
+    async def llm_routing_stats(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        client = semantic_checker.llm_client
+        router = getattr(client, "router", None)
+        if router is None:
+            return {"enabled": False, "provider": client.provider}
+        return {"enabled": True, **router.stats(client.providers)}
+
+    @router.get("/llm_limits")
+    async def llm_limits_stats(x_admin_token: str | None = Header(default=None)) -> Dict[str, Any]:
+        _require_admin(x_admin_token)
+        limiters = getattr(semantic_checker.llm_client, "limiters", None)
+        if limiters is None:
+            return {"enabled": False}
+        return {"enabled": True, "providers": limiters.stats()}
+
     @router.get("/expert_comments")
     async def list_expert_comments(
         x_admin_token: str | None = Header(default=None),
@@ -254,7 +372,7 @@ def build_admin_router(rule_engine, layout_analyzer, semantic_checker) -> APIRou
 
             embedding = None
             if embed:
-                embedding = await asyncio.to_thread(_embed_text_expert_comment, f"{metric_id}\n{text_val}")
+                embedding = await embedding_service.embed(f"{metric_id}\n{text_val}")
 
             if existing:
                 existing.metric_id = metric_id or existing.metric_id
@@ -308,6 +426,7 @@ def build_admin_router(rule_engine, layout_analyzer, semantic_checker) -> APIRou
             await session.commit()
             await session.refresh(obj)
 
+        expert_comment_index.invalidate()
         return {"ok": True, "comment_id": obj.comment_id}
 
     @router.post("/expert_comments/reembed")
@@ -319,6 +438,7 @@ def build_admin_router(rule_engine, layout_analyzer, semantic_checker) -> APIRou
         limit = int(payload.get("limit", 200) or 200)
         limit_val = max(1, min(2000, limit))
         require_text = bool(payload.get("require_text", True))
+        batch_size = int(payload.get("batch_size") or embedding_service.batch_size)
 
         predicates = []
         predicates.append(or_(ExpertComment.embedding.is_(None)))
@@ -328,22 +448,37 @@ def build_admin_router(rule_engine, layout_analyzer, semantic_checker) -> APIRou
 
         async with db_manager.session() as session:
             rows = (
-                (await session.execute(select(ExpertComment).where(and_(*predicates)).limit(limit_val)))
-                .scalars()
-                .all()
-            )
-            updated = 0
-            now = datetime.utcnow()
-            for r in rows:
-                metric = _normalize_text(r.metric_id)
-                text_val = _normalize_text(r.text)
+                await session.execute(
+                    select(ExpertComment.comment_id, ExpertComment.metric_id, ExpertComment.text)
+                    .where(and_(*predicates))
+                    .limit(limit_val)
+                )
+            ).all()
+            pending = []
+            for comment_id, metric_id, text in rows:
+                metric = _normalize_text(metric_id)
+                text_val = _normalize_text(text)
                 if require_text and not text_val:
                     continue
-                r.embedding = await asyncio.to_thread(_embed_text_expert_comment, f"{metric}\n{text_val}")
-                r.updated_at = now
-                updated += 1
+                pending.append((comment_id, f"{metric}\n{text_val}"))
+
+            # 按批向量化，每批一条 executemany UPDATE（按主键）
+            updated = 0
+            now = datetime.utcnow()
+            for batch in embedding_service.batches(pending, batch_size):
+                vectors = await embedding_service.embed_many([t for _, t in batch], batch_size)
+                await session.execute(
+                    update(ExpertComment),
+                    [
+                        {"comment_id": comment_id, "embedding": vec, "updated_at": now}
+                        for (comment_id, _), vec in zip(batch, vectors)
+                    ],
+                )
+                updated += len(batch)
             await session.commit()
 
+        if updated:
+            expert_comment_index.invalidate()
         return {"ok": True, "updated": updated}
 
     @router.post("/ground_truth/batch_upsert")
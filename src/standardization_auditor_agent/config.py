@@ -31,13 +31,63 @@ DEEPSEEK_MODEL_NAME = os.getenv("DEEPSEEK_MODEL_NAME", "deepseek-chat")
 # LLM Provider: "gemini", "qwen", "deepseek" or "mock"
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "mock")
 LLM_TIMEOUT_SEC = int(os.getenv("LLM_TIMEOUT_SEC", "60"))
+# 多 provider 路由（逗号分隔，按优先级），为空时只使用 LLM_PROVIDER
+LLM_ROUTE_PROVIDERS = os.getenv("LLM_ROUTE_PROVIDERS", "").strip()
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "1") != "0"  # 首选 provider 超过其 p95 未返回时向下一个发起对冲请求
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "5"))  # 样本数不足时不对冲，仅在失败时切换
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))  # 连续失败次数达到后熔断
+LLM_BREAKER_COOLDOWN_SEC = float(os.getenv("LLM_BREAKER_COOLDOWN_SEC", "30"))
+# 每个 provider 的限流（<=0 不限制，默认关闭）；LLM_RATE_LIMITS 按 "provider:rpm:tpm" 逗号分隔单独覆盖
+LLM_RATE_RPM = float(os.getenv("LLM_RATE_RPM", "0"))
+LLM_RATE_TPM = float(os.getenv("LLM_RATE_TPM", "0"))
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "").strip()
+LLM_RATE_MAX_WAIT_SEC = float(os.getenv("LLM_RATE_MAX_WAIT_SEC", "30"))  # 排队等待配额的最长时间，超时视为该 provider 失败
+LLM_CONCURRENCY_INITIAL = int(os.getenv("LLM_CONCURRENCY_INITIAL", "4"))  # AIMD 并发初始值，成功时递增、429/超时时减半
+LLM_CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "1"))
+LLM_CONCURRENCY_MAX = int(os.getenv("LLM_CONCURRENCY_MAX", "16"))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"  # 按 provider/模型/提示词/内容哈希缓存 LLM 响应
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "").strip()  # SQLite 文件路径，为空时使用系统临时目录
+LLM_CACHE_TTL_SEC = int(os.getenv("LLM_CACHE_TTL_SEC", "604800"))  # 缓存有效期，默认 7 天，<=0 不过期
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "256"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))  # 所有 LLMClient 共享的连接池上限
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "10"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "30"))  # 空闲连接保留秒数
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") != "0"  # 需要安装 h2，未安装时自动使用 HTTP/1.1
 
 # RAG / Embedding 配置
 SBERT_MODEL_NAME = os.getenv("SBERT_MODEL_NAME", "sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
 SBERT_DEVICE = os.getenv("SBERT_DEVICE", "")
+SBERT_BATCH_SIZE = int(os.getenv("SBERT_BATCH_SIZE", "64"))  # 批量向量化每批文本数（重算/导入专家评语）
+EMBED_CACHE_ITEMS = int(os.getenv("EMBED_CACHE_ITEMS", "4096"))  # 进程内向量 LRU 条数，0 关闭
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "")  # 磁盘向量缓存目录（memmap），为空时只用内存
+EMBED_CACHE_DISK_ITEMS = int(os.getenv("EMBED_CACHE_DISK_ITEMS", "100000"))  # 磁盘缓存容量（条），写满后覆盖最早的条目
+EXPERT_INDEX_ENABLED = os.getenv("EXPERT_INDEX_ENABLED", "1") != "0"  # 专家评语进程内向量索引，关闭后每次检索直接查 pgvector
+EXPERT_INDEX_HNSW_MIN = int(os.getenv("EXPERT_INDEX_HNSW_MIN", "20000"))  # 评语条数达到该值且安装了 hnswlib 时改用 HNSW
+EXPERT_INDEX_REFRESH_SEC = float(os.getenv("EXPERT_INDEX_REFRESH_SEC", "60"))  # 每隔多少秒比对评语表是否被其它进程修改，0 关闭
+
+# 缺少 payload.content 时按论文缓存切片
+SECTION_CACHE_PAPERS = int(os.getenv("SECTION_CACHE_PAPERS", "64"))  # 缓存最近取过切片的论文数，0 关闭
+# 切片缓存有效期（秒），<=0 不过期。切片在外部被修改后，有效期内的重审可能读到旧内容；
+# 写入方可调用 POST /admin/section_cache/invalidate 立即失效
+SECTION_CACHE_TTL_SEC = float(os.getenv("SECTION_CACHE_TTL_SEC", "30"))
+
+# 任务状态持久化
+TASK_WRITE_STRICT = os.getenv("TASK_WRITE_STRICT", "0") == "1"  # 1 时每次状态变更同步写库，失败即报错；默认写回队列批量写库
+TASK_WRITE_BATCH_SIZE = int(os.getenv("TASK_WRITE_BATCH_SIZE", "50"))  # 待写任务数达到该值立即批量写库
+TASK_WRITE_FLUSH_SEC = float(os.getenv("TASK_WRITE_FLUSH_SEC", "1.0"))  # 首条待写记录最多等待的秒数
+TASK_WRITE_SPOOL_DIR = os.getenv("TASK_WRITE_SPOOL_DIR", "")  # 数据库不可用时的本地暂存目录（需持久化），默认 <应用目录>/var/task_spool
 
 # 布局分析配置
 LAYOUT_ANALYSIS_TIMEOUT = int(os.getenv("LAYOUT_ANALYSIS_TIMEOUT", "300")) # 5分钟，适应长文档处理
+LAYOUT_TIMEOUT_GRACE = int(os.getenv("LAYOUT_TIMEOUT_GRACE", "30"))  # 解析到期后留给已解析页面做校验的时间
+LAYOUT_PARSE_WORKERS = int(os.getenv("LAYOUT_PARSE_WORKERS", "0"))  # 分片并行解析进程数，<=1 时走串行解析
+LAYOUT_PARSE_SHARD_PAGES = int(os.getenv("LAYOUT_PARSE_SHARD_PAGES", "8"))  # 每个分片的页数
+LAYOUT_PARSE_MIN_PAGES = int(os.getenv("LAYOUT_PARSE_MIN_PAGES", "16"))  # 页数不足时不启用并行解析
+LAYOUT_STREAMING = os.getenv("LAYOUT_STREAMING", "1") != "0"  # 串行解析时逐页产出并提前执行页内检查
+LAYOUT_CACHE_ENABLED = os.getenv("LAYOUT_CACHE_ENABLED", "1") != "0"  # 按 PDF 内容哈希缓存解析结果
+LAYOUT_CACHE_DIR = os.getenv("LAYOUT_CACHE_DIR", "").strip()  # 为空时使用系统临时目录
+LAYOUT_CACHE_MEMORY_MB = int(os.getenv("LAYOUT_CACHE_MEMORY_MB", "64"))
+LAYOUT_CACHE_MAX_MB = int(os.getenv("LAYOUT_CACHE_MAX_MB", "512"))  # <=0 时仅使用内存缓存
 
 # 数据库配置
 DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
@@ -0,0 +1,266 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+
+class ElementRow:
+    """
+    ElementStore 中一行的只读视图，属性与 VisualElement 一致（type/content/bbox/page_num/region）。
+    由 ElementStore 按列批量生成，不做 pydantic 校验。
+    """
+
+    __slots__ = ("type", "content", "bbox", "page_num", "region")
+    paper_id = None
+    chunk_id = None
+
+    def __init__(self, type: str, content: str, bbox: List[float], page_num: int, region: str):
+        self.type = type
+        self.content = content
+        self.bbox = bbox
+        self.page_num = page_num
+        self.region = region
+
+    def model_dump(self) -> Dict[str, Any]:
+        return {
+            "type": self.type,
+            "content": self.content,
+            "bbox": list(self.bbox),
+            "page_num": self.page_num,
+            "region": self.region,
+            "paper_id": None,
+            "chunk_id": None,
+        }
+
+    def __repr__(self) -> str:
+        return f"ElementRow(type={self.type!r}, page_num={self.page_num}, region={self.region!r}, content={self.content[:40]!r})"
+
+
+class ElementStore:
+    """
+    列式存储的布局元素表：类型/区域为编码数组，页码与 bbox 为 NumPy 数组，
+    文本拼接为一个字符串并以 offsets 切分。
+    按序列使用（len / 下标 / 迭代）时返回 ElementRow，可直接替代 List[VisualElement]；
+    行对象在首次逐行访问时由各列批量生成并缓存，视为只读。
+    """
+
+    def __init__(
+        self,
+        type_names: Sequence[str],
+        type_codes: np.ndarray,
+        region_names: Sequence[str],
+        region_codes: np.ndarray,
+        page_nums: np.ndarray,
+        bboxes: np.ndarray,
+        text: str,
+        offsets: np.ndarray,
+    ):
+        self.type_names = tuple(type_names)
+        self.type_codes = type_codes
+        self.region_names = tuple(region_names)
+        self.region_codes = region_codes
+        self.page_nums = page_nums
+        self.bboxes = bboxes
+        self.text = text
+        self.offsets = offsets
+        self._reset_views()
+
+    def _reset_views(self) -> None:
+        self._rows: Optional[List[ElementRow]] = None
+        self._offsets: Optional[List[int]] = None
+
+    @classmethod
+    def empty(cls) -> "ElementStore":
+        return ElementStoreBuilder().build()
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Any]) -> "ElementStore":
+        builder = ElementStoreBuilder()
+        for r in rows:
+            if isinstance(r, dict):
+                builder.add(r["type"], r["content"], r["bbox"], r["page_num"], r["region"])
+            else:
+                builder.add(r.type, r.content, r.bbox, r.page_num, r.region)
+        return builder.build()
+
+    @classmethod
+    def concat(cls, stores: Sequence["ElementStore"]) -> "ElementStore":
+        stores = [s for s in stores if s is not None]
+        if not stores:
+            return cls.empty()
+        if len(stores) == 1:
+            return stores[0]
+        type_names: List[str] = []
+        region_names: List[str] = []
+        for s in stores:
+            type_names.extend(n for n in s.type_names if n not in type_names)
+            region_names.extend(n for n in s.region_names if n not in region_names)
+        type_index = {n: i for i, n in enumerate(type_names)}
+        region_index = {n: i for i, n in enumerate(region_names)}
+        type_codes = []
+        region_codes = []
+        offsets = [np.zeros(1, dtype=np.int64)]
+        base = 0
+        for s in stores:
+            type_map = np.array([type_index[n] for n in s.type_names] or [0], dtype=np.uint8)
+            region_map = np.array([region_index[n] for n in s.region_names] or [0], dtype=np.uint8)
+            type_codes.append(type_map[s.type_codes])
+            region_codes.append(region_map[s.region_codes])
+            offsets.append(s.offsets[1:] + base)
+            base += len(s.text)
+        return cls(
+            type_names,
+            np.concatenate(type_codes),
+            region_names,
+            np.concatenate(region_codes),
+            np.concatenate([s.page_nums for s in stores]),
+            np.concatenate([s.bboxes for s in stores]),
+            "".join(s.text for s in stores),
+            np.concatenate(offsets),
+        )
+
+    def __len__(self) -> int:
+        return len(self.page_nums)
+
+    def __iter__(self) -> Iterator[ElementRow]:
+        return iter(self.rows())
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, slice):
+            return self.take(np.arange(len(self))[key])
+        return self.rows()[int(key)]
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # 行视图缓存可由数组重建，不随进程间传递
+        return {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._reset_views()
+
+    def take(self, indices: Any) -> "ElementStore":
+        """按下标（或布尔掩码）取子表，保持原有顺序。"""
+        idx = np.asarray(indices)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        idx = idx.astype(np.int64, copy=False)
+        starts = self.offsets[idx]
+        ends = self.offsets[idx + 1]
+        offset_list = self._offset_list()
+        text = "".join(self.text[offset_list[i]:offset_list[i + 1]] for i in idx.tolist())
+        offsets = np.zeros(len(idx) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+        return ElementStore(
+            self.type_names,
+            self.type_codes[idx],
+            self.region_names,
+            self.region_codes[idx],
+            self.page_nums[idx],
+            self.bboxes[idx],
+            text,
+            offsets,
+        )
+
+    def type_mask(self, *names: str) -> np.ndarray:
+        codes = [i for i, n in enumerate(self.type_names) if n in names]
+        return np.isin(self.type_codes, codes)
+
+    def region_mask(self, *names: str) -> np.ndarray:
+        codes = [i for i, n in enumerate(self.region_names) if n in names]
+        return np.isin(self.region_codes, codes)
+
+    def by_page(self) -> Dict[int, "ElementStore"]:
+        """按页拆分为子表，页序与元素首次出现的顺序一致。"""
+        if not len(self):
+            return {}
+        pages, first = np.unique(self.page_nums, return_index=True)
+        out: Dict[int, ElementStore] = {}
+        for page in pages[np.argsort(first, kind="stable")].tolist():
+            out[int(page)] = self.take(self.page_nums == page)
+        return out
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [r.model_dump() for r in self.rows()]
+
+    def rows(self) -> List[ElementRow]:
+        if self._rows is None:
+            offsets = self._offset_list()
+            text = self.text
+            self._rows = [
+                ElementRow(self.type_names[t], text[offsets[i]:offsets[i + 1]], bbox, page, self.region_names[r])
+                for i, (t, r, page, bbox) in enumerate(
+                    zip(self.type_codes.tolist(), self.region_codes.tolist(), self.page_nums.tolist(), self.bboxes.tolist())
+                )
+            ]
+        return self._rows
+
+    def to_table(self) -> Dict[str, Any]:
+        """紧凑的可 JSON 序列化表示，供解析缓存使用。"""
+        return {
+            "types": list(self.type_names),
+            "type_codes": self.type_codes.tolist(),
+            "regions": list(self.region_names),
+            "region_codes": self.region_codes.tolist(),
+            "page_nums": self.page_nums.tolist(),
+            "bboxes": self.bboxes.tolist(),
+            "text": self.text,
+            "offsets": self.offsets.tolist(),
+        }
+
+    @classmethod
+    def from_table(cls, data: Dict[str, Any]) -> "ElementStore":
+        n = len(data.get("page_nums", []))
+        return cls(
+            data.get("types", []),
+            np.asarray(data.get("type_codes", []), dtype=np.uint8),
+            data.get("regions", []),
+            np.asarray(data.get("region_codes", []), dtype=np.uint8),
+            np.asarray(data.get("page_nums", []), dtype=np.int32),
+            np.asarray(data.get("bboxes", []), dtype=np.float64).reshape(n, 4),
+            data.get("text", ""),
+            np.asarray(data.get("offsets", [0]), dtype=np.int64),
+        )
+
+    def _offset_list(self) -> List[int]:
+        if self._offsets is None:
+            self._offsets = self.offsets.tolist()
+        return self._offsets
+
+
+class ElementStoreBuilder:
+    """逐行追加元素，build() 时一次性生成列式数组。"""
+
+    def __init__(self):
+        self._type_index: Dict[str, int] = {}
+        self._region_index: Dict[str, int] = {}
+        self._types: List[int] = []
+        self._regions: List[int] = []
+        self._pages: List[int] = []
+        self._bboxes: List[Tuple[float, float, float, float]] = []
+        self._texts: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def add(self, type: str, content: str, bbox: Sequence[float], page_num: int, region: str) -> None:
+        self._types.append(self._type_index.setdefault(type, len(self._type_index)))
+        self._regions.append(self._region_index.setdefault(region, len(self._region_index)))
+        self._pages.append(int(page_num))
+        self._bboxes.append((float(bbox[0]), float(bbox[1]), float(bbox[2]), float(bbox[3])))
+        self._texts.append(content or "")
+
+    def build(self) -> ElementStore:
+        offsets = np.zeros(len(self._texts) + 1, dtype=np.int64)
+        if self._texts:
+            np.cumsum([len(t) for t in self._texts], out=offsets[1:])
+        return ElementStore(
+            list(self._type_index),
+            np.asarray(self._types, dtype=np.uint8),
+            list(self._region_index),
+            np.asarray(self._regions, dtype=np.uint8),
+            np.asarray(self._pages, dtype=np.int32),
+            np.asarray(self._bboxes, dtype=np.float64).reshape(len(self._pages), 4),
+            "".join(self._texts),
+            offsets,
+        )
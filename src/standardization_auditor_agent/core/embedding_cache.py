@@ -0,0 +1,284 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import contextlib
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from config import EMBED_CACHE_DIR, EMBED_CACHE_DISK_ITEMS, EMBED_CACHE_ITEMS
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+try:
+    import fcntl  # POSIX 文件锁；不可用时（Windows）磁盘层目录不要在多个进程间共用
+except ImportError:
+    fcntl = None
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_embedding_text(text: str) -> str:
+    """去掉首尾空白并合并连续空白，只影响缓存 key"""
+    return _WS.sub(" ", (text or "").strip())
+
+
+def embedding_cache_key(model_name: str, text: str) -> bytes:
+    raw = f"{model_name}\x00{normalize_embedding_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).digest()
+
+
+class _DiskTier:
+    """
+    定长环形存储：keys.bin 存 32 字节 key，vectors.f32 存 float32 向量，sums.u32 存 key+向量的 CRC32，均为 memmap；
+    meta.json 记录维度、容量、下一个写入位置和累计写入行数。写满后覆盖最早写入的行。
+    多个进程可共用同一目录：写入在 lock 文件的 flock 下进行，写入位置以 meta.json 为准；
+    读取时校验该行的 key（读向量前后各一次）和 CRC，被其它进程覆盖或未写完的行视为未命中。
+    """
+
+    LAYOUT = 2
+
+    def __init__(self, directory: str, capacity: int, dim: int):
+        self.directory = directory
+        self.capacity = max(1, int(capacity))
+        self.dim = int(dim)
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._lock_path = os.path.join(directory, "lock")
+        self._rows: Dict[bytes, int] = {}
+        with self._locked():
+            meta = self._read_meta()
+            fresh = (
+                meta.get("dim") != self.dim
+                or meta.get("capacity") != self.capacity
+                or meta.get("layout") != self.LAYOUT
+            )
+            mode = "w+" if fresh else "r+"
+            self._keys = np.memmap(os.path.join(directory, "keys.bin"), dtype="S32", mode=mode, shape=(self.capacity,))
+            self._vectors = np.memmap(
+                os.path.join(directory, "vectors.f32"), dtype=np.float32, mode=mode, shape=(self.capacity, self.dim)
+            )
+            self._sums = np.memmap(os.path.join(directory, "sums.u32"), dtype=np.uint32, mode=mode, shape=(self.capacity,))
+            if fresh:
+                self.next, self.writes = 0, 0
+                self._write_meta()
+            else:
+                self.next = int(meta.get("next", 0)) % self.capacity
+                self.writes = int(meta.get("writes", 0))
+                self._index_rows(range(self.capacity))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(self._lock_path, "a+") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def _read_meta(self) -> Dict[str, Any]:
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self) -> None:
+        tmp = f"{self._meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {"dim": self.dim, "capacity": self.capacity, "next": self.next, "writes": self.writes, "layout": self.LAYOUT},
+                f,
+            )
+        os.replace(tmp, self._meta_path)
+
+    def _index_rows(self, rows: Iterable[int]) -> None:
+        for row in rows:
+            key = bytes(self._keys[row])
+            if key:
+                self._rows[key] = row
+
+    def _sync_from_meta(self) -> None:
+        """持锁时调用：采用 meta.json 中的写入位置，并把其它进程新写入的行加入本进程索引"""
+        meta = self._read_meta()
+        writes = int(meta.get("writes", self.writes))
+        start = self.next
+        self.next = int(meta.get("next", self.next)) % self.capacity
+        new = writes - self.writes
+        self.writes = writes
+        if new <= 0:
+            return
+        if new >= self.capacity:
+            self._rows.clear()
+            self._index_rows(range(self.capacity))
+            return
+        rows = [(start + i) % self.capacity for i in range(new)]
+        stale = set(rows)
+        for key in [k for k, r in self._rows.items() if r in stale]:
+            del self._rows[key]
+        self._index_rows(rows)
+
+    @staticmethod
+    def _checksum(key: bytes, vec: np.ndarray) -> int:
+        return zlib.crc32(np.ascontiguousarray(vec, dtype=np.float32).tobytes(), zlib.crc32(key))
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        if bytes(self._keys[row]) != key:
+            self._rows.pop(key, None)
+            return None
+        vec = np.array(self._vectors[row], dtype=np.float32)
+        if bytes(self._keys[row]) != key or int(self._sums[row]) != self._checksum(key, vec):
+            # 该行被其它进程覆盖或写了一半
+            self._rows.pop(key, None)
+            return None
+        return vec
+
+    def put(self, key: bytes, vec: np.ndarray) -> None:
+        self.put_many([(key, vec)])
+
+    def put_many(self, items: List[Tuple[bytes, np.ndarray]]) -> None:
+        """整批写入：持锁一次，memmap 各刷盘一次，meta.json 写一次"""
+        with self._locked():
+            self._sync_from_meta()
+            written = 0
+            for key, vec in items:
+                if key in self._rows:
+                    continue
+                row = self.next
+                old = bytes(self._keys[row])
+                if old:
+                    self._rows.pop(old, None)
+                # 先清空 key 再写向量，读者在写入过程中不会把新向量当成旧 key 的结果
+                self._keys[row] = b""
+                self._vectors[row] = vec
+                self._sums[row] = self._checksum(key, vec)
+                self._keys[row] = key
+                self._rows[key] = row
+                self.next = (row + 1) % self.capacity
+                written += 1
+            if not written:
+                return
+            self.writes += written
+            self._vectors.flush()
+            self._sums.flush()
+            self._keys.flush()
+            self._write_meta()
+
+    def clear(self) -> None:
+        with self._locked():
+            self._keys[:] = b""
+            self._keys.flush()
+            self._rows.clear()
+            self.next = 0
+            self.writes = int(self._read_meta().get("writes", self.writes)) + self.capacity
+            self._write_meta()
+
+
+class EmbeddingCache:
+    """
+    向量缓存：key 为 模型名 + 归一化文本 的 SHA-256。进程内 LRU 在前，
+    可选的 memmap 磁盘层在后（配置目录时启用），相同文本跨请求、跨重启都不再重复推理。
+    """
+
+    def __init__(self, max_items: int, directory: Optional[str] = None, disk_items: int = 0, dim: int = 768):
+        self.max_items = max(0, int(max_items))
+        self.dim = int(dim)
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._disk: Optional[_DiskTier] = None
+        if directory and disk_items > 0:
+            try:
+                self._disk = _DiskTier(directory, disk_items, self.dim)
+            except (OSError, ValueError) as e:
+                logger.warning(f"embedding disk cache unavailable: {e!r}")
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, model_name: str, text: str) -> Optional[np.ndarray]:
+        key = embedding_cache_key(model_name, text)
+        with self._lock:
+            vec = self._memory.get(key)
+            if vec is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vec
+            if self._disk is not None:
+                vec = self._disk.get(key)
+                if vec is not None:
+                    self.disk_hits += 1
+                    self._remember(key, vec)
+                    return vec
+            self.misses += 1
+            return None
+
+    def put(self, model_name: str, text: str, vec: Any) -> None:
+        self.put_many(model_name, [text], [vec])
+
+    def put_many(self, model_name: str, texts: Sequence[str], vecs: Sequence[Any]) -> None:
+        """整批写入，磁盘层只落盘一次"""
+        items = []
+        for text, vec in zip(texts, vecs):
+            arr = np.asarray(vec, dtype=np.float32)
+            if arr.shape == (self.dim,):
+                items.append((embedding_cache_key(model_name, text), arr))
+        if not items:
+            return
+        with self._lock:
+            for key, arr in items:
+                self._remember(key, arr)
+            if self._disk is not None:
+                try:
+                    self._disk.put_many(items)
+                except OSError as e:
+                    logger.warning(f"embedding disk cache write failed: {e!r}")
+
+    def _remember(self, key: bytes, vec: np.ndarray) -> None:
+        if self.max_items <= 0:
+            return
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get_or_compute(self, model_name: str, text: str, compute: Callable[[str], List[float]]) -> List[float]:
+        vec = self.get(model_name, text)
+        if vec is None:
+            out = compute(text)
+            self.put(model_name, text, out)
+            return out
+        return vec.astype(float).tolist()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "items": len(self._memory),
+                "max_items": self.max_items,
+                "disk_items": len(self._disk) if self._disk is not None else None,
+                "disk_dir": self._disk.directory if self._disk is not None else None,
+            }
+
+
+embedding_cache = EmbeddingCache(
+    max_items=EMBED_CACHE_ITEMS,
+    directory=EMBED_CACHE_DIR or None,
+    disk_items=EMBED_CACHE_DISK_ITEMS,
+)
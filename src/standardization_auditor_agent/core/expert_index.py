@@ -0,0 +1,235 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import time
+
+import numpy as np
+from sqlalchemy import func, select
+
+from config import EXPERT_INDEX_ENABLED, EXPERT_INDEX_HNSW_MIN, EXPERT_INDEX_REFRESH_SEC
+from utils.logger import setup_logger
+from .database import ExpertComment, db_manager
+
+logger = setup_logger(__name__)
+
+try:
+    import hnswlib  # 可选依赖，评语量很大时才使用
+except ImportError:
+    hnswlib = None
+
+
+def _non_empty(value: Any) -> bool:
+    # 与 pgvector 查询中的 length(trim(col)) > 0 一致：SQL trim() 只去空格
+    return value is not None and bool(str(value).strip(" "))
+
+
+class ExpertCommentIndex:
+    """
+    expert_comments 的进程内向量索引：启动时整表载入为归一化 float32 矩阵，
+    按余弦相似度暴力 matmul 检索（条数达到 hnsw_min 且安装了 hnswlib 时改用 HNSW）。
+    require_text / require_metric_id / require_active 过滤与 pgvector 查询一致。
+    未载入或已失效时 search 返回 None，调用方回退到 pgvector，并在后台重新载入。
+    其它进程（如 scripts/seed_expert_comments.py）写入的评语：每 refresh_sec 秒在后台比对
+    条数 / max(updated_at) / max(comment_id)，有变化时重新载入。
+    """
+
+    def __init__(self, enabled: bool = True, hnsw_min: int = 20000, refresh_sec: float = 60):
+        self.enabled = enabled
+        self.hnsw_min = max(1, int(hnsw_min))
+        self.refresh_sec = float(refresh_sec)
+        self._matrix: Optional[np.ndarray] = None
+        self._texts: List[str] = []
+        self._has_text = np.zeros(0, dtype=bool)
+        self._has_metric = np.zeros(0, dtype=bool)
+        self._active = np.zeros(0, dtype=bool)
+        self._hnsw = None
+        self._version = 0
+        self._signature: Optional[Tuple[Any, ...]] = None
+        self._checked_at = 0.0
+        self._loading: Optional[asyncio.Task] = None
+        self.loaded_at: Optional[float] = None
+        self.searches = 0
+        self.fallbacks = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._matrix is not None
+
+    def _prepare(self, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """rows: [{"text", "metric_id", "active", "embedding"}]，跳过没有向量的行；只计算，不修改索引状态"""
+        vectors, texts, has_text, has_metric, active = [], [], [], [], []
+        for row in rows:
+            emb = row.get("embedding")
+            if emb is None:
+                continue
+            vectors.append(np.asarray(emb, dtype=np.float32))
+            texts.append(row.get("text") or "")
+            has_text.append(_non_empty(row.get("text")))
+            has_metric.append(_non_empty(row.get("metric_id")))
+            active.append(row.get("active") is not False)
+        matrix = np.vstack(vectors) if vectors else np.zeros((0, 768), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms > 0, norms, 1.0)
+        hnsw = None
+        if hnswlib is not None and len(texts) >= self.hnsw_min:
+            hnsw = hnswlib.Index(space="ip", dim=matrix.shape[1])
+            hnsw.init_index(max_elements=len(texts), ef_construction=200, M=16)
+            hnsw.add_items(matrix, np.arange(len(texts)))
+        return {
+            "texts": texts,
+            "has_text": np.array(has_text, dtype=bool),
+            "has_metric": np.array(has_metric, dtype=bool),
+            "active": np.array(active, dtype=bool),
+            "hnsw": hnsw,
+            "matrix": matrix,
+        }
+
+    def _install(self, state: Dict[str, Any], signature: Optional[Tuple[Any, ...]] = None) -> None:
+        self._texts = state["texts"]
+        self._has_text = state["has_text"]
+        self._has_metric = state["has_metric"]
+        self._active = state["active"]
+        self._hnsw = state["hnsw"]
+        self._matrix = state["matrix"]
+        self._signature = signature
+        self.loaded_at = self._checked_at = time.time()
+
+    def build(self, rows: List[Dict[str, Any]]) -> None:
+        self._install(self._prepare(rows))
+
+    @staticmethod
+    async def _fetch_signature(session) -> Tuple[Any, ...]:
+        result = await session.execute(
+            select(
+                func.count(),
+                func.max(ExpertComment.updated_at),
+                func.max(ExpertComment.comment_id),
+            ).where(ExpertComment.embedding.is_not(None))
+        )
+        return tuple(result.one())
+
+    async def load(self) -> bool:
+        """从数据库整表载入；失败时保持未载入状态（检索走 pgvector）"""
+        if not self.enabled:
+            return False
+        version = self._version
+        try:
+            async with db_manager.session() as session:
+                # 先取签名：载入期间的新改动会在下次比对时发现
+                signature = await self._fetch_signature(session)
+                result = await session.execute(
+                    select(
+                        ExpertComment.text,
+                        ExpertComment.metric_id,
+                        ExpertComment.active,
+                        ExpertComment.embedding,
+                    ).where(ExpertComment.embedding.is_not(None))
+                )
+                rows = [
+                    {"text": text, "metric_id": metric_id, "active": active, "embedding": embedding}
+                    for text, metric_id, active, embedding in result.all()
+                ]
+        except Exception as e:
+            logger.warning(f"expert comment index load failed: {e}")
+            return False
+        state = await asyncio.to_thread(self._prepare, rows)
+        if version != self._version:
+            # 载入期间评语被修改（invalidate），这份数据已过期，不安装
+            return False
+        self._install(state, signature)
+        logger.info(f"expert comment index loaded: {len(self._texts)} vectors ({'hnsw' if self._hnsw else 'matmul'})")
+        return True
+
+    async def _refresh_if_changed(self) -> bool:
+        """比对表签名，其它进程改过评语时重新载入"""
+        version = self._version
+        try:
+            async with db_manager.session() as session:
+                signature = await self._fetch_signature(session)
+        except Exception as e:
+            logger.warning(f"expert comment index freshness check failed: {e}")
+            return False
+        if signature == self._signature or version != self._version:
+            return False
+        logger.info("expert comments changed in DB, reloading index")
+        return await self.load()
+
+    def invalidate(self) -> None:
+        """评语新增/修改/重算向量后调用，下次检索时后台重新载入"""
+        self._version += 1
+        self._matrix = None
+        self._hnsw = None
+
+    def _schedule_reload(self, refresh: bool = False) -> None:
+        if not self.enabled or (self._loading is not None and not self._loading.done()):
+            return
+        self._loading = asyncio.get_running_loop().create_task(self._refresh_if_changed() if refresh else self.load())
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int,
+        require_text: bool,
+        require_metric_id: bool,
+        require_active: bool,
+    ) -> Optional[List[str]]:
+        matrix = self._matrix
+        if matrix is None:
+            self.fallbacks += 1
+            self._schedule_reload()
+            return None
+        if self.refresh_sec > 0 and time.time() - self._checked_at > self.refresh_sec:
+            # 后台比对，期间继续用当前索引
+            self._checked_at = time.time()
+            self._schedule_reload(refresh=True)
+        self.searches += 1
+        mask = np.ones(len(self._texts), dtype=bool)
+        if require_text:
+            mask &= self._has_text
+        if require_metric_id:
+            mask &= self._has_metric
+        if require_active:
+            mask &= self._active
+        candidates = np.flatnonzero(mask)
+        if not len(candidates) or top_k <= 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm > 0:
+            query = query / norm
+        k = min(top_k, len(candidates))
+        if self._hnsw is not None:
+            self._hnsw.set_ef(max(50, k * 4))
+            try:
+                labels, _ = self._hnsw.knn_query(query, k=k, filter=lambda label: bool(mask[label]))
+            except RuntimeError as e:
+                # 过滤后 HNSW 找不到 k 个结果时抛错，交给 pgvector
+                logger.debug(f"hnsw query failed, falling back to pgvector: {e}")
+                self.fallbacks += 1
+                return None
+            order = [int(i) for i in labels[0]]
+        else:
+            scores = matrix[candidates] @ query
+            top = np.argpartition(-scores, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+            # 相似度相同按载入顺序，结果稳定
+            top = top[np.lexsort((top, -scores[top]))]
+            order = [int(candidates[i]) for i in top]
+        return [self._texts[i] for i in order if self._texts[i]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "vectors": len(self._texts) if self.ready else 0,
+            "backend": "hnsw" if self._hnsw is not None else "matmul",
+            "loaded_at": self.loaded_at,
+            "refresh_sec": self.refresh_sec,
+            "searches": self.searches,
+            "fallbacks": self.fallbacks,
+        }
+
+
+expert_comment_index = ExpertCommentIndex(
+    enabled=EXPERT_INDEX_ENABLED,
+    hnsw_min=EXPERT_INDEX_HNSW_MIN,
+    refresh_sec=EXPERT_INDEX_REFRESH_SEC,
+)
@@ -0,0 +1,112 @@
+from typing import Dict, Iterable, List, Set, Tuple
+import difflib
+import re
+
+_LATIN = re.compile(r"[A-Za-z]")
+
+
+def _max_indel(a: int, b: int, cutoff: float) -> int:
+    """
+    ratio = 2M/(a+b) >= cutoff 时，两串的插删距离 a+b-2M 的上界（按 difflib 相同的浮点口径计算）。
+    """
+    total = a + b
+    if total <= 0:
+        return 0
+    d = 0
+    while d < total and (total - (d + 1)) / total >= cutoff:
+        d += 1
+    return d
+
+
+def _deletes(word: str, max_dist: int) -> Set[str]:
+    """删除不超过 max_dist 个字符得到的全部变体（含原词）"""
+    out = {word}
+    frontier = {word}
+    for _ in range(max_dist):
+        nxt = set()
+        for w in frontier:
+            for i in range(len(w)):
+                nxt.add(w[:i] + w[i + 1:])
+        nxt -= out
+        if not nxt:
+            break
+        out |= nxt
+        frontier = nxt
+    return out
+
+
+class KeywordFuzzyIndex:
+    """
+    关键术语的删除变体索引（SymSpell 思路）：规则加载时构建一次。
+    对文档词表中的每个去重后的词，只生成有限编辑距离内的删除变体去索引里取候选关键词，
+    再用与 difflib.get_close_matches 相同的 SequenceMatcher 打分确认，结果与逐一比较一致。
+    英文关键词候选词长差 <= length_slack，其余关键词要求等长（与原逻辑一致）。
+    """
+
+    def __init__(self, keywords: Iterable[str], cutoff: float = 0.85, length_slack: int = 2):
+        self.cutoff = cutoff
+        self.length_slack = length_slack
+        self.keywords: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._is_english: List[bool] = []
+        self._index: Dict[str, List[int]] = {}
+        # 词长 -> 需要生成的删除深度
+        self._word_depth: Dict[int, int] = {}
+        for kw in keywords:
+            if not isinstance(kw, str) or not kw or kw in self._ids:
+                continue
+            kw_id = len(self.keywords)
+            self._ids[kw] = kw_id
+            self.keywords.append(kw)
+            is_english = bool(_LATIN.search(kw))
+            self._is_english.append(is_english)
+            # 公共子序列长 M 时，关键词删 n-M 个、词删 b-M 个字符即可相遇，两者之和不超过插删上界 d
+            depth = 0
+            for b in self._word_lengths(kw_id):
+                d = _max_indel(len(kw), b, cutoff)
+                if abs(b - len(kw)) > d:
+                    continue
+                depth = max(depth, (d + len(kw) - b) // 2)
+                self._word_depth[b] = max(self._word_depth.get(b, 0), (d + b - len(kw)) // 2)
+            for variant in _deletes(kw, depth):
+                self._index.setdefault(variant, []).append(kw_id)
+
+    def _word_lengths(self, kw_id: int) -> range:
+        n = len(self.keywords[kw_id])
+        if self._is_english[kw_id]:
+            return range(max(1, n - self.length_slack), n + self.length_slack + 1)
+        return range(n, n + 1)
+
+    def _length_ok(self, kw_id: int, word: str) -> bool:
+        diff = len(word) - len(self.keywords[kw_id])
+        if self._is_english[kw_id]:
+            return abs(diff) <= self.length_slack
+        return diff == 0
+
+    def close_words(self, vocabulary: Iterable[str]) -> Dict[str, List[Tuple[float, str]]]:
+        """
+        返回 keyword -> [(ratio, word)]，只包含 ratio >= cutoff 的词表词。
+        """
+        out: Dict[str, List[Tuple[float, str]]] = {}
+        matcher = difflib.SequenceMatcher()
+        for word in vocabulary:
+            depth = self._word_depth.get(len(word))
+            if depth is None:
+                continue
+            kw_ids: Set[int] = set()
+            for variant in _deletes(word, depth):
+                hit = self._index.get(variant)
+                if hit:
+                    kw_ids.update(hit)
+            for kw_id in kw_ids:
+                if not self._length_ok(kw_id, word):
+                    continue
+                kw = self.keywords[kw_id]
+                # 与 get_close_matches 相同：seq2 为关键词，seq1 为候选词
+                matcher.set_seq2(kw)
+                matcher.set_seq1(word)
+                if matcher.real_quick_ratio() >= self.cutoff and matcher.quick_ratio() >= self.cutoff:
+                    score = matcher.ratio()
+                    if score >= self.cutoff:
+                        out.setdefault(kw, []).append((score, word))
+        return out
@@ -1,14 +1,27 @@
-from typing import Dict, Any, List, Optional, Tuple
+from typing import AsyncIterator, Callable, Dict, Any, Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
 from pydantic import BaseModel
 import asyncio
+import base64
+import multiprocessing
+import os
 import re
 import statistics
-from .pdf_utils import open_pdf, extract_blocks, extract_drawing_regions, is_encrypted, is_scanned_page, split_columns, page_to_image
+import tempfile
+import threading
+from .pdf_utils import open_pdf, extract_drawing_regions, extract_page_content, is_encrypted, split_columns, page_to_image, pdf_sha256
 from .layout_zones import is_reference_title, classify_line_region, is_caption, is_heading_text, is_formula_text
 from .layout_exceptions import ParseError, ParseReport
 from .layout_rules import check_citation_reference_match, load_rules
 from .layout_adapter import with_anchor
+from .element_store import ElementStore, ElementStoreBuilder
+from .layout_cache import LayoutParseCache, layout_parse_cache, make_cache_key
 from .vision_utils import detect_text_lines, to_gray
+from config import LAYOUT_PARSE_WORKERS, LAYOUT_PARSE_SHARD_PAGES, LAYOUT_PARSE_MIN_PAGES, LAYOUT_STREAMING
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
 
 
 class VisualElement(BaseModel):
@@ -35,17 +48,6 @@ def _sort_blocks(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return sorted(blocks, key=lambda b: (b.get("bbox", [0, 0, 0, 0])[1], b.get("bbox", [0, 0, 0, 0])[0]))
 
 
-def _text_from_line(line: Dict[str, Any]) -> str:
-    spans = line.get("spans", [])
-    return "".join([s.get("text", "") for s in spans]).strip()
-
-
-def _max_font_size(line: Dict[str, Any]) -> float:
-    spans = line.get("spans", [])
-    sizes = [s.get("size", 0) for s in spans if s.get("size") is not None]
-    return float(max(sizes)) if sizes else 0.0
-
-
 def _find_citations(text: str) -> List[str]:
     matches = []
     t = text or ""
@@ -137,315 +139,666 @@ def _parse_heading_parts(text: str) -> Optional[List[int]]:
     return None
 
 
-class PDFParser:
-    def __init__(self):
-        pass
+def _parse_pages(
+    doc: Any,
+    page_nums: List[int],
+    reference_mode_global: bool,
+    parse_report: ParseReport,
+    cancel: Optional[threading.Event] = None,
+    page_stats: Optional[List[List[int]]] = None,
+) -> Tuple[ElementStore, bool]:
+    """
+    按页序解析；cancel 被置位后在页边界停止，返回已解析页面的元素并标记 parse_report.partial。
+    page_stats 不为 None 时逐页追加 [page_num, 各计数器增量]，供缓存回放时重建逐页的累计报告。
+    """
+    stores: List[ElementStore] = []
+    for page_num in page_nums:
+        if cancel is not None and cancel.is_set():
+            parse_report.partial = True
+            break
+        before = _page_counters(parse_report)
+        page_elements, reference_mode_global = _parse_page(doc[page_num - 1], page_num, reference_mode_global, parse_report)
+        stores.append(page_elements)
+        _mark_page_parsed(parse_report, page_num, before, page_stats)
+    return ElementStore.concat(stores), reference_mode_global
+
+
+# _parse_page 逐页累加的 ParseReport 计数器
+_PAGE_COUNTERS = ("scanned_pages", "multi_column_pages", "visual_elements_count")
+
+
+def _page_counters(parse_report: ParseReport) -> List[int]:
+    return [getattr(parse_report, k) for k in _PAGE_COUNTERS]
+
+
+def _mark_page_parsed(
+    parse_report: ParseReport,
+    page_num: int,
+    before: Optional[List[int]] = None,
+    page_stats: Optional[List[List[int]]] = None,
+) -> None:
+    parse_report.pages_parsed += 1
+    parse_report.last_page_parsed = page_num
+    if page_stats is not None and before is not None:
+        page_stats.append([page_num] + [a - b for a, b in zip(_page_counters(parse_report), before)])
+
+
+def _parse_page(
+    page: Any, page_num: int, reference_mode_global: bool, parse_report: ParseReport
+) -> Tuple[ElementStore, bool]:
+    elements = ElementStoreBuilder()
+    page_rect = page.rect
+    page_content = extract_page_content(page)
+    scanned = page_content.scanned
+    if scanned:
+        parse_report.scanned_pages += 1
+    blocks = page_content.blocks
+    page_has_any_images = page_content.has_image_blocks
+    columns = split_columns(blocks, page_rect.width)
+    if len(columns) > 1:
+        parse_report.multi_column_pages += 1
+
+    # CV Analysis Integration
+    visual_lines = []
+    if scanned:
+        try:
+            img = page_to_image(page)
+            gray = to_gray(img)
+            visual_lines = detect_text_lines(gray)
+            parse_report.visual_elements_count += len(visual_lines)
+        except Exception:
+            pass
+
+    body_size = _safe_median(page_content.font_sizes, default=10.0)
+    reference_mode = reference_mode_global
+    if columns:
+        if len(columns) > 1:
+            text_blocks = _sort_blocks(columns[0]) + _sort_blocks(columns[1])
+        else:
+            text_blocks = _sort_blocks(columns[0])
+    else:
+        text_blocks = _sort_blocks([b for b in blocks if b.get("type") == 0])
+    if not text_blocks:
+        # Use CV to check for scanned content
+        if visual_lines and len(visual_lines) > 5:
+            elements.add("scanned_content", "[SCANNED_CONTENT_DETECTED]", [0.0, 0.0, 1.0, 1.0], page_num, "main")
+        else:
+            elements.add("image", "", [0.0, 0.0, page_rect.width, page_rect.height], page_num, "main")
+        return elements.build(), reference_mode_global
+    page_has_caption = False
+    caption_lines: List[Tuple[List[float], str]] = []
+    pending_caption = None
+
+    def _union_bbox(a: List[float], b: List[float]) -> List[float]:
+        return [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+
+    def _is_caption_continuation(t: str) -> bool:
+        s = (t or "").strip()
+        if not s:
+            return False
+        if is_reference_title(s) or is_caption(s):
+            return False
+        if is_heading_text(s) or is_formula_text(s):
+            return False
+        if re.fullmatch(r"第\s*\d+\s*页", s):
+            return False
+        if re.search(r"[。！？]$", s):
+            return False
+        if len(s) < 4 or len(s) > 90:
+            return False
+        return True
+
+    def _flush_caption():
+        nonlocal pending_caption
+        if not pending_caption:
+            return
+        caption_lines.append((pending_caption["bbox"], pending_caption["text"]))
+        elements.add("title", pending_caption["text"], pending_caption["bbox"], page_num, "chart")
+        pending_caption = None
+
+    for block in text_blocks:
+        block_bbox = _bbox_from_rect(block.get("bbox", (0, 0, 0, 0)))
+        for line in block.get("lines", []):
+            text = line.get("text", "")
+            if not text:
+                continue
+            line_bbox = _bbox_from_rect(line.get("bbox", block_bbox))
+            max_size = line.get("max_size", 0.0)
+            if pending_caption:
+                if pending_caption.get("lines", 1) < 3 and _is_caption_continuation(text):
+                    pending_caption["bbox"] = _union_bbox(pending_caption["bbox"], line_bbox)
+                    pending_caption["text"] = (pending_caption["text"] + " " + text).strip()
+                    pending_caption["lines"] = int(pending_caption.get("lines", 1)) + 1
+                    continue
+                _flush_caption()
+            if is_reference_title(text):
+                reference_mode = True
+                reference_mode_global = True
+                elements.add("title", text, line_bbox, page_num, "reference")
+                continue
+            if is_caption(text):
+                page_has_caption = True
+                pending_caption = {"bbox": line_bbox, "text": text, "lines": 1}
+                continue
+            region = classify_line_region(text, max_size, body_size, reference_mode)
+            citations = _find_citations(text)
+            if citations:
+                for c in citations:
+                    elements.add("citation", c, line_bbox, page_num, "citation")
+            if region == "formula":
+                elements.add("formula", text, line_bbox, page_num, "formula")
+                continue
+            if region == "title":
+                elements.add("title", text, line_bbox, page_num, "title")
+                continue
+            region = "reference" if reference_mode else "main"
+            elements.add("text", text, line_bbox, page_num, region)
+    _flush_caption()
+    if page_has_caption and not page_has_any_images:
+        drawing_regions = extract_drawing_regions(page)
+        if drawing_regions:
+            used = set()
+            figure_caption_pat = re.compile(r"^\s*(?:图|Figure|Fig\.?)\s*", flags=re.IGNORECASE)
+            table_caption_pat = re.compile(r"^\s*(?:表|Table)\s*", flags=re.IGNORECASE)
+            for cap_bbox, cap_text in caption_lines:
+                cap_w = max(1.0, cap_bbox[2] - cap_bbox[0])
+                is_figure = bool(figure_caption_pat.match(cap_text or ""))
+                is_table = bool(table_caption_pat.match(cap_text or ""))
+                best = None
+                best_score = None
+                for x0, y0, x1, y1 in drawing_regions:
+                    key = (round(x0, 1), round(y0, 1), round(x1, 1), round(y1, 1))
+                    if key in used:
+                        continue
+                    overlap = min(cap_bbox[2], x1) - max(cap_bbox[0], x0)
+                    if overlap <= 0:
+                        continue
+                    r_w = max(1.0, x1 - x0)
+                    if overlap < min(cap_w, r_w) * 0.2:
+                        continue
+                    tol = 6.0
+                    if is_figure and y0 > cap_bbox[3] + tol:
+                        continue
+                    if is_table and y1 < cap_bbox[1] - tol:
+                        continue
+                    if y1 <= cap_bbox[1]:
+                        dy = cap_bbox[1] - y1
+                    elif y0 >= cap_bbox[3]:
+                        dy = y0 - cap_bbox[3]
+                    else:
+                        dy = 0.0
+                    score = dy * 1000.0 + abs((cap_bbox[0] + cap_bbox[2]) / 2.0 - (x0 + x1) / 2.0)
+                    if best_score is None or score < best_score:
+                        best_score = score
+                        best = (x0, y0, x1, y1, key)
+                if best is not None:
+                    x0, y0, x1, y1, key = best
+                    used.add(key)
+                    elements.add("image", "", [x0, y0, x1, y1], page_num, "chart")
+            if not used:
+                x0, y0, x1, y1 = max(drawing_regions, key=lambda r: (r[2] - r[0]) * (r[3] - r[1]))
+                elements.add("image", "", [x0, y0, x1, y1], page_num, "chart")
+    for block in blocks:
+        if block.get("type") == 1:
+            image_bbox = _bbox_from_rect(block.get("bbox", (0, 0, 0, 0)))
+            elements.add("image", "", image_bbox, page_num, "chart")
+    return elements.build(), reference_mode_global
+
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_workers = 0
+_parse_pool_lock = threading.Lock()
+
+
+def _init_parse_worker() -> None:
+    # 预热：worker 进程启动时即导入 PyMuPDF，避免首个分片承担导入开销
+    import fitz  # noqa: F401
+
+
+def _parse_pool_context():
+    # 进程池在多线程的服务进程中懒创建（to_thread 线程里），fork 可能让子进程继承被其它线程持有的锁而死锁；
+    # 改用 forkserver（不支持的平台用 spawn），worker 由 _init_parse_worker 预热
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def get_parse_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    获取进程级常驻解析进程池；worker 数变化时重建。
+    """
+    global _parse_pool, _parse_pool_workers
+    with _parse_pool_lock:
+        if _parse_pool is None or _parse_pool_workers != workers:
+            if _parse_pool is not None:
+                _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=_parse_pool_context(), initializer=_init_parse_worker
+            )
+            _parse_pool_workers = workers
+        return _parse_pool
+
+
+def shutdown_parse_pool() -> None:
+    global _parse_pool, _parse_pool_workers
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=True, cancel_futures=True)
+        _parse_pool = None
+        _parse_pool_workers = 0
+
+
+@contextmanager
+def _shared_source(pdf_payload: Any) -> Iterator[str]:
+    """
+    为 worker 提供可重新打开的 PDF 路径：已有文件直接复用；字节/base64 内容落盘为临时文件，
+    由各 worker 通过操作系统页缓存共享，而非逐分片序列化整份 PDF。
+    """
+    if isinstance(pdf_payload, str) and os.path.exists(pdf_payload):
+        yield pdf_payload
+        return
+    if isinstance(pdf_payload, (bytes, bytearray)):
+        data = bytes(pdf_payload)
+    else:
+        data = base64.b64decode(str(pdf_payload), validate=True)
+    fd, path = tempfile.mkstemp(suffix=".pdf", prefix="layout_shard_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        yield path
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class _AliveFlag:
+    """分片 worker 的取消标记：主进程删除该文件后，worker 在下一页边界停止（接口与 threading.Event.is_set 一致）"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def is_set(self) -> bool:
+        return not os.path.exists(self.path)
+
+
+def _parse_shard_worker(
+    pdf_path: str, page_nums: List[int], reference_mode_global: bool, alive_path: Optional[str] = None
+) -> Dict[str, Any]:
+    parse_report = ParseReport()
+    page_stats: List[List[int]] = []
+    cancel = _AliveFlag(alive_path) if alive_path else None
+    doc = open_pdf(pdf_path)
+    try:
+        elements, reference_seen = _parse_pages(doc, page_nums, reference_mode_global, parse_report, cancel, page_stats)
+    finally:
+        doc.close()
+    return {
+        "elements": elements,
+        "reference_seen": bool(reference_seen),
+        "parse_report": parse_report.model_dump(),
+        "page_stats": page_stats,
+    }
+
+
+def _wait_shard(fut: Any, cancel: Optional[threading.Event]) -> Optional[Dict[str, Any]]:
+    if cancel is None:
+        return fut.result()
+    while not fut.done():
+        if cancel.is_set():
+            return None
+        try:
+            return fut.result(timeout=0.2)
+        except FuturesTimeoutError:
+            continue
+    return fut.result()
+
+
+def _resolve_parse_input(content: Any) -> Tuple[Any, Optional[set]]:
+    page_set = None
+    pdf_payload = content
+    if isinstance(content, dict):
+        pdf_payload = (
+            content.get("pdf_path")
+            or content.get("pdf")
+            or content.get("path")
+            or content.get("content")
+        )
+        pages = content.get("pages") or content.get("page_nums") or content.get("page_numbers")
+        if pages:
+            try:
+                page_set = {int(p) for p in pages if int(p) > 0}
+            except Exception:
+                page_set = None
+    elif isinstance(content, (tuple, list)) and len(content) == 2:
+        pdf_payload, pages = content[0], content[1]
+        if pages:
+            try:
+                page_set = {int(p) for p in pages if int(p) > 0}
+            except Exception:
+                page_set = None
+    return pdf_payload, page_set
+
+
+def _encode_parse_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    elements = result.get("elements")
+    if not isinstance(elements, ElementStore):
+        elements = ElementStore.from_rows(elements or [])
+    encoded = {
+        "elements": elements.to_table(),
+        "parse_errors": result.get("parse_errors", []),
+        "parse_report": result.get("parse_report", {}),
+    }
+    if result.get("page_stats") is not None:
+        encoded["page_stats"] = result["page_stats"]
+    return encoded
+
+
+def _decode_parse_result(data: Dict[str, Any]) -> Dict[str, Any]:
+    decoded = {
+        "elements": ElementStore.from_table(data.get("elements") or {}),
+        "parse_errors": list(data.get("parse_errors", [])),
+        "parse_report": dict(data.get("parse_report", {})),
+    }
+    if data.get("page_stats") is not None:
+        decoded["page_stats"] = [list(row) for row in data["page_stats"]]
+    return decoded
+
+
+def _replay_page_reports(result: Dict[str, Any]) -> Optional[List[Tuple[int, Dict[str, Any]]]]:
+    """
+    由缓存中的逐页计数增量重建与现场解析一致的逐页累计报告：[(page_num, parse_report)]。
+    旧缓存条目没有逐页数据时返回 None（调用方改为现场解析）。
+    """
+    page_stats = result.get("page_stats")
+    if page_stats is None:
+        return None
+    final = result["parse_report"]
+    report = ParseReport(encrypted=bool(final.get("encrypted")), page_count=int(final.get("page_count") or 0))
+    out = []
+    for page_num, *deltas in page_stats:
+        for key, delta in zip(_PAGE_COUNTERS, deltas):
+            setattr(report, key, getattr(report, key) + int(delta))
+        _mark_page_parsed(report, int(page_num))
+        out.append((int(page_num), report.model_dump()))
+    return out
 
-    async def parse(self, content: Any) -> Dict[str, Any]:
-        return await asyncio.to_thread(self._parse_sync, content)
 
-    def _parse_sync(self, content: Any) -> Dict[str, Any]:
+class PDFParser:
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        shard_pages: Optional[int] = None,
+        cache: Optional[LayoutParseCache] = layout_parse_cache,
+    ):
+        self.workers = int(LAYOUT_PARSE_WORKERS if workers is None else workers)
+        self.shard_pages = max(1, int(LAYOUT_PARSE_SHARD_PAGES if shard_pages is None else shard_pages))
+        self.cache = cache
+
+    async def parse(self, content: Any, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._parse_sync, content, cancel)
+
+    async def iter_pages(self, content: Any, cancel: Optional[threading.Event] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式解析：逐页产出 {"page_num", "elements", "parse_errors", "parse_report"}。
+        解析在后台线程进行，消费方处理已产出页面的同时后续页面继续解析；
+        parse_report 为截至当前页的累计值，最后一批即为全文结果。
+        PDF 无法打开或已加密时只产出一批 page_num 为 None 的空结果；
+        cancel 被置位时在页边界停止，并以一批 page_num 为 None、parse_report.partial 为 True 的结果收尾。
+        流式模式逐页串行解析，不走分片进程池；命中缓存时按页回放。
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def _emit(item: Any) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        def _produce() -> None:
+            try:
+                self._iter_pages_sync(content, _emit, stop, cancel)
+            except Exception as exc:
+                _emit(exc)
+            finally:
+                _emit(done)
+
+        worker = asyncio.ensure_future(asyncio.to_thread(_produce))
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            await asyncio.shield(worker)
+
+    def _iter_pages_sync(
+        self,
+        content: Any,
+        emit: Callable[[Dict[str, Any]], None],
+        stop: threading.Event,
+        cancel: Optional[threading.Event] = None,
+    ) -> None:
+        pdf_payload, page_set = _resolve_parse_input(content)
+        cache_key = self._cache_key(pdf_payload, page_set)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            result = _decode_parse_result(cached) if cached is not None else None
+            replay = _replay_page_reports(result) if result is not None else None
+            if replay is not None:
+                # 与现场解析相同：每页（含无元素的页）带截至该页的累计报告
+                by_page = result["elements"].by_page()
+                for page_num, page_report in replay:
+                    emit({
+                        "page_num": page_num,
+                        "elements": by_page.get(page_num) or ElementStore.empty(),
+                        "parse_errors": result["parse_errors"],
+                        "parse_report": page_report,
+                    })
+                if not replay:
+                    emit({
+                        "page_num": None,
+                        "elements": ElementStore.empty(),
+                        "parse_errors": result["parse_errors"],
+                        "parse_report": result["parse_report"],
+                    })
+                return
         parse_errors = []
         parse_report = ParseReport()
-        page_set = None
-        pdf_payload = content
-        if isinstance(content, dict):
-            pdf_payload = (
-                content.get("pdf_path")
-                or content.get("pdf")
-                or content.get("path")
-                or content.get("content")
-            )
-            pages = content.get("pages") or content.get("page_nums") or content.get("page_numbers")
-            if pages:
-                try:
-                    page_set = {int(p) for p in pages if int(p) > 0}
-                except Exception:
-                    page_set = None
-        elif isinstance(content, (tuple, list)) and len(content) == 2:
-            pdf_payload, pages = content[0], content[1]
-            if pages:
-                try:
-                    page_set = {int(p) for p in pages if int(p) > 0}
-                except Exception:
-                    page_set = None
         try:
             doc = open_pdf(pdf_payload)
         except Exception as exc:
             parse_errors.append(ParseError(error_type="invalid_pdf", message=str(exc)).model_dump())
-            return {"elements": [], "parse_errors": parse_errors, "parse_report": parse_report.model_dump()}
+            emit({"page_num": None, "elements": ElementStore.empty(), "parse_errors": parse_errors, "parse_report": parse_report.model_dump()})
+            return
         if is_encrypted(doc):
             parse_report.encrypted = True
             parse_errors.append(ParseError(error_type="encrypted_pdf", message="pdf is encrypted").model_dump())
-            return {"elements": [], "parse_errors": parse_errors, "parse_report": parse_report.model_dump()}
-        elements: List[VisualElement] = []
+            emit({"page_num": None, "elements": ElementStore.empty(), "parse_errors": parse_errors, "parse_report": parse_report.model_dump()})
+            return
+        page_stores: List[ElementStore] = []
+        page_stats: List[List[int]] = []
         reference_mode_global = False
-        for page_index in range(len(doc)):
-            page = doc[page_index]
-            page_num = page_index + 1
-            if page_set is not None and page_num not in page_set:
-                continue
-            page_rect = page.rect
-            scanned = is_scanned_page(page)
-            if scanned:
-                parse_report.scanned_pages += 1
-            blocks = extract_blocks(page)
-            page_has_image_blocks = any(b.get("type") == 1 for b in blocks)
-            try:
-                page_has_raster_images = bool(page.get_images(full=True))
-            except Exception:
-                page_has_raster_images = False
-            page_has_any_images = page_has_image_blocks or page_has_raster_images
-            columns = split_columns(blocks, page_rect.width)
-            if len(columns) > 1:
-                parse_report.multi_column_pages += 1
-
-            # CV Analysis Integration
-            visual_lines = []
-            if scanned:
-                try:
-                    img = page_to_image(page)
-                    gray = to_gray(img)
-                    visual_lines = detect_text_lines(gray)
-                    parse_report.visual_elements_count += len(visual_lines)
-                except Exception:
-                    pass
-
-            font_sizes = []
-            for b in blocks:
-                if b.get("type") != 0:
-                    continue
-                for line in b.get("lines", []):
-                    size = _max_font_size(line)
-                    if size > 0:
-                        font_sizes.append(size)
-            body_size = _safe_median(font_sizes, default=10.0)
-            reference_mode = reference_mode_global
-            if columns:
-                if len(columns) > 1:
-                    text_blocks = _sort_blocks(columns[0]) + _sort_blocks(columns[1])
-                else:
-                    text_blocks = _sort_blocks(columns[0])
-            else:
-                text_blocks = _sort_blocks([b for b in blocks if b.get("type") == 0])
-            if not text_blocks:
-                # Use CV to check for scanned content
-                if visual_lines and len(visual_lines) > 5:
-                    elements.append(
-                        VisualElement(
-                            type="scanned_content",
-                            content="[SCANNED_CONTENT_DETECTED]",
-                            bbox=[0.0, 0.0, 1.0, 1.0],
-                            page_num=page_num,
-                            region="main",
-                        )
-                    )
-                else:
-                    elements.append(
-                        VisualElement(
-                            type="image",
-                            content="",
-                            bbox=[0.0, 0.0, page_rect.width, page_rect.height],
-                            page_num=page_num,
-                            region="main",
-                        )
-                    )
-                continue
-            page_has_caption = False
-            caption_lines: List[Tuple[List[float], str]] = []
-            pending_caption = None
-
-            def _union_bbox(a: List[float], b: List[float]) -> List[float]:
-                return [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
-
-            def _is_caption_continuation(t: str) -> bool:
-                s = (t or "").strip()
-                if not s:
-                    return False
-                if is_reference_title(s) or is_caption(s):
-                    return False
-                if is_heading_text(s) or is_formula_text(s):
-                    return False
-                if re.fullmatch(r"第\s*\d+\s*页", s):
-                    return False
-                if re.search(r"[。！？]$", s):
-                    return False
-                if len(s) < 4 or len(s) > 90:
-                    return False
-                return True
-
-            def _flush_caption():
-                nonlocal pending_caption
-                if not pending_caption:
+        try:
+            parse_report.page_count = len(doc)
+            page_nums = [
+                i + 1 for i in range(len(doc)) if page_set is None or (i + 1) in page_set
+            ]
+            for page_num in page_nums:
+                if stop.is_set():
                     return
-                caption_lines.append((pending_caption["bbox"], pending_caption["text"]))
-                elements.append(
-                    VisualElement(
-                        type="title",
-                        content=pending_caption["text"],
-                        bbox=pending_caption["bbox"],
-                        page_num=page_num,
-                        region="chart",
-                    )
+                if cancel is not None and cancel.is_set():
+                    parse_report.partial = True
+                    break
+                before = _page_counters(parse_report)
+                page_elements, reference_mode_global = _parse_page(
+                    doc[page_num - 1], page_num, reference_mode_global, parse_report
                 )
-                pending_caption = None
+                page_stores.append(page_elements)
+                _mark_page_parsed(parse_report, page_num, before, page_stats)
+                emit({
+                    "page_num": page_num,
+                    "elements": page_elements,
+                    "parse_errors": parse_errors,
+                    "parse_report": parse_report.model_dump(),
+                })
+            if not page_nums or parse_report.partial:
+                emit({"page_num": None, "elements": ElementStore.empty(), "parse_errors": parse_errors, "parse_report": parse_report.model_dump()})
+        finally:
+            doc.close()
+        if cache_key is not None and not parse_report.partial:
+            self.cache.put(
+                cache_key,
+                _encode_parse_result({
+                    "elements": ElementStore.concat(page_stores),
+                    "parse_errors": parse_errors,
+                    "parse_report": parse_report.model_dump(),
+                    "page_stats": page_stats,
+                }),
+            )
 
-            for block in text_blocks:
-                block_bbox = _bbox_from_rect(block.get("bbox", (0, 0, 0, 0)))
-                for line in block.get("lines", []):
-                    text = _text_from_line(line)
-                    if not text:
-                        continue
-                    line_bbox = _bbox_from_rect(line.get("bbox", block_bbox))
-                    max_size = _max_font_size(line)
-                    if pending_caption:
-                        if pending_caption.get("lines", 1) < 3 and _is_caption_continuation(text):
-                            pending_caption["bbox"] = _union_bbox(pending_caption["bbox"], line_bbox)
-                            pending_caption["text"] = (pending_caption["text"] + " " + text).strip()
-                            pending_caption["lines"] = int(pending_caption.get("lines", 1)) + 1
-                            continue
-                        _flush_caption()
-                    if is_reference_title(text):
-                        reference_mode = True
-                        reference_mode_global = True
-                        elements.append(
-                            VisualElement(
-                                type="title",
-                                content=text,
-                                bbox=line_bbox,
-                                page_num=page_num,
-                                region="reference",
-                            )
-                        )
-                        continue
-                    if is_caption(text):
-                        page_has_caption = True
-                        pending_caption = {"bbox": line_bbox, "text": text, "lines": 1}
-                        continue
-                    region = classify_line_region(text, max_size, body_size, reference_mode)
-                    citations = _find_citations(text)
-                    if citations:
-                        for c in citations:
-                            elements.append(
-                                VisualElement(
-                                    type="citation",
-                                    content=c,
-                                    bbox=line_bbox,
-                                    page_num=page_num,
-                                    region="citation",
-                                )
-                            )
-                    if region == "formula":
-                        elements.append(
-                            VisualElement(
-                                type="formula",
-                                content=text,
-                                bbox=line_bbox,
-                                page_num=page_num,
-                                region="formula",
-                            )
-                        )
-                        continue
-                    if region == "title":
-                        elements.append(
-                            VisualElement(
-                                type="title",
-                                content=text,
-                                bbox=line_bbox,
-                                page_num=page_num,
-                                region="title",
-                            )
-                        )
-                        continue
-                    region = "reference" if reference_mode else "main"
-                    elements.append(
-                        VisualElement(
-                            type="text",
-                            content=text,
-                            bbox=line_bbox,
-                            page_num=page_num,
-                            region=region,
-                        )
-                    )
-            _flush_caption()
-            if page_has_caption and not page_has_any_images:
-                drawing_regions = extract_drawing_regions(page)
-                if drawing_regions:
-                    used = set()
-                    figure_caption_pat = re.compile(r"^\s*(?:图|Figure|Fig\.?)\s*", flags=re.IGNORECASE)
-                    table_caption_pat = re.compile(r"^\s*(?:表|Table)\s*", flags=re.IGNORECASE)
-                    for cap_bbox, cap_text in caption_lines:
-                        cap_w = max(1.0, cap_bbox[2] - cap_bbox[0])
-                        is_figure = bool(figure_caption_pat.match(cap_text or ""))
-                        is_table = bool(table_caption_pat.match(cap_text or ""))
-                        best = None
-                        best_score = None
-                        for x0, y0, x1, y1 in drawing_regions:
-                            key = (round(x0, 1), round(y0, 1), round(x1, 1), round(y1, 1))
-                            if key in used:
-                                continue
-                            overlap = min(cap_bbox[2], x1) - max(cap_bbox[0], x0)
-                            if overlap <= 0:
-                                continue
-                            r_w = max(1.0, x1 - x0)
-                            if overlap < min(cap_w, r_w) * 0.2:
-                                continue
-                            tol = 6.0
-                            if is_figure and y0 > cap_bbox[3] + tol:
-                                continue
-                            if is_table and y1 < cap_bbox[1] - tol:
-                                continue
-                            if y1 <= cap_bbox[1]:
-                                dy = cap_bbox[1] - y1
-                            elif y0 >= cap_bbox[3]:
-                                dy = y0 - cap_bbox[3]
-                            else:
-                                dy = 0.0
-                            score = dy * 1000.0 + abs((cap_bbox[0] + cap_bbox[2]) / 2.0 - (x0 + x1) / 2.0)
-                            if best_score is None or score < best_score:
-                                best_score = score
-                                best = (x0, y0, x1, y1, key)
-                        if best is not None:
-                            x0, y0, x1, y1, key = best
-                            used.add(key)
-                            elements.append(
-                                VisualElement(
-                                    type="image",
-                                    content="",
-                                    bbox=[x0, y0, x1, y1],
-                                    page_num=page_num,
-                                    region="chart",
-                                )
-                            )
-                    if not used:
-                        x0, y0, x1, y1 = max(drawing_regions, key=lambda r: (r[2] - r[0]) * (r[3] - r[1]))
-                        elements.append(
-                            VisualElement(
-                                type="image",
-                                content="",
-                                bbox=[x0, y0, x1, y1],
-                                page_num=page_num,
-                                region="chart",
-                            )
-                        )
-            for block in blocks:
-                if block.get("type") == 1:
-                    image_bbox = _bbox_from_rect(block.get("bbox", (0, 0, 0, 0)))
-                    elements.append(
-                        VisualElement(
-                            type="image",
-                            content="",
-                            bbox=image_bbox,
-                            page_num=page_num,
-                            region="chart",
-                        )
-                    )
+    def _parse_sync(self, content: Any, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        pdf_payload, page_set = _resolve_parse_input(content)
+        cache_key = self._cache_key(pdf_payload, page_set)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                result = _decode_parse_result(cached)
+                result.pop("page_stats", None)
+                return result
+        result = self._parse_uncached(pdf_payload, page_set, cancel)
+        if cache_key is not None and not result.get("parse_errors") and not result["parse_report"].get("partial"):
+            self.cache.put(cache_key, _encode_parse_result(result))
+        result.pop("page_stats", None)
+        return result
+
+    def _cache_key(self, pdf_payload: Any, page_set: Optional[set]) -> Optional[str]:
+        if self.cache is None:
+            return None
+        digest = pdf_sha256(pdf_payload)
+        return make_cache_key(digest, page_set) if digest else None
+
+    def _parse_uncached(
+        self, pdf_payload: Any, page_set: Optional[set], cancel: Optional[threading.Event] = None
+    ) -> Dict[str, Any]:
+        parse_errors = []
+        parse_report = ParseReport()
+        try:
+            doc = open_pdf(pdf_payload)
+        except Exception as exc:
+            parse_errors.append(ParseError(error_type="invalid_pdf", message=str(exc)).model_dump())
+            return {"elements": ElementStore.empty(), "parse_errors": parse_errors, "parse_report": parse_report.model_dump()}
+        if is_encrypted(doc):
+            parse_report.encrypted = True
+            parse_errors.append(ParseError(error_type="encrypted_pdf", message="pdf is encrypted").model_dump())
+            return {"elements": ElementStore.empty(), "parse_errors": parse_errors, "parse_report": parse_report.model_dump()}
+        try:
+            page_count = len(doc)
+            parse_report.page_count = page_count
+            page_nums = [
+                i + 1 for i in range(page_count) if page_set is None or (i + 1) in page_set
+            ]
+            page_stats: List[List[int]] = []
+            if self._should_shard(len(page_nums)):
+                try:
+                    elements = self._parse_sharded(pdf_payload, page_nums, parse_report, cancel, page_stats)
+                    return {
+                        "elements": elements,
+                        "parse_errors": parse_errors,
+                        "parse_report": parse_report.model_dump(),
+                        "page_stats": page_stats,
+                    }
+                except Exception as exc:
+                    logger.warning(f"sharded parse failed, falling back to serial: {exc!r}")
+                    parse_report = ParseReport(page_count=page_count)
+                    page_stats = []
+            elements, _ = _parse_pages(doc, page_nums, False, parse_report, cancel, page_stats)
+        finally:
+            doc.close()
         return {
             "elements": elements,
             "parse_errors": parse_errors,
             "parse_report": parse_report.model_dump(),
+            "page_stats": page_stats,
         }
 
+    def _should_shard(self, page_count: int) -> bool:
+        if self.workers <= 1:
+            return False
+        return page_count >= max(LAYOUT_PARSE_MIN_PAGES, self.shard_pages + 1)
+
+    def _parse_sharded(
+        self,
+        pdf_payload: Any,
+        page_nums: List[int],
+        parse_report: ParseReport,
+        cancel: Optional[threading.Event] = None,
+        page_stats: Optional[List[List[int]]] = None,
+    ) -> ElementStore:
+        """
+        将页码切分为若干分片，投递到常驻进程池并行解析，再按页序合并。
+        分片默认以非参考文献模式起步；若前序分片出现“参考文献”标题，则后续分片以参考文献模式重算，
+        保证与串行解析的 reference_mode_global 语义一致。
+        cancel 被置位后不再等待剩余分片，只合并已完成且结果有效的前缀分片；
+        排队中的分片直接取消，运行中的分片 worker 通过删除 alive 标记文件在下一页边界停止。
+        """
+        shards = [page_nums[i:i + self.shard_pages] for i in range(0, len(page_nums), self.shard_pages)]
+        pool = get_parse_pool(self.workers)
+        partial = False
+        fd, alive = tempfile.mkstemp(prefix="layout_shards_", suffix=".alive")
+        os.close(fd)
+        try:
+            with _shared_source(pdf_payload) as source:
+                futures = [pool.submit(_parse_shard_worker, source, shard, False, alive) for shard in shards]
+                results = []
+                for fut in futures:
+                    r = _wait_shard(fut, cancel)
+                    if r is None:
+                        break
+                    results.append(r)
+                ref_idx = next((i for i, r in enumerate(results) if r["reference_seen"]), None)
+                if len(results) < len(shards):
+                    partial = True
+                    if ref_idx is not None:
+                        results = results[:ref_idx + 1]
+                elif ref_idx is not None and ref_idx + 1 < len(shards):
+                    redo = {
+                        i: pool.submit(_parse_shard_worker, source, shards[i], True, alive)
+                        for i in range(ref_idx + 1, len(shards))
+                    }
+                    futures.extend(redo.values())
+                    for i, fut in redo.items():
+                        r = _wait_shard(fut, cancel)
+                        if r is None:
+                            partial = True
+                            results = results[:i]
+                            break
+                        results[i] = r
+                if partial:
+                    for fut in futures:
+                        fut.cancel()
+        finally:
+            # 通知仍在运行的分片 worker 停止（正常结束时已没有运行中的分片）
+            try:
+                os.unlink(alive)
+            except OSError:
+                pass
+        for r in results:
+            if page_stats is not None:
+                page_stats.extend(r.get("page_stats") or [])
+            for key, value in r["parse_report"].items():
+                if key in ("encrypted", "partial", "page_count", "last_page_parsed"):
+                    continue
+                setattr(parse_report, key, getattr(parse_report, key) + int(value or 0))
+        if results:
+            parse_report.last_page_parsed = results[-1]["parse_report"].get("last_page_parsed")
+        parse_report.partial = partial
+        return ElementStore.concat([r["elements"] for r in results])
+
     def _identify_zones(self, page_obj):
         return None
 
@@ -453,22 +806,306 @@ class PDFParser:
         return []
 
 
+_FORMULA_NUM_PAT = r"\d+(?:\s*[-.−–—－]\s*\d+)*"
+
+
+def _norm_formula_num(n: str) -> str:
+    if not n:
+        return ""
+    s = re.sub(r"\s+", "", str(n))
+    for ch in "−–—－":
+        s = s.replace(ch, "-")
+    if re.fullmatch(r"\d+(?:-\d+)+", s):
+        s = s.replace("-", ".")
+    return s
+
+
+def _is_display_formula(text: str) -> bool:
+    s = (text or "").strip()
+    if not s:
+        return False
+    if re.search(rf"(（|\()({_FORMULA_NUM_PAT})(）|\))\s*$", s):
+        return True
+    if ":=" in s:
+        return False
+    if re.search(r"[；;。;]\s*$", s):
+        return False
+    if re.search(r"[\(\[（【\{⟨<]\s*$", s):
+        return False
+    if re.match(r"^\s*\d+\s*:\s*\S", s):
+        return False
+    if re.match(r"^\s*\d+\)\s+\S", s):
+        return False
+    if re.match(r"^\s*\d+\s*且\s+\S", s):
+        return False
+    if re.match(r"^[^\d\s\(\)【】\[\]\{\}<>]{1,2}\s*[:：]\s*\S", s):
+        return False
+    if re.search(r"[∧∨¬⇒⇔]", s):
+        return False
+    if re.search(r"(其中|定义|我们|令|则|即|表示)", s):
+        return False
+    if re.fullmatch(r"!\([^)]*\)", s):
+        return False
+    if re.fullmatch(r"\[\s*!\([^)]*\)\s*\]", s):
+        return False
+    if "⟨" in s and "⟩" not in s:
+        return False
+    if "⟩" in s and "⟨" not in s:
+        return False
+    if "{" in s and "}" not in s:
+        return False
+    if "}" in s and "{" not in s:
+        return False
+    if re.search(r"⟨[^⟩]+⟩", s) and "," in s:
+        return False
+    if "←" in s:
+        return False
+    if re.match(r"^\s*算法\s*\d", s):
+        return False
+    if "。" in s:
+        return False
+    if "˙" in s:
+        return False
+    # Exclude likely code patterns
+    if re.search(r"(\[\]|\{\}|return\s|def\s|class\s|import\s|print\()", s):
+        return False
+    if re.search(r"[=<>≤≥±×÷*/+\-≈≠]\s*$", s):
+        return False
+    cn = len(re.findall(r"[\u4e00-\u9fff]", s))
+    if cn / max(len(s), 1) > 0.15:
+        return False
+    if "," in s and s.count("=") >= 2 and not re.search(r"[∧∨¬⇒⇔∑∫√]", s):
+        parts = [p.strip() for p in re.split(r"[,，]", s) if p.strip()]
+        if len(parts) >= 2 and all("=" in p for p in parts):
+            return False
+    if re.fullmatch(r"\S+\s*(?:≤|≥|<|>)\s*\S+(?:\s*[+\-−–—]\s*\d+(?:\.\d+)?)?", s):
+        return False
+    if re.fullmatch(r"[A-Za-zα-ωΑ-Ω]\w{0,3}\s*[≤≥<>]=?\s*-?\d+(?:\.\d+)?", s):
+        return False
+    if re.fullmatch(r"[A-Za-zα-ωΑ-Ω]\w{0,2}", s):
+        return False
+    if re.fullmatch(r"[∑∫√α-ωΑ-Ω∂∇∞≈≠≤≥±×÷]", s):
+        return False
+    if len(s) <= 6:
+        return False
+    # Exclude scientific notation like "5 × 102" or "1.28 × 106"
+    if re.fullmatch(r"[\d\.]+\s*[×xX*]\s*10\s*[-−]?\d+", s):
+        return False
+    # Exclude simple assignment or property access like "T=0.2" or "H=0.85"
+    if re.fullmatch(r"[A-Za-z]+\s*=\s*[\d\.]+", s):
+        return False
+    # Exclude simple numbers with units or simple arithmetic
+    if re.fullmatch(r"[\d\.]+\s*[+\-−–—]\s*[\d\.]+", s):
+        return False
+    # Exclude trailing assignments without complex formula features (e.g. "布，H=0.85")
+    if re.search(r"[\u4e00-\u9fff]\s*[,，]?\s*[A-Za-z]+\s*=\s*[\d\.]+$", s):
+        return False
+    # Exclude Chinese text that might end up with weird math-like symbols due to OCR or parsing
+    if "，" in s or "。" in s or "、" in s or "：" in s:
+        return False
+
+    if re.search(r"[=<>≤≥±×÷*/+\-≈≠]", s):
+        return True
+    if re.search(r"[∑∫√∂∇∞]", s):
+        return True
+    if re.search(r"(\\[a-zA-Z]+|\^|\{.*\})", s):
+        return True
+    return False
+
+
+def _is_caption_element(e: VisualElement) -> bool:
+    return (e.type == "chart") or (e.type == "title" and is_caption(e.content))
+
+
+_CAPTION_NUM_PAT = re.compile(r"^\s*(?:图|表|Figure|Fig\.?|Table)\s*([0-9]+(?:\s*[-.−–—－]\s*[0-9]+)*)", flags=re.IGNORECASE)
+# Require a boundary before/after 图/表/Figure/Table to avoid matching inside words like “代表”
+_CHART_REF_PAT = re.compile(
+    r"(?<![\u4e00-\u9fffA-Za-z0-9])(?:图|表|(?<![A-Za-z])(?:Figure|Fig\.?|Table)(?![A-Za-z]))\s*([0-9]+(?:\s*[-.−–—－]\s*[0-9]+)*)",
+    flags=re.IGNORECASE,
+)
+_FIGURE_CAPTION_PAT = re.compile(r"^\s*(?:图|Figure|Fig\.?)\s*", flags=re.IGNORECASE)
+_TABLE_CAPTION_PAT = re.compile(r"^\s*(?:表|Table)\s*", flags=re.IGNORECASE)
+_SUBFIGURE_CAPTION_PAT = re.compile(r"^\s*(?:图|Figure|Fig\.?)\s*[（(]?\s*[A-Za-z]\s*[)）]", flags=re.IGNORECASE)
+_TOC_DOTS_PAT = re.compile(r"[\.·…]{5,}\s*\d+\s*$")
+_FORMULA_NUM_ONLY_PAT = re.compile(rf"^\s*(?:（|\()({_FORMULA_NUM_PAT})(?:）|\))\s*$")
+_FORMULA_NUM_END_PAT = re.compile(rf"(（|\()({_FORMULA_NUM_PAT})(）|\))\s*$")
+_FORMULA_REF_CN_PAT = re.compile(rf"(?:式|公式)\s*(?:（|\()?\s*({_FORMULA_NUM_PAT})\s*(?:）|\))?")
+_FORMULA_REF_EN_PAT = re.compile(rf"(?:Eq\.?|Equation)\s*(?:\(|（)?\s*({_FORMULA_NUM_PAT})\s*(?:\)|）)?", flags=re.IGNORECASE)
+_FORMULA_REF_PAREN_PAT = re.compile(rf"(?:（|\()({_FORMULA_NUM_PAT})(?:）|\))")
+_CHAPTER_ONLY_PAT = re.compile(r"^第[0-9一二三四五六七八九十百千两零]+章$")
+
+
+def _norm_label_num(value: str) -> str:
+    s = (value or "").strip()
+    if not s:
+        return ""
+    s = re.sub(r"\s+", "", s)
+    for ch in ("−", "–", "—", "－"):
+        s = s.replace(ch, "-")
+    s = s.replace(".", "-")
+    if s.endswith("."):
+        s = s[:-1]
+    return s
+
+
+class ElementIndex:
+    """
+    一份文档（或一页）元素的预计算索引：按类型/区域/页分组、页面范围、图表标题及其编号、行间公式等。
+    由 VisualValidator 在校验开始时构建一次，各项检查只做查表，避免反复扫描全部元素。
+    """
+
+    def __init__(self, elements: Any):
+        self.elements = list(elements)
+        self.by_type: Dict[str, List[Any]] = {}
+        self.by_region: Dict[str, List[Any]] = {}
+        self.by_page: Dict[int, List[Any]] = {}
+        self.page_max_x: Dict[int, float] = {}
+        self.page_max_y: Dict[int, float] = {}
+        self.captions: List[Any] = []
+        self.captions_by_page: Dict[int, List[Any]] = {}
+        self.images_by_page: Dict[int, List[Any]] = {}
+        self.scanned_pages = set()
+        for e in self.elements:
+            page_num = e.page_num
+            self.by_type.setdefault(e.type, []).append(e)
+            self.by_region.setdefault(e.region, []).append(e)
+            self.by_page.setdefault(page_num, []).append(e)
+            x1, y1 = e.bbox[2], e.bbox[3]
+            if page_num not in self.page_max_x or x1 > self.page_max_x[page_num]:
+                self.page_max_x[page_num] = x1
+            if page_num not in self.page_max_y or y1 > self.page_max_y[page_num]:
+                self.page_max_y[page_num] = y1
+            if _is_caption_element(e):
+                self.captions.append(e)
+                self.captions_by_page.setdefault(int(page_num or 0), []).append(e)
+            if e.type == "image":
+                self.images_by_page.setdefault(int(page_num or 0), []).append(e)
+            elif e.type == "scanned_content":
+                self.scanned_pages.add(page_num)
+        self.caption_numbers = set()
+        for c in self.captions:
+            m = _CAPTION_NUM_PAT.match(c.content or "")
+            if m and m.group(1):
+                norm = _norm_label_num(m.group(1))
+                if norm:
+                    self.caption_numbers.add(norm)
+        self._display_formulas: Optional[List[Any]] = None
+        self._formula_num_labels: Optional[Dict[int, List[Tuple[Any, str]]]] = None
+
+    def of_type(self, type_name: str) -> List[Any]:
+        return self.by_type.get(type_name, [])
+
+    def in_region(self, region: str) -> List[Any]:
+        return self.by_region.get(region, [])
+
+    def page(self, page_num: int) -> List[Any]:
+        return self.by_page.get(page_num, [])
+
+    @property
+    def display_formulas(self) -> List[Any]:
+        if self._display_formulas is None:
+            self._display_formulas = [e for e in self.of_type("formula") if _is_display_formula(e.content)]
+        return self._display_formulas
+
+    @property
+    def formula_num_labels(self) -> Dict[int, List[Tuple[Any, str]]]:
+        """单独成行的公式编号 “(1)” 按页分组，保持元素顺序"""
+        if self._formula_num_labels is None:
+            labels: Dict[int, List[Tuple[Any, str]]] = {}
+            for e in self.elements:
+                if e.type not in {"text", "title", "formula"}:
+                    continue
+                m = _FORMULA_NUM_ONLY_PAT.match(e.content or "")
+                if m:
+                    labels.setdefault(e.page_num, []).append((e, _norm_formula_num(m.group(1))))
+            self._formula_num_labels = labels
+        return self._formula_num_labels
+
+
+class _ValidatorSettings:
+    """从规则中解析出的校验参数，每个规则版本只解析一次"""
+
+    def __init__(self, rules: Dict[str, Any]):
+        figure = rules.get("figure_table_check", {})
+        self.fig_caption_pos = figure.get("caption_requirement", "bottom")
+        self.table_caption_pos = figure.get("table_caption_requirement", "top")
+        self.min_figure_area_ratio = float(figure.get("min_figure_area_ratio", 0.03))
+        formula = rules.get("formula_check", {})
+        self.numbering_pos = formula.get("numbering", "right")
+        self.require_numbering = bool(formula.get("require_numbering", False))
+        self.missing_severity = formula.get("missing_severity", "Warning")
+        self.check_reference = bool(formula.get("check_reference", False))
+        self.unref_ratio_threshold = float(formula.get("unreferenced_ratio_threshold", 0.0) or 0.0)
+        self.min_unref_count = int(formula.get("min_unreferenced_count", 0) or 0)
+        heading = rules.get("heading_check", {})
+        self.max_depth = heading.get("max_depth", 4)
+        self.continuity_check = bool(heading.get("continuity_check", False))
+        self.continuity_severity = heading.get("continuity_severity", "Info")
+        self.column_threshold = float(heading.get("column_threshold", 200.0))
+
+
 class VisualValidator:
     def __init__(self):
         self.rules = {}
+        self.rules_version = 0
+        self._settings: Optional[_ValidatorSettings] = None
+        self._settings_key: Optional[Tuple[int, int]] = None
 
     def update_rules(self, rules: Dict[str, Any]):
         self.rules = rules
+        self.rules_version += 1
+
+    @property
+    def settings(self) -> _ValidatorSettings:
+        # 直接替换 self.rules 的调用方同样生效
+        key = (self.rules_version, id(self.rules))
+        if self._settings is None or self._settings_key != key:
+            self._settings = _ValidatorSettings(self.rules or {})
+            self._settings_key = key
+        return self._settings
 
     async def validate(self, elements: List[VisualElement]) -> Dict[str, Any]:
         return await asyncio.to_thread(self._validate_sync, elements)
 
     def _validate_sync(self, elements: List[VisualElement]) -> Dict[str, Any]:
-        issues = []
-        issues.extend(self._check_charts(elements))
-        issues.extend(self._check_formulas(elements))
-        issues.extend(self._check_titles(elements))
-        issues.extend(self._check_citations(elements))
+        index = ElementIndex(elements)
+        return self._finalize_sync(elements, [self._check_page_sync(elements, index)], index)
+
+    def _check_page_sync(self, page_elements: List[VisualElement], index: Optional[ElementIndex] = None) -> Dict[str, Any]:
+        """
+        页内检查：图标题位置、图片配题、公式编号与对齐。
+        只依赖同页元素，流式解析时每产出一页即可执行。
+        """
+        if index is None:
+            index = ElementIndex(page_elements)
+        return {
+            "caption_placement": self._check_caption_placement(index),
+            "image_captions": self._check_image_captions(index),
+            "has_caption": bool(index.captions),
+            "formula_records": self._formula_records(index),
+        }
+
+    def _finalize_sync(
+        self,
+        elements: List[VisualElement],
+        page_parts: List[Dict[str, Any]],
+        index: Optional[ElementIndex] = None,
+    ) -> Dict[str, Any]:
+        """
+        全局检查（图表引用、公式引用、标题连续性、引用与参考文献匹配），
+        并按整篇校验时的顺序合并逐页结果，保证流式与整篇两种模式输出一致。
+        """
+        if index is None:
+            index = ElementIndex(elements)
+        issues = self._check_chart_refs(index)
+        for part in page_parts:
+            issues.extend(part["caption_placement"])
+        if any(part["has_caption"] for part in page_parts):
+            for part in page_parts:
+                issues.extend(part["image_captions"])
+        issues.extend(self._formula_issues([r for part in page_parts for r in part["formula_records"]], index))
+        issues.extend(self._check_titles(index))
+        issues.extend(self._check_citations(index))
         return {"layout_issues": self._dedupe_issues(issues)}
 
     def _dedupe_issues(self, issues: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -496,47 +1133,14 @@ class VisualValidator:
             out.append(issue)
         return out
 
-    def _check_charts(self, elements: List[VisualElement]) -> List[Dict[str, Any]]:
+    def _check_chart_refs(self, index: ElementIndex) -> List[Dict[str, Any]]:
+        """正文中的图表编号引用须能在全文图表标题中找到（全局检查）"""
         issues = []
-        rule_config = self.rules.get("figure_table_check", {})
-        fig_caption_pos = rule_config.get("caption_requirement", "bottom")
-        table_caption_pos = rule_config.get("table_caption_requirement", "top")
-        min_figure_area_ratio = float(rule_config.get("min_figure_area_ratio", 0.03))
-
-        def _norm_label_num(value: str) -> str:
-            s = (value or "").strip()
-            if not s:
-                return ""
-            s = re.sub(r"\s+", "", s)
-            for ch in ("−", "–", "—", "－"):
-                s = s.replace(ch, "-")
-            s = s.replace(".", "-")
-            if s.endswith("."):
-                s = s[:-1]
-            return s
-
-        caption_num_pat = re.compile(r"^\s*(?:图|表|Figure|Fig\.?|Table)\s*([0-9]+(?:\s*[-.−–—－]\s*[0-9]+)*)", flags=re.IGNORECASE)
-        # Require a boundary before/after 图/表/Figure/Table to avoid matching inside words like “代表”
-        ref_pat = re.compile(
-            r"(?<![\u4e00-\u9fffA-Za-z0-9])(?:图|表|(?<![A-Za-z])(?:Figure|Fig\.?|Table)(?![A-Za-z]))\s*([0-9]+(?:\s*[-.−–—－]\s*[0-9]+)*)",
-            flags=re.IGNORECASE,
-        )
-        figure_caption_pat = re.compile(r"^\s*(?:图|Figure|Fig\.?)\s*", flags=re.IGNORECASE)
-        table_caption_pat = re.compile(r"^\s*(?:表|Table)\s*", flags=re.IGNORECASE)
-
-        captions = [e for e in elements if (e.type == "chart") or (e.type == "title" and is_caption(e.content))]
-        images = [e for e in elements if e.type == "image"]
-        text_refs = [e for e in elements if e.type == "text" and (getattr(e, "region", "") or "") != "reference"]
-        caption_nums = set()
-        for c in captions:
-            m = caption_num_pat.match(c.content or "")
-            if m and m.group(1):
-                norm = _norm_label_num(m.group(1))
-                if norm:
-                    caption_nums.add(norm)
+        caption_nums = index.caption_numbers
+        text_refs = [e for e in index.of_type("text") if (getattr(e, "region", "") or "") != "reference"]
         for t in text_refs:
             text_content = t.content or ""
-            for m in ref_pat.finditer(text_content):
+            for m in _CHART_REF_PAT.finditer(text_content):
                 raw_num = m.group(1) or ""
                 end_pos = m.end(1)
                 next_ch = text_content[end_pos:end_pos + 1]
@@ -561,29 +1165,25 @@ class VisualValidator:
                             "location": {"page": t.page_num, "bbox": t.bbox}
                         }
                     )
+        return issues
 
-        captions_by_page: Dict[int, List[VisualElement]] = {}
-        for c in captions:
-            captions_by_page.setdefault(int(getattr(c, "page_num", 0) or 0), []).append(c)
-        has_any_caption = bool(captions)
-
-        images_by_page: Dict[int, List[VisualElement]] = {}
-        for img in images:
-            images_by_page.setdefault(int(getattr(img, "page_num", 0) or 0), []).append(img)
+    def _check_caption_placement(self, index: ElementIndex) -> List[Dict[str, Any]]:
+        """图标题相对同页图片的位置（页内检查）"""
+        issues = []
+        fig_caption_pos = self.settings.fig_caption_pos
 
-        for c in captions:
-            is_figure = bool(figure_caption_pat.match(c.content or ""))
-            is_table = bool(table_caption_pat.match(c.content or ""))
+        for c in index.captions:
+            is_figure = bool(_FIGURE_CAPTION_PAT.match(c.content or ""))
+            is_table = bool(_TABLE_CAPTION_PAT.match(c.content or ""))
             
-            same_page_images = [i for i in images if i.page_num == c.page_num]
+            same_page_images = index.images_by_page.get(int(c.page_num or 0), [])
             
             if is_figure:
                 if not same_page_images:
                     continue
                 
-                page_elements = [e for e in elements if e.page_num == c.page_num]
-                max_y = max((e.bbox[3] for e in page_elements), default=842.0)
-                max_x = max((e.bbox[2] for e in page_elements), default=595.0)
+                max_y = index.page_max_y.get(c.page_num, 842.0)
+                max_x = index.page_max_x.get(c.page_num, 595.0)
                 c_mid_x = (c.bbox[0] + c.bbox[2]) / 2.0
                 tol_y = 6.0
 
@@ -632,16 +1232,31 @@ class VisualValidator:
 
             if is_table:
                 pass
+        return issues
 
-        if not has_any_caption:
-            return issues
-
-        for page_num, page_images in images_by_page.items():
-            page_elements = [e for e in elements if e.page_num == page_num]
-            if any(getattr(e, "type", "") == "scanned_content" for e in page_elements):
+    def _check_image_captions(self, index: ElementIndex) -> List[Dict[str, Any]]:
+        """同页图片是否配有图标题（页内检查；全文无任何图表标题时由 _finalize_sync 整体丢弃）"""
+        issues = []
+        settings = self.settings
+        fig_caption_pos = settings.fig_caption_pos
+        table_caption_pos = settings.table_caption_pos
+        min_figure_area_ratio = settings.min_figure_area_ratio
+        figure_caption_pat = _FIGURE_CAPTION_PAT
+        table_caption_pat = _TABLE_CAPTION_PAT
+        captions_by_page = index.captions_by_page
+
+        def _truncate(s: str, n: int = 120) -> str:
+            t = re.sub(r"\s+", " ", (s or "")).strip()
+            if len(t) <= n:
+                return t
+            return t[: max(0, n - 1)] + "…"
+
+        for page_num, page_images in index.images_by_page.items():
+            if page_num in index.scanned_pages:
                 continue
-            max_x = max((e.bbox[2] for e in page_elements if getattr(e, "bbox", None)), default=595.0)
-            max_y = max((e.bbox[3] for e in page_elements if getattr(e, "bbox", None)), default=842.0)
+            page_elements = index.page(page_num)
+            max_x = index.page_max_x.get(page_num, 595.0)
+            max_y = index.page_max_y.get(page_num, 842.0)
             page_area = max(1.0, float(max_x) * float(max_y))
             page_captions = captions_by_page.get(page_num, [])
             figure_captions = [c for c in page_captions if figure_caption_pat.match(c.content or "")]
@@ -668,26 +1283,29 @@ class VisualValidator:
                         except Exception:
                             continue
 
-            def _truncate(s: str, n: int = 120) -> str:
-                t = re.sub(r"\s+", " ", (s or "")).strip()
-                if len(t) <= n:
-                    return t
-                return t[: max(0, n - 1)] + "…"
+            # 每页只筛一次候选文本，各图片复用
+            text_pool: List[Tuple[Any, str]] = []
+            subcap_pool: List[Tuple[Any, str]] = []
+            for e in page_elements:
+                if getattr(e, "type", "") not in {"text", "title", "chart"}:
+                    continue
+                if (getattr(e, "region", "") or "") == "reference":
+                    continue
+                txt = (getattr(e, "content", "") or "").strip()
+                if not txt:
+                    continue
+                if _SUBFIGURE_CAPTION_PAT.match(txt):
+                    subcap_pool.append((e, txt))
+                if is_reference_title(txt):
+                    continue
+                if _TOC_DOTS_PAT.search(txt):
+                    continue
+                text_pool.append((e, txt))
+            implicit_pool = [(e, txt) for e, txt in text_pool if e.type in {"text", "title"} and is_caption(txt)]
 
             def _nearby_text(img_el: VisualElement, prefer: str) -> str:
                 candidates: List[Tuple[float, str]] = []
-                for e in page_elements:
-                    if getattr(e, "type", "") not in {"text", "title", "chart"}:
-                        continue
-                    if (getattr(e, "region", "") or "") == "reference":
-                        continue
-                    txt = (getattr(e, "content", "") or "").strip()
-                    if not txt:
-                        continue
-                    if is_reference_title(txt):
-                        continue
-                    if re.search(r"[\.·…]{5,}\s*\d+\s*$", txt):
-                        continue
+                for e, txt in text_pool:
                     overlap = min(e.bbox[2], img_el.bbox[2]) - max(e.bbox[0], img_el.bbox[0])
                     if overlap <= 0:
                         continue
@@ -709,20 +1327,7 @@ class VisualValidator:
 
             def _implicit_caption(img_el: VisualElement) -> Optional[Tuple[VisualElement, str]]:
                 candidates: List[Tuple[float, VisualElement, str]] = []
-                for e in page_elements:
-                    if getattr(e, "type", "") not in {"text", "title"}:
-                        continue
-                    if (getattr(e, "region", "") or "") == "reference":
-                        continue
-                    txt = (getattr(e, "content", "") or "").strip()
-                    if not txt:
-                        continue
-                    if is_reference_title(txt):
-                        continue
-                    if re.search(r"[\.·…]{5,}\s*\d+\s*$", txt):
-                        continue
-                    if not is_caption(txt):
-                        continue
+                for e, txt in implicit_pool:
                     overlap = min(e.bbox[2], img_el.bbox[2]) - max(e.bbox[0], img_el.bbox[0])
                     if overlap <= 0:
                         continue
@@ -745,19 +1350,8 @@ class VisualValidator:
                 _, best_e, pos = candidates[0]
                 return best_e, pos
 
-            subcap_pat = re.compile(r"^\s*(?:图|Figure|Fig\.?)\s*[（(]?\s*[A-Za-z]\s*[)）]", flags=re.IGNORECASE)
-
             def _has_subfigure_caption(img_el: VisualElement) -> bool:
-                for e in page_elements:
-                    if getattr(e, "type", "") not in {"text", "title", "chart"}:
-                        continue
-                    if (getattr(e, "region", "") or "") == "reference":
-                        continue
-                    txt = (getattr(e, "content", "") or "").strip()
-                    if not txt:
-                        continue
-                    if not subcap_pat.match(txt):
-                        continue
+                for e, _ in subcap_pool:
                     overlap = min(e.bbox[2], img_el.bbox[2]) - max(e.bbox[0], img_el.bbox[0])
                     if overlap <= 0:
                         continue
@@ -770,6 +1364,8 @@ class VisualValidator:
                         return True
                 return False
 
+            text_count: Optional[int] = None
+
             for img in page_images:
                 try:
                     key = (round(float(img.bbox[0]), 1), round(float(img.bbox[1]), 1), round(float(img.bbox[2]), 1), round(float(img.bbox[3]), 1))
@@ -835,7 +1431,8 @@ class VisualValidator:
                 if img_area_ratio >= 0.6:
                     x0, y0, x1, y1 = img.bbox
                     near_edges = (x0 <= float(max_x) * 0.05 and x1 >= float(max_x) * 0.95 and y0 <= float(max_y) * 0.10 and y1 >= float(max_y) * 0.90)
-                    text_count = len([e for e in page_elements if getattr(e, "type", "") in {"text", "title", "citation", "chart", "formula"} and (getattr(e, "region", "") or "") != "reference"])
+                    if text_count is None:
+                        text_count = len([e for e in page_elements if getattr(e, "type", "") in {"text", "title", "citation", "chart", "formula"} and (getattr(e, "region", "") or "") != "reference"])
                     if near_edges and text_count >= 15:
                         continue
                 if key is not None and key in covered:
@@ -920,156 +1517,29 @@ class VisualValidator:
                     )
         return issues
 
-    def _check_formulas(self, elements: List[VisualElement]) -> List[Dict[str, Any]]:
-        issues = []
-        rule_config = self.rules.get("formula_check", {})
-        numbering_pos = rule_config.get("numbering", "right")
-        require_numbering = bool(rule_config.get("require_numbering", False))
-        check_reference = bool(rule_config.get("check_reference", False))
-        unref_ratio_threshold = float(rule_config.get("unreferenced_ratio_threshold", 0.0) or 0.0)
-        min_unref_count = int(rule_config.get("min_unreferenced_count", 0) or 0)
-        missing_severity = rule_config.get("missing_severity", "Warning")
-        num_pat = r"\d+(?:\s*[-.−–—－]\s*\d+)*"
-        dash_chars = "−–—－"
-
-        def _norm_num(n: str) -> str:
-            if not n:
-                return ""
-            s = re.sub(r"\s+", "", str(n))
-            for ch in dash_chars:
-                s = s.replace(ch, "-")
-            if re.fullmatch(r"\d+(?:-\d+)+", s):
-                s = s.replace("-", ".")
-            return s
-
-        def _is_display_formula(text: str) -> bool:
-            s = (text or "").strip()
-            if not s:
-                return False
-            if re.search(rf"(（|\()({num_pat})(）|\))\s*$", s):
-                return True
-            if ":=" in s:
-                return False
-            if re.search(r"[；;。;]\s*$", s):
-                return False
-            if re.search(r"[\(\[（【\{⟨<]\s*$", s):
-                return False
-            if re.match(r"^\s*\d+\s*:\s*\S", s):
-                return False
-            if re.match(r"^\s*\d+\)\s+\S", s):
-                return False
-            if re.match(r"^\s*\d+\s*且\s+\S", s):
-                return False
-            if re.match(r"^[^\d\s\(\)【】\[\]\{\}<>]{1,2}\s*[:：]\s*\S", s):
-                return False
-            if re.search(r"[∧∨¬⇒⇔]", s):
-                return False
-            if re.search(r"(其中|定义|我们|令|则|即|表示)", s):
-                return False
-            if re.fullmatch(r"!\([^)]*\)", s):
-                return False
-            if re.fullmatch(r"\[\s*!\([^)]*\)\s*\]", s):
-                return False
-            if "⟨" in s and "⟩" not in s:
-                return False
-            if "⟩" in s and "⟨" not in s:
-                return False
-            if "{" in s and "}" not in s:
-                return False
-            if "}" in s and "{" not in s:
-                return False
-            if re.search(r"⟨[^⟩]+⟩", s) and "," in s:
-                return False
-            if "←" in s:
-                return False
-            if re.match(r"^\s*算法\s*\d", s):
-                return False
-            if "。" in s:
-                return False
-            if "˙" in s:
-                return False
-            # Exclude likely code patterns
-            if re.search(r"(\[\]|\{\}|return\s|def\s|class\s|import\s|print\()", s):
-                return False
-            if re.search(r"[=<>≤≥±×÷*/+\-≈≠]\s*$", s):
-                return False
-            cn = len(re.findall(r"[\u4e00-\u9fff]", s))
-            if cn / max(len(s), 1) > 0.15:
-                return False
-            if "," in s and s.count("=") >= 2 and not re.search(r"[∧∨¬⇒⇔∑∫√]", s):
-                parts = [p.strip() for p in re.split(r"[,，]", s) if p.strip()]
-                if len(parts) >= 2 and all("=" in p for p in parts):
-                    return False
-            if re.fullmatch(r"\S+\s*(?:≤|≥|<|>)\s*\S+(?:\s*[+\-−–—]\s*\d+(?:\.\d+)?)?", s):
-                return False
-            if re.fullmatch(r"[A-Za-zα-ωΑ-Ω]\w{0,3}\s*[≤≥<>]=?\s*-?\d+(?:\.\d+)?", s):
-                return False
-            if re.fullmatch(r"[A-Za-zα-ωΑ-Ω]\w{0,2}", s):
-                return False
-            if re.fullmatch(r"[∑∫√α-ωΑ-Ω∂∇∞≈≠≤≥±×÷]", s):
-                return False
-            if len(s) <= 6:
-                return False
-            # Exclude scientific notation like "5 × 102" or "1.28 × 106"
-            if re.fullmatch(r"[\d\.]+\s*[×xX*]\s*10\s*[-−]?\d+", s):
-                return False
-            # Exclude simple assignment or property access like "T=0.2" or "H=0.85"
-            if re.fullmatch(r"[A-Za-z]+\s*=\s*[\d\.]+", s):
-                return False
-            # Exclude simple numbers with units or simple arithmetic
-            if re.fullmatch(r"[\d\.]+\s*[+\-−–—]\s*[\d\.]+", s):
-                return False
-            # Exclude trailing assignments without complex formula features (e.g. "布，H=0.85")
-            if re.search(r"[\u4e00-\u9fff]\s*[,，]?\s*[A-Za-z]+\s*=\s*[\d\.]+$", s):
-                return False
-            # Exclude Chinese text that might end up with weird math-like symbols due to OCR or parsing
-            if "，" in s or "。" in s or "、" in s or "：" in s:
-                return False
-            
-            if re.search(r"[=<>≤≥±×÷*/+\-≈≠]", s):
-                return True
-            if re.search(r"[∑∫√∂∇∞]", s):
-                return True
-            if re.search(r"(\\[a-zA-Z]+|\^|\{.*\})", s):
-                return True
-            return False
-
-        formulas = [e for e in elements if e.type == "formula" and _is_display_formula(e.content)]
+    def _formula_records(self, index: ElementIndex) -> List[Dict[str, Any]]:
+        """
+        识别行间公式及其编号，并检查编号缺失与对齐（页内检查）。
+        编号是否被正文引用依赖全文，留给 _formula_issues 判定。
+        """
+        settings = self.settings
+        numbering_pos = settings.numbering_pos
+        require_numbering = settings.require_numbering
+        missing_severity = settings.missing_severity
+        formulas = index.display_formulas
         if not formulas:
-            return issues
-        page_max_x = {}
-        page_max_y = {}
-        for e in elements:
-            page_max_x[e.page_num] = max(page_max_x.get(e.page_num, 0), e.bbox[2])
-            page_max_y[e.page_num] = max(page_max_y.get(e.page_num, 0), e.bbox[3])
-        text_refs = [e for e in elements if e.type == "text"]
-        ref_nums = set()
-        for t in text_refs:
-            for m in re.finditer(rf"(?:式|公式)\s*(?:（|\()?\s*({num_pat})\s*(?:）|\))?", t.content):
-                ref_nums.add(_norm_num(m.group(1)))
-            for m in re.finditer(rf"(?:Eq\.?|Equation)\s*(?:\(|（)?\s*({num_pat})\s*(?:\)|）)?", t.content, flags=re.IGNORECASE):
-                ref_nums.add(_norm_num(m.group(1)))
-            for m in re.finditer(rf"(?:（|\()({num_pat})(?:）|\))", t.content):
-                raw = m.group(1)
-                if not re.search(r"[-.−–—－]", raw):
-                    continue
-                ref_nums.add(_norm_num(raw))
-        num_only_pat = re.compile(rf"^\s*(?:（|\()({num_pat})(?:）|\))\s*$")
-        page_num_only = {}
-        for e in elements:
-            if e.type not in {"text", "title", "formula"}:
-                continue
-            m = num_only_pat.match(e.content or "")
-            if not m:
-                continue
-            page_num_only.setdefault(e.page_num, []).append((e, _norm_num(m.group(1))))
-        total_numbered = 0
+            return []
+        # 与逐元素从 0 取最大值的旧口径一致
+        page_max_x = {p: max(0, v) for p, v in index.page_max_x.items()}
+        page_max_y = {p: max(0, v) for p, v in index.page_max_y.items()}
+        page_num_only = index.formula_num_labels
+        records: List[Dict[str, Any]] = []
         for f in formulas:
             num = None
             num_bbox: Optional[List[float]] = None
-            m_end = re.search(rf"(（|\()({num_pat})(）|\))\s*$", f.content)
+            m_end = _FORMULA_NUM_END_PAT.search(f.content)
             if m_end:
-                num = _norm_num(m_end.group(2))
+                num = _norm_formula_num(m_end.group(2))
                 num_bbox = f.bbox
             else:
                 # Fallback: check if the number is at the beginning (left-aligned case) or just separated
@@ -1106,12 +1576,14 @@ class VisualValidator:
                             best = num
                             best_bbox = e.bbox
                     if best is not None:
-                        num = _norm_num(best)
+                        num = _norm_formula_num(best)
                         num_bbox = best_bbox
             
+            record: Dict[str, Any] = {"formula": f, "num": num or None, "issues": []}
+            records.append(record)
             if not num:
                 if require_numbering:
-                    issues.append(
+                    record["issues"].append(
                         {
                             "issue_type": "Formula_Missing",
                             "severity": missing_severity,
@@ -1123,27 +1595,13 @@ class VisualValidator:
                         }
                     )
                 continue
-            total_numbered += 1
-            if check_reference and num not in ref_nums:
-                issues.append(
-                    {
-                        "issue_type": "Formula_Ref_Missing",
-                        "severity": "Info",
-                        "page_num": f.page_num,
-                        "bbox": f.bbox,
-                        "evidence": f.content,
-                        "message": "公式编号未在正文引用中出现",
-                        "location": {"page": f.page_num, "bbox": f.bbox},
-                        "_internal_formula_ref_missing": True,
-                    }
-                )
             max_x = page_max_x.get(f.page_num, f.bbox[2])
             
             # Dynamic Rule Check: Formula Numbering
             if numbering_pos == "right":
                 check_bbox = num_bbox or f.bbox
                 if check_bbox[2] < max_x * 0.6:
-                    issues.append(
+                    record["issues"].append(
                         {
                             "issue_type": "Formula_Misaligned",
                             "severity": "Warning",
@@ -1158,7 +1616,7 @@ class VisualValidator:
                 # Assuming left margin is near 0
                  check_bbox = num_bbox or f.bbox
                  if check_bbox[0] > max_x * 0.15: # Simple heuristic
-                    issues.append(
+                    record["issues"].append(
                         {
                             "issue_type": "Formula_Misaligned",
                             "severity": "Warning",
@@ -1169,6 +1627,50 @@ class VisualValidator:
                             "location": {"page": f.page_num, "bbox": f.bbox}
                         }
                     )
+        return records
+
+    def _formula_issues(self, records: List[Dict[str, Any]], index: ElementIndex) -> List[Dict[str, Any]]:
+        """汇总公式问题；编号是否在正文中被引用需要全文文本，因此在最后一页解析完成后判定"""
+        issues = []
+        if not records:
+            return issues
+        settings = self.settings
+        check_reference = settings.check_reference
+        unref_ratio_threshold = settings.unref_ratio_threshold
+        min_unref_count = settings.min_unref_count
+
+        ref_nums = set()
+        if check_reference:
+            for t in index.of_type("text"):
+                for m in _FORMULA_REF_CN_PAT.finditer(t.content):
+                    ref_nums.add(_norm_formula_num(m.group(1)))
+                for m in _FORMULA_REF_EN_PAT.finditer(t.content):
+                    ref_nums.add(_norm_formula_num(m.group(1)))
+                for m in _FORMULA_REF_PAREN_PAT.finditer(t.content):
+                    raw = m.group(1)
+                    if not re.search(r"[-.−–—－]", raw):
+                        continue
+                    ref_nums.add(_norm_formula_num(raw))
+        total_numbered = 0
+        for record in records:
+            f = record["formula"]
+            num = record["num"]
+            if num:
+                total_numbered += 1
+                if check_reference and num not in ref_nums:
+                    issues.append(
+                        {
+                            "issue_type": "Formula_Ref_Missing",
+                            "severity": "Info",
+                            "page_num": f.page_num,
+                            "bbox": f.bbox,
+                            "evidence": f.content,
+                            "message": "公式编号未在正文引用中出现",
+                            "location": {"page": f.page_num, "bbox": f.bbox},
+                            "_internal_formula_ref_missing": True,
+                        }
+                    )
+            issues.extend(record["issues"])
         if check_reference and total_numbered > 0:
             unref_count = sum(1 for i in issues if i.get("_internal_formula_ref_missing"))
             ratio = unref_count / float(total_numbered)
@@ -1185,22 +1687,18 @@ class VisualValidator:
                         i.pop("_internal_formula_ref_missing", None)
         return issues
 
-    def _check_titles(self, elements: List[VisualElement]) -> List[Dict[str, Any]]:
+    def _check_titles(self, index: ElementIndex) -> List[Dict[str, Any]]:
         issues = []
-        rule_config = self.rules.get("heading_check", {})
-        max_depth = rule_config.get("max_depth", 4)
-        continuity_check = bool(rule_config.get("continuity_check", False))
-        continuity_severity = rule_config.get("continuity_severity", "Info")
-        column_threshold = float(rule_config.get("column_threshold", 200.0))
-
-        page_max_y: Dict[int, float] = {}
-        for e in elements:
-            if not getattr(e, "bbox", None):
-                continue
-            page_max_y[e.page_num] = max(page_max_y.get(e.page_num, 0.0), float(e.bbox[3]))
+        settings = self.settings
+        max_depth = settings.max_depth
+        continuity_check = settings.continuity_check
+        continuity_severity = settings.continuity_severity
+        column_threshold = settings.column_threshold
+
+        page_max_y: Dict[int, float] = {p: max(0.0, float(v)) for p, v in index.page_max_y.items()}
 
         heading_candidate_pos: Dict[str, Tuple[int, float, float]] = {}
-        for e in elements:
+        for e in index.elements:
             if not getattr(e, "bbox", None):
                 continue
             max_y = page_max_y.get(e.page_num, 842.0) or 842.0
@@ -1221,14 +1719,14 @@ class VisualValidator:
             if key not in heading_candidate_pos or pos < heading_candidate_pos[key]:
                 heading_candidate_pos[key] = pos
 
-        titles = [e for e in elements if e.type == "title" and e.region == "title"]
+        titles = [e for e in index.of_type("title") if e.region == "title"]
         title_text_counts: Dict[str, int] = {}
         for t in titles:
             key = re.sub(r"\s+", "", (t.content or "")).strip()
             if not key:
                 continue
             title_text_counts[key] = title_text_counts.get(key, 0) + 1
-        chapter_only_pat = re.compile(r"^第[0-9一二三四五六七八九十百千两零]+章$")
+        chapter_only_pat = _CHAPTER_ONLY_PAT
         titles = sorted(
             titles,
             key=lambda e: (
@@ -1340,10 +1838,8 @@ class VisualValidator:
             prev_heading = (curr, curr_parts)
         return issues
 
-    def _check_citations(self, elements: List[VisualElement]) -> List[Dict[str, Any]]:
-        citations = [e for e in elements if e.type == "citation"]
-        references = [e for e in elements if e.region == "reference"]
-        issues = check_citation_reference_match(citations, references)
+    def _check_citations(self, index: ElementIndex) -> List[Dict[str, Any]]:
+        issues = check_citation_reference_match(index.of_type("citation"), index.in_region("reference"))
         return [issue.model_dump() for issue in issues]
 
 
@@ -1355,14 +1851,113 @@ class LayoutAnalyzer:
     def update_rules(self, rules: Dict[str, Any]):
         self.validator.update_rules(rules)
 
-    async def analyze(self, content: Any) -> Dict[str, Any]:
-        parse_result = await self.parser.parse(content)
+    async def analyze(
+        self,
+        content: Any,
+        page_hook: Optional[Callable[[List[VisualElement]], Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        page_hook: 可选的页内检查（如标点检查），在每页元素产出后于工作线程中执行，
+        其逐页返回值按页序放入结果的 page_hook_results。
+        timeout: 解析时间预算（秒）。到期后解析在页边界停止，已解析页面照常校验并返回，
+        parse_report 记录 partial / pages_parsed / last_page_parsed，parse_errors 追加 layout_timeout。
+        调用方取消本协程时同样会通知解析线程停止，不再继续占用 CPU。
+        """
+        cancel = threading.Event()
+        timer = asyncio.get_running_loop().call_later(timeout, cancel.set) if timeout else None
+        try:
+            if LAYOUT_STREAMING and self.parser.workers <= 1:
+                result = await self._analyze_streaming(content, page_hook, cancel)
+            else:
+                result = await self._analyze_batch(content, page_hook, cancel)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            cancel.set()
+        parse_report = result.get("parse_report") or {}
+        if parse_report.get("partial"):
+            logger.warning(
+                f"layout analysis timeout, returning partial result "
+                f"({parse_report.get('pages_parsed', 0)}/{parse_report.get('page_count', 0)} pages)"
+            )
+            result["parse_errors"] = list(result.get("parse_errors", [])) + [
+                ParseError(
+                    error_type="layout_timeout",
+                    message=f"layout analysis timeout, parsed up to page {parse_report.get('last_page_parsed') or 0}",
+                    page_num=parse_report.get("last_page_parsed"),
+                ).model_dump()
+            ]
+        return result
+
+    async def _analyze_batch(
+        self,
+        content: Any,
+        page_hook: Optional[Callable[[List[VisualElement]], Any]] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> Dict[str, Any]:
+        parse_result = await self.parser.parse(content, cancel)
         elements = parse_result.get("elements", [])
         validation_result = await self.validator.validate(elements)
         validation_result["layout_issues"] = with_anchor(validation_result.get("layout_issues", []))
-        return {
+        result = {
             "elements": elements,
             "layout_result": validation_result,
             "parse_errors": parse_result.get("parse_errors", []),
             "parse_report": parse_result.get("parse_report", {}),
         }
+        if page_hook is not None:
+            try:
+                result["page_hook_results"] = [await asyncio.to_thread(page_hook, elements)]
+            except Exception as e:
+                logger.error(f"layout page hook failed: {e!r}")
+        return result
+
+    async def _analyze_streaming(
+        self,
+        content: Any,
+        page_hook: Optional[Callable[[List[VisualElement]], Any]] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> Dict[str, Any]:
+        """
+        边解析边校验：页内检查随每页产出立即执行，
+        图表/公式引用、标题连续性、引用-参考文献匹配等全局检查在最后一页后执行。
+        """
+        page_stores: List[ElementStore] = []
+        page_parts: List[Dict[str, Any]] = []
+        hook_results: Optional[List[Any]] = [] if page_hook is not None else None
+        parse_errors: List[Dict[str, Any]] = []
+        parse_report: Dict[str, Any] = {}
+
+        def _check_page(page_elements: List[VisualElement]) -> Dict[str, Any]:
+            nonlocal hook_results
+            part = self.validator._check_page_sync(page_elements)
+            if hook_results is not None:
+                try:
+                    hook_results.append(page_hook(page_elements))
+                except Exception as e:
+                    # 页内钩子失败时放弃其全部结果，由调用方按整篇方式重做
+                    logger.error(f"layout page hook failed: {e!r}")
+                    hook_results = None
+            return part
+
+        async for batch in self.parser.iter_pages(content, cancel):
+            parse_errors = batch.get("parse_errors", [])
+            parse_report = batch.get("parse_report", {})
+            page_elements = batch.get("elements", [])
+            if batch.get("page_num") is None:
+                continue
+            page_stores.append(page_elements)
+            page_parts.append(await asyncio.to_thread(_check_page, page_elements))
+        elements = ElementStore.concat(page_stores)
+        validation_result = await asyncio.to_thread(self.validator._finalize_sync, elements, page_parts)
+        validation_result["layout_issues"] = with_anchor(validation_result.get("layout_issues", []))
+        result = {
+            "elements": elements,
+            "layout_result": validation_result,
+            "parse_errors": parse_errors,
+            "parse_report": parse_report,
+        }
+        if hook_results is not None:
+            result["page_hook_results"] = hook_results
+        return result
@@ -0,0 +1,204 @@
+from typing import Any, Dict, Iterable, Optional
+from collections import OrderedDict
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from config import LAYOUT_CACHE_DIR, LAYOUT_CACHE_ENABLED, LAYOUT_CACHE_MAX_MB, LAYOUT_CACHE_MEMORY_MB
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 解析逻辑变化（元素划分、区域判定等）时需递增，使旧缓存自动失效
+LAYOUT_PARSER_VERSION = "4"
+
+
+def make_cache_key(pdf_digest: str, page_set: Optional[Iterable[int]], parser_version: str = LAYOUT_PARSER_VERSION) -> str:
+    pages = ",".join(str(p) for p in sorted(set(page_set))) if page_set else "*"
+    raw = f"{parser_version}|{pdf_digest}|{pages}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LayoutParseCache:
+    """
+    布局解析结果缓存：内存 LRU + 磁盘 gzip(JSON)，两级均按字节数淘汰。
+    key 由 PDF 内容哈希、页码集合与解析器版本构成，与请求来源无关，
+    因此 /audit、/layout/analyze、CLI 与回归脚本可共享同一份解析结果。
+    """
+
+    def __init__(self, cache_dir: Optional[str], memory_bytes: int, disk_bytes: int):
+        self.cache_dir = cache_dir if cache_dir and disk_bytes > 0 else None
+        self.memory_bytes = max(0, int(memory_bytes))
+        self.disk_bytes = max(0, int(disk_bytes))
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._disk_size: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+        if blob is None:
+            blob = self._read_disk(key)
+            if blob is not None:
+                self._remember(key, blob)
+        if blob is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            data = json.loads(gzip.decompress(blob).decode("utf-8"))
+        except Exception as e:
+            logger.warning(f"layout cache entry corrupted, dropping: {e!r}")
+            self.invalidate(key)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: Dict[str, Any]) -> None:
+        try:
+            blob = gzip.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), compresslevel=5)
+        except Exception as e:
+            logger.warning(f"layout cache encode failed: {e!r}")
+            return
+        self._remember(key, blob)
+        self._write_disk(key, blob)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            blob = self._memory.pop(key, None)
+            if blob is not None:
+                self._memory_size -= len(blob)
+        path = self._path(key)
+        if path:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+        for path, _, _ in self._scan_disk():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self._disk_size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_dir": self.cache_dir,
+                "disk_bytes": self._disk_size,
+            }
+
+    def _remember(self, key: str, blob: bytes) -> None:
+        if len(blob) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= len(old)
+            self._memory[key] = blob
+            self._memory_size += len(blob)
+            while self._memory_size > self.memory_bytes and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _path(self, key: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, key[:2], key + ".json.gz")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+            os.utime(path, None)
+            return blob
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, blob: bytes) -> None:
+        path = self._path(key)
+        if not path or len(blob) > self.disk_bytes:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"layout cache write failed: {e!r}")
+            return
+        if self._disk_size is None:
+            self._disk_size = sum(size for _, size, _ in self._scan_disk())
+        else:
+            self._disk_size += len(blob)
+        if self._disk_size > self.disk_bytes:
+            self._evict_disk()
+
+    def _scan_disk(self):
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json.gz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict_disk(self) -> None:
+        entries = sorted(self._scan_disk(), key=lambda x: x[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.disk_bytes * 0.9)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                continue
+        self._disk_size = total
+
+
+def _default_cache_dir() -> str:
+    return os.path.join(tempfile.gettempdir(), "standardization_auditor_agent", "layout_cache")
+
+
+layout_parse_cache: Optional[LayoutParseCache] = (
+    LayoutParseCache(
+        LAYOUT_CACHE_DIR or _default_cache_dir(),
+        memory_bytes=LAYOUT_CACHE_MEMORY_MB * 1024 * 1024,
+        disk_bytes=LAYOUT_CACHE_MAX_MB * 1024 * 1024,
+    )
+    if LAYOUT_CACHE_ENABLED
+    else None
+)
@@ -13,3 +13,7 @@ class ParseReport(BaseModel):
     scanned_pages: int = 0
     multi_column_pages: int = 0
     visual_elements_count: int = 0
+    page_count: int = 0
+    pages_parsed: int = 0
+    last_page_parsed: Optional[int] = None
+    partial: bool = False
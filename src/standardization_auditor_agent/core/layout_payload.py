@@ -13,7 +13,7 @@ class LayoutPayload(BaseModel):
 
 def build_layout_payload(elements, layout_issues, anchors, parse_errors=None, parse_report=None, frontend=None) -> LayoutPayload:
     return LayoutPayload(
-        elements=[e.model_dump() for e in elements],
+        elements=elements.to_dicts() if hasattr(elements, "to_dicts") else [e.model_dump() for e in elements],
         layout_issues=layout_issues,
         anchors=anchors,
         parse_errors=parse_errors or [],
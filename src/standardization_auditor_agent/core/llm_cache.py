@@ -0,0 +1,180 @@
+from typing import Any, Dict, Optional
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from config import LLM_CACHE_ENABLED, LLM_CACHE_MAX_MB, LLM_CACHE_PATH, LLM_CACHE_TTL_SEC
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def make_llm_cache_key(
+    provider: str,
+    model: str,
+    system_prompt: str,
+    user_content: str,
+    temperature: float,
+    max_tokens: int,
+) -> str:
+    raw = "|".join([
+        provider or "",
+        model or "",
+        _sha256(system_prompt),
+        _sha256(user_content),
+        repr(float(temperature)),
+        str(int(max_tokens)),
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    LLM 响应缓存：SQLite 单文件存储，按 TTL 过期、按总字节数淘汰最久未访问的条目。
+    key 覆盖 provider / 模型 / system prompt 哈希 / 用户内容哈希 / temperature / max_tokens，
+    论文重新提交时未改动的分块直接命中，不再消耗 token。
+    """
+
+    def __init__(self, path: Optional[str], ttl_sec: int, max_bytes: int):
+        self.path = path or ":memory:"
+        self.ttl_sec = max(0, int(ttl_sec))
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._size: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                row = conn.execute("SELECT value, size, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and self.ttl_sec and now - row[2] > self.ttl_sec:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    if self._size is not None:
+                        self._size -= row[1]
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                logger.warning(f"llm cache read failed: {e!r}")
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        if not value:
+            return
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                if self._size is None:
+                    self._size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+                old = conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache(key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now),
+                )
+                self._size += size - (old[0] if old else 0)
+                self.stores += 1
+                if self._size > self.max_bytes:
+                    self._evict(conn, now)
+            except sqlite3.Error as e:
+                logger.warning(f"llm cache write failed: {e!r}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        # 先清掉过期条目，仍超限时按最近访问时间从旧到新淘汰到上限的 90%
+        if self.ttl_sec:
+            cur = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_sec,))
+            self.evictions += max(0, cur.rowcount)
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        if total > target:
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at ASC"):
+                if total <= target:
+                    break
+                victims.append((key,))
+                total -= size
+            conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+            self.evictions += len(victims)
+        self._size = total
+
+    def clear(self) -> None:
+        with self._lock:
+            try:
+                self._connect().execute("DELETE FROM llm_cache")
+                self._size = 0
+            except sqlite3.Error as e:
+                logger.warning(f"llm cache clear failed: {e!r}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            try:
+                items = self._connect().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            except sqlite3.Error:
+                items = None
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "items": items,
+                "bytes": self._size,
+                "path": self.path,
+                "ttl_sec": self.ttl_sec,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _default_cache_path() -> str:
+    return os.path.join(tempfile.gettempdir(), "standardization_auditor_agent", "llm_cache.sqlite3")
+
+
+llm_response_cache: Optional[LLMResponseCache] = (
+    LLMResponseCache(
+        LLM_CACHE_PATH or _default_cache_path(),
+        ttl_sec=LLM_CACHE_TTL_SEC,
+        max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024,
+    )
+    if LLM_CACHE_ENABLED
+    else None
+)
@@ -1,7 +1,6 @@
-from google import genai
 from google.genai import types
-from openai import AsyncOpenAI
-from typing import Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
 import json
 import re
 from utils.logger import setup_logger
@@ -9,73 +8,271 @@ from config import (
     GEMINI_MODEL_NAME, GOOGLE_API_KEY,
     QWEN_API_KEY, QWEN_BASE_URL, QWEN_MODEL_NAME,
     DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL_NAME,
-    LLM_PROVIDER, LLM_TIMEOUT_SEC
+    LLM_PROVIDER, LLM_ROUTE_PROVIDERS, LLM_TIMEOUT_SEC
 )
 from core.prompts import SYSTEM_PROMPT_MAIN as SYSTEM_PROMPT
+from core.llm_cache import LLMResponseCache, llm_response_cache, make_llm_cache_key
+from core.llm_http import LLMClientRegistry, llm_client_registry
+from core.llm_routing import LLMRouter, LLMRoutingError, llm_router
+from core.llm_limits import ProviderLimiters, estimate_tokens, llm_rate_limiters
+from core.llm_stream import IssueStreamParser
 
 logger = setup_logger(__name__)
 
+# scan_document 各 provider 使用的输出上限，同时作为缓存 key 的一部分
+_SCAN_MAX_TOKENS = {"gemini": 8192, "qwen": 2000, "deepseek": 4096}
+
+
+def _usage_tokens(response: Any) -> Optional[int]:
+    """响应中的实际 token 用量（OpenAI 兼容接口 usage.total_tokens / Gemini usage_metadata.total_token_count）"""
+    usage = getattr(response, "usage", None)
+    total = getattr(usage, "total_tokens", None)
+    if total is None:
+        total = getattr(getattr(response, "usage_metadata", None), "total_token_count", None)
+    return total if isinstance(total, int) else None
+
 class LLMClient:
     """
     统一的 LLM 客户端封装，支持 Google Gemini 和 Qwen (DashScope)。
-    根据 config.LLM_PROVIDER 动态切换后端。
+    根据 config.LLM_PROVIDER 动态切换后端；底层 provider 客户端与连接池由 registry 进程内共享。
+    配置 LLM_ROUTE_PROVIDERS 时按顺序使用多个 provider，由 router 负责对冲请求、失败切换与熔断。
     """
-    def __init__(self):
-        self.provider = LLM_PROVIDER.lower() if LLM_PROVIDER else "none"
-        
+    def __init__(
+        self,
+        cache: Optional[LLMResponseCache] = llm_response_cache,
+        registry: LLMClientRegistry = llm_client_registry,
+        router: Optional[LLMRouter] = llm_router,
+        route_providers: Optional[List[str]] = None,
+        limiters: Optional[ProviderLimiters] = llm_rate_limiters,
+    ):
+        self.cache = cache
+        self.registry = registry
+        self.limiters = limiters
+        self.gemini_client = None
+        self.qwen_client = None
+        self.deepseek_client = None
+        self.model_names: Dict[str, str] = {}
+
+        if route_providers is None:
+            route_providers = [p.strip().lower() for p in LLM_ROUTE_PROVIDERS.split(",") if p.strip()]
+        if route_providers:
+            # 多 provider 路由：只保留已配置 API Key 的 provider，顺序即优先级
+            self.providers = [p for p in dict.fromkeys(route_providers) if self._init_provider(p)]
+        else:
+            primary = LLM_PROVIDER.lower() if LLM_PROVIDER else "none"
+            self.providers = [primary] if self._init_provider(primary) else []
+        self.provider = self.providers[0] if self.providers else "none"
+        self.model_name = self.model_names.get(self.provider, "")
+        self.router = router if len(self.providers) > 1 else None
+
+    def _init_provider(self, provider: str) -> bool:
         # 初始化 Gemini
-        if self.provider == "gemini":
-            if not GOOGLE_API_KEY:
-                self.gemini_client = None
-                self.provider = "none"
-            else:
-                self.gemini_client = genai.Client(api_key=GOOGLE_API_KEY)
-            self.model_name = GEMINI_MODEL_NAME
-            
+        if provider == "gemini":
+            self.model_names[provider] = GEMINI_MODEL_NAME
+            if GOOGLE_API_KEY:
+                self.gemini_client = self.registry.gemini(GOOGLE_API_KEY)
+            return self.gemini_client is not None
+
         # 初始化 Qwen (OpenAI Compatible)
-        elif self.provider == "qwen":
-            if not QWEN_API_KEY:
-                self.qwen_client = None
-                self.provider = "none"
-            else:
-                self.qwen_client = AsyncOpenAI(
-                    api_key=QWEN_API_KEY,
-                    base_url=QWEN_BASE_URL
-                )
-            self.model_name = QWEN_MODEL_NAME
-        
+        if provider == "qwen":
+            self.model_names[provider] = QWEN_MODEL_NAME
+            if QWEN_API_KEY:
+                self.qwen_client = self.registry.openai(QWEN_API_KEY, QWEN_BASE_URL)
+            return self.qwen_client is not None
+
         # 初始化 DeepSeek (OpenAI Compatible)
-        elif self.provider == "deepseek":
-            if not DEEPSEEK_API_KEY:
-                self.deepseek_client = None
-                self.provider = "none"
-            else:
-                self.deepseek_client = AsyncOpenAI(
-                    api_key=DEEPSEEK_API_KEY,
-                    base_url=DEEPSEEK_BASE_URL
-                )
-            self.model_name = DEEPSEEK_MODEL_NAME
-
-        elif self.provider == "mock":
-            pass # No client needed
+        if provider == "deepseek":
+            self.model_names[provider] = DEEPSEEK_MODEL_NAME
+            if DEEPSEEK_API_KEY:
+                self.deepseek_client = self.registry.openai(DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL)
+            return self.deepseek_client is not None
 
-        else:
-            self.provider = "none"
+        # No client needed
+        return provider == "mock"
+
+    def _model_for(self, provider: str) -> str:
+        if provider == self.provider:
+            return self.model_name
+        return self.model_names.get(provider, "")
+
+    def _cache_key(self, system_prompt: str, user_content: str, temperature: float, max_tokens: int) -> Optional[str]:
+        # mock 不消耗 token，不走缓存
+        if self.cache is None or self.provider in ("none", "mock"):
+            return None
+        # 路由模式下结果可能来自任一 provider，key 覆盖整个 provider 列表
+        providers = self.providers if self.router is not None else [self.provider]
+        return make_llm_cache_key(
+            ">".join(providers),
+            ">".join(self._model_for(p) for p in providers),
+            system_prompt,
+            user_content,
+            temperature,
+            max_tokens,
+        )
+
+    async def _cached(self, key: Optional[str], call) -> str:
+        if key is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached
+        result = await call()
+        # 出错时返回空串，不缓存
+        if key is not None and result:
+            await asyncio.to_thread(self.cache.put, key, result)
+        return result
+
+    async def _dispatch(self, call: Callable[[str], Awaitable[Optional[str]]]) -> str:
+        """单 provider 直接调用；多 provider 交给 router。出错时记录日志并返回空串。"""
+        if self.provider == "none":
+            return ""
+        if self.router is None:
+            try:
+                return await call(self.provider) or ""
+            except Exception as e:
+                logger.error(f"LLM Error ({self.provider}): {e}", exc_info=True)
+                return ""
+        try:
+            result, provider = await self.router.run(self.providers, call)
+            if provider != self.provider:
+                logger.info(f"LLM response served by {provider}")
+            return result
+        except LLMRoutingError as e:
+            logger.error(f"LLM Error (all providers failed): {e}")
+            return ""
+
+    async def _limited(
+        self,
+        provider: str,
+        estimated_tokens: int,
+        call: Callable[[], Awaitable[Tuple[Optional[str], Optional[int]]]],
+    ) -> Optional[str]:
+        """
+        在 provider 限流器下执行一次请求：排队等待请求数/token 配额与并发槽位，
+        按响应中的实际用量结算（无用量信息时沿用预估值）。
+        """
+        limiter = self.limiters.get(provider) if self.limiters is not None else None
+        if limiter is None:
+            text, _ = await call()
+            return text
+        async with limiter.lease(estimated_tokens) as lease:
+            text, usage = await call()
+            lease.settle(usage)
+        return text
 
     async def scan_document(self, content: str, temperature: float = 0.1) -> str:
         """
-        扫描文档内容，执行格式审计。
+        扫描文档内容，执行格式审计。相同 provider/模型/提示词/内容的结果直接取自缓存。
+        """
+        key = self._cache_key(SYSTEM_PROMPT, content, temperature, _SCAN_MAX_TOKENS.get(self.provider, 0))
+        prompt_tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(content)
+        return await self._cached(key, lambda: self._dispatch(
+            lambda p: self._limited(
+                p, prompt_tokens + _SCAN_MAX_TOKENS.get(p, 0), lambda: self._scan_with(p, content, temperature)
+            )
+        ))
+
+    async def scan_document_stream(
+        self,
+        content: str,
+        on_issue: Callable[[Dict[str, Any]], bool],
+        temperature: float = 0.1,
+    ) -> str:
+        """
+        流式扫描：issues 数组中的每个对象一闭合就交给 on_issue，on_issue 返回 False 时提前结束请求。
+        返回已收到的原始文本（提前结束或出错时为不完整的 JSON）；只有完整收到的响应才写入缓存。
+        调用方超时取消时，已交给 on_issue 的问题保留在调用方手中。
         """
-        if self.provider == "gemini":
+        parser = IssueStreamParser(on_issue)
+        if self.router is not None:
+            # 多 provider 对冲时多个请求同时在途，无法确定哪一路的增量可信，整段返回后再解析
+            text = await self.scan_document(content, temperature)
+            parser.feed(text)
+            return text
+        if self.provider == "none":
+            return ""
+        provider = self.provider
+        key = self._cache_key(SYSTEM_PROMPT, content, temperature, _SCAN_MAX_TOKENS.get(provider, 0))
+        if key is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                parser.feed(cached)
+                return cached
+        estimated = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(content) + _SCAN_MAX_TOKENS.get(provider, 0)
+        try:
+            text = await self._limited(
+                provider, estimated, lambda: self._stream_with(provider, content, temperature, parser)
+            )
+        except Exception as e:
+            logger.error(f"LLM Error ({provider}): {e}", exc_info=True)
+            return parser.text
+        if key is not None and text and not parser.stopped:
+            await asyncio.to_thread(self.cache.put, key, text)
+        return text or ""
+
+    async def _stream_with(
+        self, provider: str, content: str, temperature: float, parser: IssueStreamParser
+    ) -> Tuple[Optional[str], Optional[int]]:
+        usage = None
+        if provider == "mock":
+            parser.feed(await self._scan_with_mock(content, temperature))
+        elif provider == "gemini":
+            if not self.gemini_client:
+                return "", None
+            config = types.GenerateContentConfig(
+                system_instruction=SYSTEM_PROMPT,
+                temperature=temperature,
+                max_output_tokens=_SCAN_MAX_TOKENS["gemini"],
+            )
+            stream = await self.gemini_client.aio.models.generate_content_stream(
+                model=self._model_for("gemini"),
+                contents=content,
+                config=config,
+            )
+            async for chunk in stream:
+                parser.feed(chunk.text or "")
+                usage = _usage_tokens(chunk) or usage
+                if parser.stopped:
+                    break
+        else:
+            client = self._openai_client(provider)
+            if not client:
+                return "", None
+            stream = await client.chat.completions.create(
+                model=self._model_for(provider),
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": content}
+                ],
+                temperature=temperature,
+                max_tokens=_SCAN_MAX_TOKENS.get(provider, 0),
+                timeout=LLM_TIMEOUT_SEC,
+                stream=True,
+                # 最后一个事件携带本次请求的 token 用量
+                stream_options={"include_usage": True},
+            )
+            try:
+                async for event in stream:
+                    if event.choices:
+                        parser.feed(event.choices[0].delta.content or "")
+                    usage = _usage_tokens(event) or usage
+                    if parser.stopped:
+                        break
+            finally:
+                # 提前结束时关闭响应，连接归还连接池
+                await stream.close()
+        return parser.text, usage
+
+    async def _scan_with(self, provider: str, content: str, temperature: float) -> Tuple[Optional[str], Optional[int]]:
+        if provider == "gemini":
             return await self._scan_with_gemini(content, temperature)
-        elif self.provider == "qwen":
+        elif provider == "qwen":
             return await self._scan_with_qwen(content, temperature)
-        elif self.provider == "deepseek":
+        elif provider == "deepseek":
             return await self._scan_with_deepseek(content, temperature)
-        elif self.provider == "mock":
-            return await self._scan_with_mock(content, temperature)
+        elif provider == "mock":
+            return await self._scan_with_mock(content, temperature), None
         else:
-            return ""
+            return "", None
 
     async def _scan_with_mock(self, content: str, temperature: float = 0.1) -> str:
         """
@@ -115,167 +312,153 @@ class LLMClient:
         temperature: float = 0.1,
         max_tokens: int = 800,
     ) -> str:
-        if self.provider == "mock":
-            sys_text = (system_prompt or "").strip()
-            user_text = (user_prompt or "").strip()
-            if "提取可核查的客观事实点" in sys_text:
-                parts = re.split(r"[。！？\n]+", user_text)
-                facts = []
-                for p in parts:
-                    t = p.strip()
-                    if not t:
-                        continue
-                    t = re.sub(r"\s+", " ", t)
-                    if len(t) > 30:
-                        t = t[:30]
-                    facts.append(f"- {t}")
-                    if len(facts) >= 12:
-                        break
-                return "\n".join(facts)
+        key = self._cache_key(system_prompt, user_prompt, temperature, max_tokens)
+        estimated = estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + max_tokens
+        return await self._cached(key, lambda: self._dispatch(
+            lambda p: self._limited(
+                p, estimated, lambda: self._generate_with(p, system_prompt, user_prompt, temperature, max_tokens)
+            )
+        ))
 
-            if "必须以JSON对象输出" in sys_text and "comment" in sys_text and "suggestion" in sys_text:
-                issue_summary = ""
-                expert_comments = ""
-                try:
-                    data = json.loads(user_text)
-                    issue_summary = str(data.get("issue_summary") or "")
-                    expert_comments = str(data.get("expert_comments") or "")
-                except Exception:
-                    issue_summary = user_text[:800]
-                    expert_comments = ""
-
-                top_tip = ""
-                m = re.search(r"^- (.+)$", expert_comments, flags=re.MULTILINE)
-                if m:
-                    top_tip = m.group(1).strip()
-
-                comment = "已完成格式审计。"
-                if issue_summary.strip() and issue_summary.strip() != "-":
-                    comment = f"发现以下问题：\n{issue_summary}".strip()
-                suggestion = "请优先修复 Critical/Warning，再统一排版细节。"
-                if top_tip:
-                    suggestion = f"{suggestion}\n参考建议：{top_tip}"
-
-                return json.dumps({"comment": comment, "suggestion": suggestion}, ensure_ascii=False)
+    async def _generate_with(
+        self,
+        provider: str,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float,
+        max_tokens: int,
+    ) -> Tuple[Optional[str], Optional[int]]:
+        if provider == "mock":
+            return self._generate_with_mock(system_prompt, user_prompt), None
+        if provider == "gemini":
+            if not self.gemini_client:
+                return "", None
+            config = types.GenerateContentConfig(
+                system_instruction=system_prompt,
+                temperature=temperature,
+                max_output_tokens=max_tokens,
+            )
+            response = await self.gemini_client.aio.models.generate_content(
+                model=self._model_for(provider),
+                contents=user_prompt,
+                config=config,
+            )
+            return response.text or "", _usage_tokens(response)
+        client = self._openai_client(provider)
+        if not client:
+            return "", None
+        response = await client.chat.completions.create(
+            model=self._model_for(provider),
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=LLM_TIMEOUT_SEC,
+        )
+        return response.choices[0].message.content or "", _usage_tokens(response)
 
-            return ""
+    def _openai_client(self, provider: str):
+        if provider == "qwen":
+            return self.qwen_client
+        if provider == "deepseek":
+            return self.deepseek_client
+        return None
 
-        if self.provider == "gemini":
-            if not self.gemini_client:
-                return ""
-            try:
-                config = types.GenerateContentConfig(
-                    system_instruction=system_prompt,
-                    temperature=temperature,
-                    max_output_tokens=max_tokens,
-                )
-                response = await self.gemini_client.aio.models.generate_content(
-                    model=self.model_name,
-                    contents=user_prompt,
-                    config=config,
-                )
-                return response.text or ""
-            except Exception as e:
-                logger.error(f"LLM Error (Gemini): {e}", exc_info=True)
-                return ""
-        elif self.provider == "qwen":
-            if not self.qwen_client:
-                return ""
-            try:
-                response = await self.qwen_client.chat.completions.create(
-                    model=self.model_name,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    timeout=LLM_TIMEOUT_SEC,
-                )
-                return response.choices[0].message.content or ""
-            except Exception as e:
-                logger.error(f"LLM Error (Qwen): {e}", exc_info=True)
-                return ""
-        elif self.provider == "deepseek":
-            if not self.deepseek_client:
-                return ""
+    def _generate_with_mock(self, system_prompt: str, user_prompt: str) -> str:
+        sys_text = (system_prompt or "").strip()
+        user_text = (user_prompt or "").strip()
+        if "提取可核查的客观事实点" in sys_text:
+            parts = re.split(r"[。！？\n]+", user_text)
+            facts = []
+            for p in parts:
+                t = p.strip()
+                if not t:
+                    continue
+                t = re.sub(r"\s+", " ", t)
+                if len(t) > 30:
+                    t = t[:30]
+                facts.append(f"- {t}")
+                if len(facts) >= 12:
+                    break
+            return "\n".join(facts)
+
+        if "必须以JSON对象输出" in sys_text and "comment" in sys_text and "suggestion" in sys_text:
+            issue_summary = ""
+            expert_comments = ""
             try:
-                response = await self.deepseek_client.chat.completions.create(
-                    model=self.model_name,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    timeout=LLM_TIMEOUT_SEC,
-                )
-                return response.choices[0].message.content or ""
-            except Exception as e:
-                logger.error(f"LLM Error (DeepSeek): {e}", exc_info=True)
-                return ""
+                data = json.loads(user_text)
+                issue_summary = str(data.get("issue_summary") or "")
+                expert_comments = str(data.get("expert_comments") or "")
+            except Exception:
+                issue_summary = user_text[:800]
+                expert_comments = ""
+
+            top_tip = ""
+            m = re.search(r"^- (.+)$", expert_comments, flags=re.MULTILINE)
+            if m:
+                top_tip = m.group(1).strip()
+
+            comment = "已完成格式审计。"
+            if issue_summary.strip() and issue_summary.strip() != "-":
+                comment = f"发现以下问题：\n{issue_summary}".strip()
+            suggestion = "请优先修复 Critical/Warning，再统一排版细节。"
+            if top_tip:
+                suggestion = f"{suggestion}\n参考建议：{top_tip}"
+
+            return json.dumps({"comment": comment, "suggestion": suggestion}, ensure_ascii=False)
+
         return ""
 
-    async def _scan_with_gemini(self, content: str, temperature: float) -> str:
+    async def _scan_with_gemini(self, content: str, temperature: float) -> Tuple[Optional[str], Optional[int]]:
         if not self.gemini_client:
-            return ""
+            return "", None
 
-        try:
-            config = types.GenerateContentConfig(
-                system_instruction=SYSTEM_PROMPT,
-                temperature=temperature,
-                max_output_tokens=8192,
-            )
-            
-            response = await self.gemini_client.aio.models.generate_content(
-                model=self.model_name,
-                contents=content,
-                config=config
-            )
-            return response.text
-        except Exception as e:
-            logger.error(f"LLM Error (Gemini): {e}", exc_info=True)
-            return ""
+        config = types.GenerateContentConfig(
+            system_instruction=SYSTEM_PROMPT,
+            temperature=temperature,
+            max_output_tokens=_SCAN_MAX_TOKENS["gemini"],
+        )
+        
+        response = await self.gemini_client.aio.models.generate_content(
+            model=self._model_for("gemini"),
+            contents=content,
+            config=config
+        )
+        return response.text, _usage_tokens(response)
 
-    async def _scan_with_qwen(self, content: str, temperature: float) -> str:
+    async def _scan_with_qwen(self, content: str, temperature: float) -> Tuple[Optional[str], Optional[int]]:
         if not self.qwen_client:
-            return ""
+            return "", None
 
-        try:
-            response = await self.qwen_client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": content}
-                ],
-                temperature=temperature,
-                max_tokens=2000, # Qwen max output limitation
-                timeout=LLM_TIMEOUT_SEC,
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            logger.error(f"LLM Error (Qwen): {e}", exc_info=True)
-            return ""
+        response = await self.qwen_client.chat.completions.create(
+            model=self._model_for("qwen"),
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            temperature=temperature,
+            max_tokens=_SCAN_MAX_TOKENS["qwen"], # Qwen max output limitation
+            timeout=LLM_TIMEOUT_SEC,
+        )
+        return response.choices[0].message.content, _usage_tokens(response)
 
-    async def _scan_with_deepseek(self, content: str, temperature: float) -> str:
+    async def _scan_with_deepseek(self, content: str, temperature: float) -> Tuple[Optional[str], Optional[int]]:
         if not self.deepseek_client:
-            return ""
+            return "", None
 
-        try:
-            response = await self.deepseek_client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": content}
-                ],
-                temperature=temperature,
-                max_tokens=4096, # DeepSeek V3 supports longer context
-                timeout=LLM_TIMEOUT_SEC,
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            logger.error(f"LLM Error (DeepSeek): {e}", exc_info=True)
-            return ""
+        response = await self.deepseek_client.chat.completions.create(
+            model=self._model_for("deepseek"),
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            temperature=temperature,
+            max_tokens=_SCAN_MAX_TOKENS["deepseek"], # DeepSeek V3 supports longer context
+            timeout=LLM_TIMEOUT_SEC,
+        )
+        return response.choices[0].message.content, _usage_tokens(response)
 
 # 为了兼容旧代码，保留 GeminiClient 别名，但建议迁移到 LLMClient
 GeminiClient = LLMClient
@@ -0,0 +1,170 @@
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import importlib.util
+import threading
+
+import httpx
+from google import genai
+from openai import AsyncOpenAI
+
+from config import LLM_HTTP2, LLM_HTTP_KEEPALIVE_EXPIRY, LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_MAX_KEEPALIVE
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# HTTP/2 依赖可选的 h2 包，未安装时退回 HTTP/1.1
+_H2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class PooledTransport(httpx.AsyncBaseTransport):
+    """
+    包装 httpx.AsyncHTTPTransport，统计连接池指标（新建连接数、在用/空闲连接、排队请求）。
+    连接与事件循环绑定：检测到事件循环变化时重建底层连接池（脚本多次 asyncio.run 的场景）。
+    指标依赖 httpcore 的内部属性（requirements 中已固定版本）；属性缺失时只保留请求计数，连接池照常工作。
+    """
+
+    def __init__(self, limits: httpx.Limits, http2: bool):
+        self.limits = limits
+        self.http2 = http2
+        self.created = 0
+        self.requests = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._transport = self._new_transport()
+
+    def _new_transport(self) -> httpx.AsyncHTTPTransport:
+        transport = httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+        pool = getattr(transport, "_pool", None)
+        create = getattr(pool, "create_connection", None)
+        if not callable(create):
+            return transport
+
+        def _create_connection(origin):
+            self.created += 1
+            return create(origin)
+
+        try:
+            pool.create_connection = _create_connection
+        except (AttributeError, TypeError):
+            pass
+        return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._loop is not None:
+                self._transport = self._new_transport()
+            self._loop = loop
+        self.requests += 1
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        if self._loop is not None and self._loop is not asyncio.get_running_loop():
+            # 连接属于已结束的事件循环，无法在当前循环上关闭，直接丢弃
+            self._transport = self._new_transport()
+            self._loop = None
+            return
+        await self._transport.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "created": self.created,
+            "requests": self.requests,
+        }
+        pool = getattr(self._transport, "_pool", None)
+        if pool is None or not hasattr(pool, "connections"):
+            return out
+        try:
+            connections = list(pool.connections)
+            pending = list(getattr(pool, "_requests", None) or [])
+            idle = sum(1 for c in connections if c.is_idle())
+            out.update({
+                "connections": len(connections),
+                "in_use": len(connections) - idle,
+                "idle": idle,
+                "waiting": sum(1 for r in pending if r.is_queued()),
+            })
+        except (AttributeError, TypeError):
+            # httpcore 内部结构变化：不提供连接级指标
+            pass
+        return out
+
+
+class LLMClientRegistry:
+    """
+    进程级 LLM 客户端注册表：所有 LLMClient 共享同一组 provider 客户端与 httpx 连接池，
+    main.py、CLI 与回归脚本中的多个 SemanticChecker 复用已建立的连接和 TLS 会话。
+    """
+
+    def __init__(self, max_connections: int, max_keepalive: int, keepalive_expiry: float, http2: bool):
+        self.limits = httpx.Limits(
+            max_connections=max(1, int(max_connections)),
+            max_keepalive_connections=max(0, int(max_keepalive)),
+            keepalive_expiry=float(keepalive_expiry),
+        )
+        self.http2 = bool(http2) and _H2_AVAILABLE
+        if http2 and not _H2_AVAILABLE:
+            logger.info("LLM_HTTP2 requested but h2 is not installed; using HTTP/1.1")
+        self._lock = threading.Lock()
+        self._transport: Optional[PooledTransport] = None
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._openai: Dict[Tuple[str, str], AsyncOpenAI] = {}
+        self._gemini: Dict[str, genai.Client] = {}
+
+    def http_client(self) -> httpx.AsyncClient:
+        with self._lock:
+            if self._http_client is None:
+                self._transport = PooledTransport(self.limits, self.http2)
+                self._http_client = httpx.AsyncClient(transport=self._transport)
+            return self._http_client
+
+    def openai(self, api_key: str, base_url: str) -> AsyncOpenAI:
+        """OpenAI 兼容接口（Qwen / DeepSeek），同一 (api_key, base_url) 只创建一次"""
+        key = (api_key, base_url)
+        client = self._openai.get(key)
+        if client is None:
+            http_client = self.http_client()
+            with self._lock:
+                client = self._openai.get(key)
+                if client is None:
+                    client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+                    self._openai[key] = client
+        return client
+
+    def gemini(self, api_key: str) -> genai.Client:
+        # google-genai 1.2 不支持注入 httpx 客户端，只能按 api_key 复用客户端本身
+        with self._lock:
+            client = self._gemini.get(api_key)
+            if client is None:
+                client = genai.Client(api_key=api_key)
+                self._gemini[api_key] = client
+            return client
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pool = self._transport.stats() if self._transport is not None else None
+            return {
+                "openai_clients": len(self._openai),
+                "gemini_clients": len(self._gemini),
+                "pool": pool,
+            }
+
+    async def aclose(self) -> None:
+        with self._lock:
+            http_client = self._http_client
+            self._http_client = None
+            self._transport = None
+            self._openai.clear()
+            self._gemini.clear()
+        if http_client is not None:
+            await http_client.aclose()
+
+
+llm_client_registry = LLMClientRegistry(
+    max_connections=LLM_HTTP_MAX_CONNECTIONS,
+    max_keepalive=LLM_HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+    http2=LLM_HTTP2,
+)
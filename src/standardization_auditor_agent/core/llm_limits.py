@@ -0,0 +1,349 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import asyncio
+import time
+
+from config import (
+    LLM_CONCURRENCY_INITIAL,
+    LLM_CONCURRENCY_MAX,
+    LLM_CONCURRENCY_MIN,
+    LLM_RATE_LIMITS,
+    LLM_RATE_MAX_WAIT_SEC,
+    LLM_RATE_RPM,
+    LLM_RATE_TPM,
+)
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 粗略的 token 估算：ASCII 约 4 字符 / token，中文等其它字符约 0.6 token / 字
+ASCII_TOKENS_PER_CHAR = 0.25
+OTHER_TOKENS_PER_CHAR = 0.6
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ch < "\x80")
+    return int(ascii_chars * ASCII_TOKENS_PER_CHAR + (len(text) - ascii_chars) * OTHER_TOKENS_PER_CHAR) + 1
+
+
+class LLMRateLimited(Exception):
+    """排队超过最长等待时间仍未获得配额"""
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    """429 / 超时类错误，作为 AIMD 降并发的信号"""
+    if isinstance(exc, LLMRateLimited):
+        return False
+    if isinstance(exc, asyncio.TimeoutError):
+        return True
+    for attr in ("status_code", "code", "status"):
+        if getattr(exc, attr, None) == 429:
+            return True
+    name = type(exc).__name__
+    return "RateLimit" in name or "Timeout" in name
+
+
+class TokenBucket:
+    """
+    令牌桶：容量为每分钟额度，按时间连续补充。允许欠账（实际用量超过预估时扣成负数），后续请求相应等待。
+    rate_per_min <= 0 表示不限制。
+    """
+
+    def __init__(self, rate_per_min: float, clock: Callable[[], float] = time.monotonic):
+        self.rate_per_min = float(rate_per_min)
+        self.capacity = max(0.0, self.rate_per_min)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate_per_min <= 0
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_min / 60.0)
+        self._updated = now
+
+    def available(self) -> float:
+        if self.unlimited:
+            return float("inf")
+        self._refill()
+        return self._tokens
+
+    def wait_time(self, amount: float) -> float:
+        """距离可扣除 amount 还需等待的秒数（amount 超过容量时按容量计）"""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        need = min(float(amount), self.capacity) - self._tokens
+        return max(0.0, need * 60.0 / self.rate_per_min)
+
+    def take(self, amount: float) -> None:
+        if not self.unlimited:
+            self._refill()
+            self._tokens -= float(amount)
+
+    def give(self, amount: float) -> None:
+        if not self.unlimited:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + float(amount))
+
+
+class AIMDConcurrency:
+    """
+    AIMD 并发控制：每次成功加 1/limit（约每轮加 1），遇到 429/超时乘以 backoff；
+    同一秒内的多次限流只降一次，避免一次突发把并发压到最低。
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, backoff: float = 0.5, clock: Callable[[], float] = time.monotonic):
+        self.minimum = max(1, int(minimum))
+        self.maximum = max(self.minimum, int(maximum))
+        self.limit = float(min(self.maximum, max(self.minimum, int(initial))))
+        self.backoff = backoff
+        self.in_flight = 0
+        self._clock = clock
+        self._last_decrease = float("-inf")
+        self._waiters: List[asyncio.Future] = []
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> None:
+        deadline = self._clock() + timeout
+        while self.in_flight >= int(self.limit):
+            remaining = deadline - self._clock()
+            if remaining <= 0:
+                raise LLMRateLimited("concurrency limit")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight = max(0, self.in_flight - 1)
+        self._wake()
+
+    def on_success(self) -> None:
+        self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def on_throttle(self) -> None:
+        now = self._clock()
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.minimum), self.limit * self.backoff)
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        for waiter in list(self._waiters):
+            if free <= 0:
+                break
+            if not waiter.done():
+                try:
+                    waiter.set_result(None)
+                except RuntimeError:
+                    # 所属事件循环已关闭
+                    continue
+                free -= 1
+
+
+class ProviderLimiter:
+    """单个 provider 的请求数/分钟、token 数/分钟令牌桶与 AIMD 并发控制"""
+
+    def __init__(
+        self,
+        provider: str,
+        rpm: float,
+        tpm: float,
+        concurrency: Tuple[int, int, int],
+        max_wait_sec: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.provider = provider
+        self.requests = TokenBucket(rpm, clock=clock)
+        self.tokens = TokenBucket(tpm, clock=clock)
+        initial, minimum, maximum = concurrency
+        self.concurrency = AIMDConcurrency(initial, minimum, maximum, clock=clock)
+        self.max_wait_sec = max(0.0, float(max_wait_sec))
+        self._clock = clock
+        self.paused_until = 0.0
+        self.completed = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.tokens_used = 0
+
+    @asynccontextmanager
+    async def lease(self, estimated_tokens: int) -> AsyncIterator["_Lease"]:
+        """
+        排队获取配额（最多等待 max_wait_sec，超时抛出 LLMRateLimited），请求结束后按实际用量结算。
+        先等令牌桶再占并发槽，等待补充令牌期间不占用并发；请求失败时退还预扣的 token。
+        """
+        deadline = self._clock() + self.max_wait_sec
+        while True:
+            wait = max(
+                self.paused_until - self._clock(),
+                self.requests.wait_time(1),
+                self.tokens.wait_time(estimated_tokens),
+            )
+            if wait <= 0:
+                break
+            if self._clock() + wait > deadline:
+                self.rejected += 1
+                raise LLMRateLimited(f"{self.provider} rate limit")
+            await asyncio.sleep(wait)
+        self.requests.take(1)
+        self.tokens.take(estimated_tokens)
+        lease = _Lease(self, estimated_tokens)
+        try:
+            await self.concurrency.acquire(max(0.0, deadline - self._clock()))
+        except BaseException:
+            lease.refund()
+            self.rejected += 1
+            raise
+        try:
+            yield lease
+        except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+            # 调用方截止时间到被取消（含对冲落败）也说明该 provider 偏慢，只降并发、不暂停
+            lease.refund()
+            if isinstance(e, asyncio.CancelledError):
+                self.throttled += 1
+                self.concurrency.on_throttle()
+            else:
+                self.on_throttle(e)
+            raise
+        except Exception as e:
+            lease.refund()
+            if is_throttle_error(e):
+                self.on_throttle(e)
+            raise
+        finally:
+            self.concurrency.release()
+
+    def on_throttle(self, exc: Optional[BaseException] = None) -> None:
+        self.throttled += 1
+        self.concurrency.on_throttle()
+        # 429 后短暂暂停该 provider 的新请求（尊重 Retry-After，最长 30 秒）
+        retry_after = 1.0
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+        if headers is not None:
+            try:
+                retry_after = float(headers.get("retry-after") or retry_after)
+            except (TypeError, ValueError):
+                pass
+        self.paused_until = max(self.paused_until, self._clock() + min(30.0, max(0.0, retry_after)))
+
+    def stats(self) -> Dict[str, Any]:
+        def _bucket(bucket: TokenBucket) -> Dict[str, Any]:
+            if bucket.unlimited:
+                return {"per_min": None, "available": None}
+            return {"per_min": bucket.rate_per_min, "available": round(bucket.available(), 1)}
+
+        return {
+            "requests": _bucket(self.requests),
+            "tokens": _bucket(self.tokens),
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            "waiting": self.concurrency.waiting,
+            "paused_for_sec": round(max(0.0, self.paused_until - self._clock()), 2),
+            "completed": self.completed,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "tokens_used": self.tokens_used,
+        }
+
+
+class _Lease:
+    def __init__(self, limiter: ProviderLimiter, estimated_tokens: int):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.settled = False
+
+    def refund(self) -> None:
+        """请求未成功：退还预扣的 token（请求次数不退，失败的请求同样计入 provider 的 RPM）"""
+        if not self.settled:
+            self.settled = True
+            self.limiter.tokens.give(self.estimated_tokens)
+
+    def settle(self, actual_tokens: Optional[int]) -> None:
+        """成功返回时调用：按实际用量修正令牌桶，并增加并发上限"""
+        if self.settled:
+            return
+        self.settled = True
+        limiter = self.limiter
+        actual = self.estimated_tokens if actual_tokens is None else int(actual_tokens)
+        if actual < self.estimated_tokens:
+            limiter.tokens.give(self.estimated_tokens - actual)
+        elif actual > self.estimated_tokens:
+            limiter.tokens.take(actual - self.estimated_tokens)
+        limiter.tokens_used += actual
+        limiter.completed += 1
+        limiter.concurrency.on_success()
+
+
+def _parse_rate_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """"deepseek:60:300000,qwen:120:500000" -> {provider: (rpm, tpm)}"""
+    out: Dict[str, Tuple[float, float]] = {}
+    for item in (spec or "").split(","):
+        parts = [p.strip() for p in item.split(":")]
+        if len(parts) != 3 or not parts[0]:
+            continue
+        try:
+            out[parts[0].lower()] = (float(parts[1]), float(parts[2]))
+        except ValueError:
+            logger.warning(f"ignoring invalid LLM_RATE_LIMITS entry: {item!r}")
+    return out
+
+
+class ProviderLimiters:
+    """按 provider 惰性创建限流器，进程内共享"""
+
+    def __init__(
+        self,
+        default_rpm: float,
+        default_tpm: float,
+        overrides: Dict[str, Tuple[float, float]],
+        concurrency: Tuple[int, int, int],
+        max_wait_sec: float,
+    ):
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.overrides = overrides
+        self.concurrency = concurrency
+        self.max_wait_sec = max_wait_sec
+        self._limiters: Dict[str, ProviderLimiter] = {}
+
+    def get(self, provider: str) -> Optional[ProviderLimiter]:
+        if provider in ("none", "mock"):
+            return None
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            rpm, tpm = self.overrides.get(provider, (self.default_rpm, self.default_tpm))
+            if rpm <= 0 and tpm <= 0:
+                # 未配置任何额度：不排队、不做 AIMD，与未启用限流时行为一致
+                return None
+            limiter = ProviderLimiter(provider, rpm, tpm, self.concurrency, self.max_wait_sec)
+            self._limiters[provider] = limiter
+        return limiter
+
+    def stats(self) -> Dict[str, Any]:
+        return {p: limiter.stats() for p, limiter in sorted(self._limiters.items())}
+
+
+llm_rate_limiters = ProviderLimiters(
+    default_rpm=LLM_RATE_RPM,
+    default_tpm=LLM_RATE_TPM,
+    overrides=_parse_rate_limits(LLM_RATE_LIMITS),
+    concurrency=(LLM_CONCURRENCY_INITIAL, LLM_CONCURRENCY_MIN, LLM_CONCURRENCY_MAX),
+    max_wait_sec=LLM_RATE_MAX_WAIT_SEC,
+)
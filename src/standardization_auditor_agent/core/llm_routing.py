@@ -0,0 +1,224 @@
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import math
+import time
+
+from config import (
+    LLM_BREAKER_COOLDOWN_SEC,
+    LLM_BREAKER_FAILURES,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MIN_SAMPLES,
+)
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class LLMRoutingError(Exception):
+    """所有候选 provider 均失败"""
+
+    def __init__(self, errors: List[Tuple[str, str]]):
+        self.errors = errors
+        super().__init__("; ".join(f"{p}: {e}" for p, e in errors) or "no provider available")
+
+
+class LatencyTracker:
+    """按 provider 记录最近 window 次成功请求的耗时，用于估算 p95"""
+
+    def __init__(self, window: int = 50, min_samples: int = 5):
+        self.window = max(1, int(window))
+        self.min_samples = max(1, int(min_samples))
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, provider: str, seconds: float) -> None:
+        self._samples.setdefault(provider, deque(maxlen=self.window)).append(float(seconds))
+
+    def percentile(self, provider: str, q: float = 0.95) -> Optional[float]:
+        """样本不足 min_samples 时返回 None"""
+        samples = self._samples.get(provider)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+    def stats(self, provider: str) -> Dict[str, Any]:
+        samples = self._samples.get(provider) or ()
+        return {"samples": len(samples), "p95_sec": self.percentile(provider)}
+
+
+class CircuitBreaker:
+    """
+    连续失败 failure_threshold 次后熔断（open），cooldown_sec 后放行一次试探（half_open），
+    试探成功恢复（closed），失败则重新熔断。试探请求在途期间其余请求仍被拒绝；
+    试探被取消而没有结论时调用 release，下一个请求可再次试探。
+    """
+
+    def __init__(self, failure_threshold: int, cooldown_sec: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown_sec = max(0.0, float(cooldown_sec))
+        self._clock = clock
+        self._failures: Dict[str, int] = {}
+        self._opened_at: Dict[str, float] = {}
+        self._probing: set = set()
+
+    def state(self, provider: str) -> str:
+        opened_at = self._opened_at.get(provider)
+        if opened_at is None:
+            return "closed"
+        if self._clock() - opened_at >= self.cooldown_sec:
+            return "half_open"
+        return "open"
+
+    def allow(self, provider: str) -> bool:
+        """closed 时放行；half_open 时只放行一个试探请求（调用方须以 record_* 或 release 结束）"""
+        state = self.state(provider)
+        if state == "closed":
+            return True
+        if state == "open" or provider in self._probing:
+            return False
+        self._probing.add(provider)
+        return True
+
+    def release(self, provider: str) -> None:
+        self._probing.discard(provider)
+
+    def record_success(self, provider: str) -> None:
+        self._probing.discard(provider)
+        self._failures[provider] = 0
+        self._opened_at.pop(provider, None)
+
+    def record_failure(self, provider: str) -> None:
+        self._probing.discard(provider)
+        failures = self._failures.get(provider, 0) + 1
+        self._failures[provider] = failures
+        # half_open 时的试探失败同样满足阈值，重新开始冷却
+        if failures >= self.failure_threshold:
+            if self.state(provider) != "open":
+                logger.warning(f"LLM provider {provider} circuit opened after {failures} consecutive failures")
+            self._opened_at[provider] = self._clock()
+
+    def stats(self, provider: str) -> Dict[str, Any]:
+        return {
+            "state": self.state(provider),
+            "consecutive_failures": self._failures.get(provider, 0),
+            "probing": provider in self._probing,
+        }
+
+
+class LLMRouter:
+    """
+    多 provider 路由：按顺序选择未熔断的 provider；首个请求超过其 p95 仍未返回时对下一个 provider 发起对冲请求，
+    请求失败时立即切换到下一个；取最先成功的结果并取消其余请求。
+    """
+
+    def __init__(
+        self,
+        hedge: bool = True,
+        min_samples: int = 5,
+        failure_threshold: int = 3,
+        cooldown_sec: float = 30.0,
+        window: int = 50,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.hedge = hedge
+        self.latency = LatencyTracker(window=window, min_samples=min_samples)
+        self.breaker = CircuitBreaker(failure_threshold, cooldown_sec, clock=clock)
+        self._clock = clock
+        self.hedged = 0
+        self.failovers = 0
+        self.wins: Dict[str, int] = {}
+
+    async def run(self, providers: Sequence[str], call: Callable[[str], Awaitable[str]]) -> Tuple[str, str]:
+        """返回 (结果, 实际应答的 provider)；空结果视为失败。全部失败时抛出 LLMRoutingError。"""
+        order = [p for p in providers if self.breaker.state(p) != "open"]
+        # 全部熔断时仍按顺序尝试，不经过熔断器放行
+        forced = not order
+        if forced:
+            order = list(providers)
+        pending: Dict[asyncio.Future, Tuple[str, float]] = {}
+        errors: List[Tuple[str, str]] = []
+        launched: List[Tuple[str, float]] = []
+
+        candidates = deque(order)
+        probes: set = set()
+
+        def _launch() -> bool:
+            # 在发起时才向熔断器申请：half_open 的 provider 只有一个请求能拿到试探资格
+            while candidates:
+                provider = candidates.popleft()
+                if not forced:
+                    half_open = self.breaker.state(provider) == "half_open"
+                    if not self.breaker.allow(provider):
+                        errors.append((provider, "circuit open"))
+                        continue
+                    if half_open:
+                        probes.add(provider)
+                started = self._clock()
+                pending[asyncio.ensure_future(call(provider))] = (provider, started)
+                launched.append((provider, started))
+                return True
+            return False
+
+        _launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and candidates:
+                    provider, started = launched[-1]
+                    p95 = self.latency.percentile(provider)
+                    if p95 is not None:
+                        timeout = max(0.0, started + p95 - self._clock())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    slow = launched[-1][0]
+                    if _launch():
+                        self.hedged += 1
+                        logger.info(f"LLM provider {slow} slower than p95, hedging to {launched[-1][0]}")
+                    continue
+                failed = False
+                for task in done:
+                    provider, started = pending.pop(task)
+                    try:
+                        result = task.result()
+                        error = "empty response"
+                    except Exception as e:
+                        result = None
+                        error = repr(e)
+                    if result:
+                        self.latency.record(provider, self._clock() - started)
+                        self.breaker.record_success(provider)
+                        self.wins[provider] = self.wins.get(provider, 0) + 1
+                        return result, provider
+                    logger.warning(f"LLM provider {provider} failed: {error}")
+                    self.breaker.record_failure(provider)
+                    errors.append((provider, error))
+                    failed = True
+                if failed and _launch():
+                    self.failovers += 1
+            raise LLMRoutingError(errors)
+        finally:
+            for task, (provider, _) in pending.items():
+                task.cancel()
+                if provider in probes:
+                    self.breaker.release(provider)
+
+    def stats(self, providers: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        names = list(providers or sorted(set(self.wins) | set(self.latency._samples) | set(self.breaker._failures)))
+        return {
+            "hedge": self.hedge,
+            "hedged": self.hedged,
+            "failovers": self.failovers,
+            "providers": {
+                p: {**self.latency.stats(p), **self.breaker.stats(p), "wins": self.wins.get(p, 0)}
+                for p in names
+            },
+        }
+
+
+llm_router = LLMRouter(
+    hedge=LLM_HEDGE_ENABLED,
+    min_samples=LLM_HEDGE_MIN_SAMPLES,
+    failure_threshold=LLM_BREAKER_FAILURES,
+    cooldown_sec=LLM_BREAKER_COOLDOWN_SEC,
+)
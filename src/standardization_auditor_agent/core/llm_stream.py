@@ -0,0 +1,101 @@
+from typing import Any, Callable, Dict, Optional
+import json
+import re
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_ISSUES_KEY = re.compile(r'"issues"\s*:\s*\[')
+# 根节点直接是数组（可带 ```json 代码块前缀）
+_ROOT_ARRAY = re.compile(r"\s*(?:```(?:json)?\s*)?\[")
+
+
+class IssueStreamParser:
+    """
+    增量解析 LLM 流式输出中的 issues 数组：每收到一段增量就继续扫描，
+    数组中的某个对象一闭合即解析并交给 on_issue。on_issue 返回 False 时停止（stopped=True），
+    调用方据此提前结束流式请求。
+    """
+
+    def __init__(self, on_issue: Callable[[Dict[str, Any]], bool]):
+        self.on_issue = on_issue
+        self.text = ""
+        self.emitted = 0
+        self.stopped = False
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start: Optional[int] = None
+
+    def feed(self, delta: str) -> None:
+        if not delta:
+            return
+        self.text += delta
+        if self._done or self.stopped:
+            return
+        if not self._in_array and not self._find_array():
+            return
+        self._scan()
+
+    def _find_array(self) -> bool:
+        root = _ROOT_ARRAY.match(self.text)
+        if root:
+            self._pos = root.end()
+        else:
+            # 键名可能跨增量边界，从上次位置往前回退一段再找
+            match = _ISSUES_KEY.search(self.text, max(0, self._pos - 16))
+            if not match:
+                self._pos = len(self.text)
+                return False
+            self._pos = match.end()
+        self._in_array = True
+        return True
+
+    def _scan(self) -> None:
+        text = self.text
+        i = self._pos
+        n = len(text)
+        while i < n:
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0 and ch == "{":
+                    self._obj_start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    # issues 数组结束
+                    self._done = True
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._obj_start is not None:
+                    self._emit(text[self._obj_start:i + 1])
+                    self._obj_start = None
+                    if self.stopped:
+                        break
+            i += 1
+        self._pos = i + 1 if (self._done or self.stopped) else i
+
+    def _emit(self, raw: str) -> None:
+        try:
+            issue = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.debug(f"skipping malformed streamed issue: {raw[:80]!r}")
+            return
+        if not isinstance(issue, dict):
+            return
+        self.emitted += 1
+        if self.on_issue(issue) is False:
+            self.stopped = True
@@ -1,5 +1,7 @@
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
 import base64
+import hashlib
 import os
 import fitz
 import numpy as np
@@ -20,6 +22,33 @@ def open_pdf(content: Any) -> fitz.Document:
     raise ValueError("invalid pdf content")
 
 
+def pdf_sha256(content: Any) -> Optional[str]:
+    """
+    计算 PDF 原始字节的 SHA-256（路径按文件内容、base64 按解码后字节），无法识别时返回 None。
+    """
+    h = hashlib.sha256()
+    if isinstance(content, (bytes, bytearray)):
+        h.update(content)
+        return h.hexdigest()
+    if isinstance(content, str):
+        if os.path.exists(content):
+            try:
+                with open(content, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        h.update(chunk)
+            except OSError:
+                return None
+            return h.hexdigest()
+        try:
+            decoded = base64.b64decode(content, validate=True)
+        except Exception:
+            return None
+        if b"%PDF" in decoded[:1024]:
+            h.update(decoded)
+            return h.hexdigest()
+    return None
+
+
 def is_encrypted(doc: fitz.Document) -> bool:
     return bool(getattr(doc, "is_encrypted", False))
 
@@ -36,26 +65,50 @@ def page_to_image(page: fitz.Page, zoom: float = 2.0) -> np.ndarray:
     return img
 
 
-def _to_rect(value: Any) -> fitz.Rect | None:
-    try:
-        r = fitz.Rect(value)
-        if r.is_empty:
-            return None
-        return r
-    except Exception:
-        return None
+def _touch_mask(boxes: np.ndarray, box: np.ndarray, margin: float) -> np.ndarray:
+    """boxes 中与 box 相交、或在 x、y 方向间隙都不超过 margin 的行"""
+    gap_x = np.maximum(boxes[:, 0] - box[2], box[0] - boxes[:, 2])
+    gap_y = np.maximum(boxes[:, 1] - box[3], box[1] - boxes[:, 3])
+    return ((gap_x <= margin) & (gap_y <= margin)) | ((gap_x < 0) & (gap_y < 0))
 
 
-def _touch_or_intersect(a: fitz.Rect, b: fitz.Rect, margin: float) -> bool:
-    if a.intersects(b):
-        return True
-    ax0, ay0, ax1, ay1 = a.x0 - margin, a.y0 - margin, a.x1 + margin, a.y1 + margin
-    bx0, by0, bx1, by1 = b.x0, b.y0, b.x1, b.y1
-    if ax0 <= bx1 and ax1 >= bx0 and ay0 <= by1 and ay1 >= by0:
-        return True
-    bx0, by0, bx1, by1 = b.x0 - margin, b.y0 - margin, b.x1 + margin, b.y1 + margin
-    ax0, ay0, ax1, ay1 = a.x0, a.y0, a.x1, a.y1
-    return bx0 <= ax1 and bx1 >= ax0 and by0 <= ay1 and by1 >= ay0
+def _cluster_rects(boxes: np.ndarray, margin: float, chunk: int = 64) -> np.ndarray:
+    """
+    将矩形合并到任意两簇外接框都不接触为止，返回各簇外接框。
+    该不动点与合并顺序无关，因此可以：
+    1) 按块向量化判断矩形是否已被某簇外接框完全包含——这类矩形不改变任何簇，直接跳过；
+    2) 其余矩形与所有接触的簇合并，并级联吸收合并后新接触的簇，始终保持簇间互不接触。
+    输出按簇内最小输入下标排序，与逐个贪心合并、反复扫描至不变的结果顺序一致。
+    """
+    clusters = np.empty((0, 4), dtype=np.float64)
+    first = np.empty(0, dtype=np.int64)
+    for start in range(0, len(boxes), chunk):
+        block = boxes[start:start + chunk]
+        pending = np.arange(len(block))
+        if len(clusters):
+            contained = (
+                (block[:, None, 0] >= clusters[None, :, 0])
+                & (block[:, None, 1] >= clusters[None, :, 1])
+                & (block[:, None, 2] <= clusters[None, :, 2])
+                & (block[:, None, 3] <= clusters[None, :, 3])
+            ).any(axis=1)
+            pending = pending[~contained]
+        for j in pending:
+            cur = block[j].copy()
+            cur_first = start + int(j)
+            while len(clusters):
+                hit = _touch_mask(clusters, cur, margin)
+                if not hit.any():
+                    break
+                sel = clusters[hit]
+                cur[:2] = np.minimum(cur[:2], sel[:, :2].min(axis=0))
+                cur[2:] = np.maximum(cur[2:], sel[:, 2:].max(axis=0))
+                cur_first = min(cur_first, int(first[hit].min()))
+                clusters = clusters[~hit]
+                first = first[~hit]
+            clusters = np.vstack([clusters, cur[None, :]])
+            first = np.append(first, cur_first)
+    return clusters[np.argsort(first, kind="stable")]
 
 
 def extract_drawing_regions(
@@ -71,69 +124,48 @@ def extract_drawing_regions(
     except Exception:
         return []
 
-    rects: List[fitz.Rect] = []
+    raw: List[Tuple[float, float, float, float]] = []
     for d in drawings:
         r = d.get("rect") or d.get("bbox")
-        rr = _to_rect(r)
-        if rr is None:
-            continue
-        rr = rr & page_rect
-        if rr.is_empty:
-            continue
-        area_ratio = (float(rr.width) * float(rr.height)) / page_area
-        if area_ratio < 0.0008:
+        try:
+            raw.append((float(r[0]), float(r[1]), float(r[2]), float(r[3])))
+        except Exception:
             continue
-        rects.append(rr)
+    if not raw:
+        return []
 
-    if not rects:
+    px0, py0, px1, py1 = float(page_rect.x0), float(page_rect.y0), float(page_rect.x1), float(page_rect.y1)
+    arr = np.asarray(raw, dtype=np.float64)
+    keep = (arr[:, 0] < arr[:, 2]) & (arr[:, 1] < arr[:, 3])
+    # 与 fitz.Rect 的 & / | 一致：MuPDF 以 float32 计算矩形交并
+    rects = np.empty_like(arr)
+    rects[:, 0] = np.maximum(arr[:, 0], px0)
+    rects[:, 1] = np.maximum(arr[:, 1], py0)
+    rects[:, 2] = np.minimum(arr[:, 2], px1)
+    rects[:, 3] = np.minimum(arr[:, 3], py1)
+    rects = rects.astype(np.float32).astype(np.float64)
+    widths = rects[:, 2] - rects[:, 0]
+    heights = rects[:, 3] - rects[:, 1]
+    keep &= (widths > 0) & (heights > 0)
+    keep &= (widths * heights) / page_area >= 0.0008
+    rects = rects[keep]
+    if not len(rects):
         return []
 
-    rects.sort(key=lambda r: float(r.width) * float(r.height), reverse=True)
-
-    clusters: List[fitz.Rect] = []
-    for r in rects:
-        merged = False
-        for idx, c in enumerate(clusters):
-            if _touch_or_intersect(c, r, merge_margin):
-                clusters[idx] = c | r
-                merged = True
-                break
-        if not merged:
-            clusters.append(r)
-
-    changed = True
-    while changed and len(clusters) > 1:
-        changed = False
-        new_clusters: List[fitz.Rect] = []
-        for r in clusters:
-            merged = False
-            for idx, c in enumerate(new_clusters):
-                if _touch_or_intersect(c, r, merge_margin):
-                    new_clusters[idx] = c | r
-                    merged = True
-                    changed = True
-                    break
-            if not merged:
-                new_clusters.append(r)
-        clusters = new_clusters
+    areas = (rects[:, 2] - rects[:, 0]) * (rects[:, 3] - rects[:, 1])
+    rects = rects[np.argsort(-areas, kind="stable")]
+    clusters = _cluster_rects(rects, float(merge_margin))
 
-    out: List[Tuple[float, float, float, float]] = []
     pw, ph = float(page_rect.width), float(page_rect.height)
-    for c in clusters:
-        c = c & page_rect
-        if c.is_empty:
-            continue
-        w, h = float(c.width), float(c.height)
-        if w <= 1.0 or h <= 1.0:
-            continue
-        area_ratio = (w * h) / page_area
-        if area_ratio < float(min_area_ratio) or area_ratio > float(max_area_ratio):
-            continue
-        slender = min(w, h) / max(w, h) < 0.06
-        if slender and (w / max(pw, 1.0) > 0.8 or h / max(ph, 1.0) > 0.8):
-            continue
-        out.append((float(c.x0), float(c.y0), float(c.x1), float(c.y1)))
-    return out
+    w = clusters[:, 2] - clusters[:, 0]
+    h = clusters[:, 3] - clusters[:, 1]
+    area_ratio = (w * h) / page_area
+    keep = (w > 1.0) & (h > 1.0)
+    keep &= (area_ratio >= float(min_area_ratio)) & (area_ratio <= float(max_area_ratio))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slender = np.minimum(w, h) / np.maximum(w, h) < 0.06
+    keep &= ~(slender & ((w / max(pw, 1.0) > 0.8) | (h / max(ph, 1.0) > 0.8)))
+    return [tuple(float(v) for v in c) for c in clusters[keep]]
 
 
 def extract_blocks(page: fitz.Page) -> List[Dict[str, Any]]:
@@ -166,6 +198,54 @@ def extract_blocks(page: fitz.Page) -> List[Dict[str, Any]]:
         return output
 
 
+@dataclass
+class PageContent:
+    """
+    单次 dict 提取得到的页面内容。每个文本行会就地补充 "text"（拼接并去空白后的行文本）
+    与 "max_size"（行内最大字号），下游无需再遍历 spans。
+    """
+    blocks: List[Dict[str, Any]] = field(default_factory=list)
+    lines: List[Dict[str, Any]] = field(default_factory=list)
+    spans: List[Dict[str, Any]] = field(default_factory=list)
+    font_sizes: List[float] = field(default_factory=list)
+    text_len: int = 0
+    has_image_blocks: bool = False
+
+    @property
+    def scanned(self) -> bool:
+        # 与 is_scanned_page 口径一致：去空白后的文本少于 10 个字符
+        return self.text_len < 10
+
+
+def extract_page_content(page: fitz.Page) -> PageContent:
+    """
+    对页面内容流只解释一次，同时产出 blocks/lines/spans、正文字号分布、扫描页判定所需的文本长度
+    以及图片块标记，替代 is_scanned_page + extract_blocks + get_images 的多次提取。
+    """
+    blocks = extract_blocks(page)
+    content = PageContent(blocks=blocks)
+    text_parts: List[str] = []
+    for b in blocks:
+        if b.get("type") != 0:
+            if b.get("type") == 1:
+                content.has_image_blocks = True
+            continue
+        for line in b.get("lines", []):
+            spans = line.get("spans", [])
+            raw = "".join([s.get("text", "") for s in spans])
+            sizes = [s.get("size", 0) for s in spans if s.get("size") is not None]
+            max_size = float(max(sizes)) if sizes else 0.0
+            line["text"] = raw.strip()
+            line["max_size"] = max_size
+            content.lines.append(line)
+            content.spans.extend(spans)
+            if max_size > 0:
+                content.font_sizes.append(max_size)
+            text_parts.append(raw)
+    content.text_len = len("\n".join(text_parts).strip())
+    return content
+
+
 def split_columns(blocks: List[Dict[str, Any]], page_width: float) -> List[List[Dict[str, Any]]]:
     text_blocks = [b for b in blocks if b.get("type") == 0]
     if not text_blocks:
@@ -0,0 +1,119 @@
+from typing import Any, Callable, Dict, FrozenSet, Hashable, List, Optional, Sequence
+import time
+
+from sqlalchemy import text
+
+from utils.logger import setup_logger
+from .database import db_manager
+
+logger = setup_logger(__name__)
+
+# 列名与完整类型名（format_type），动态 SQL 用它给参数加显式类型转换
+_COLUMNS_SQL = """
+select c.relname::text, a.attname::text, format_type(a.atttypid, a.atttypmod)
+from pg_attribute a
+join pg_class c on c.oid = a.attrelid
+join pg_namespace n on n.oid = c.relnamespace
+where n.nspname = 'public'
+  and a.attnum > 0
+  and not a.attisdropped
+  and c.relname::text = any(cast(:tables as text[]))
+"""
+
+# 只取普通列上的唯一索引（不含表达式/部分索引），可直接作为 ON CONFLICT 目标
+_UNIQUE_SQL = """
+select t.relname::text, array_agg(a.attname::text)
+from pg_index i
+join pg_class t on t.oid = i.indrelid
+join pg_namespace n on n.oid = t.relnamespace
+join pg_attribute a on a.attrelid = t.oid and a.attnum = any(i.indkey)
+where n.nspname = 'public'
+  and i.indisunique
+  and i.indexprs is null
+  and i.indpred is null
+  and t.relname::text = any(cast(:tables as text[]))
+group by t.relname, i.indexrelid
+"""
+
+
+class SchemaCache:
+    """
+    持久化相关表的结构缓存：列、列类型与唯一索引在启动时一次查询得到，之后每次请求不再查系统表。
+    依赖表结构拼出的动态 SQL 按 schema 版本缓存；表结构变更后通过 refresh（admin 接口）重新载入。
+    """
+
+    def __init__(self, tables: Sequence[str]):
+        self.tables = list(tables)
+        self.version = 0
+        self.loaded_at: Optional[float] = None
+        self._columns: Dict[str, Dict[str, str]] = {}
+        self._unique: Dict[str, List[FrozenSet[str]]] = {}
+        self._statements: Dict[Hashable, Any] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    async def refresh(self, session=None) -> Dict[str, Any]:
+        if session is None:
+            async with db_manager.session() as own:
+                return await self.refresh(own)
+        params = {"tables": self.tables}
+        columns: Dict[str, Dict[str, str]] = {t: {} for t in self.tables}
+        for table, column, type_name in (await session.execute(text(_COLUMNS_SQL), params)).all():
+            columns.setdefault(str(table), {})[str(column)] = str(type_name)
+        unique: Dict[str, List[FrozenSet[str]]] = {t: [] for t in self.tables}
+        for table, cols in (await session.execute(text(_UNIQUE_SQL), params)).all():
+            unique.setdefault(str(table), []).append(frozenset(str(c) for c in cols or ()))
+        self._columns = columns
+        self._unique = unique
+        self._statements.clear()
+        self.version += 1
+        self.loaded_at = time.time()
+        logger.info(f"schema cache loaded (v{self.version}): " + ", ".join(
+            f"{t}={len(c)} cols" for t, c in sorted(self._columns.items())
+        ))
+        return self.stats()
+
+    async def ensure(self, session=None) -> None:
+        if not self.loaded:
+            await self.refresh(session)
+
+    def columns(self, table: str) -> FrozenSet[str]:
+        return frozenset(self._columns.get(table, {}))
+
+    def column_type(self, table: str, column: str) -> Optional[str]:
+        return self._columns.get(table, {}).get(column)
+
+    def conflict_target(self, table: str, key_columns: Sequence[str]) -> Optional[List[str]]:
+        """返回被 key_columns 完全覆盖的唯一索引列（按 key_columns 顺序）；没有时返回 None"""
+        keys = set(key_columns)
+        for cols in self._unique.get(table, []):
+            if cols and cols <= keys:
+                return [c for c in key_columns if c in cols]
+        return None
+
+    def statement(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """按 schema 版本缓存动态拼接的 SQL，refresh 后失效"""
+        stmt = self._statements.get(key)
+        if stmt is None:
+            stmt = build()
+            self._statements[key] = stmt
+        return stmt
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "tables": {
+                t: {
+                    "columns": sorted(self.columns(t)),
+                    "unique_keys": [sorted(c) for c in self._unique.get(t, [])],
+                }
+                for t in self.tables
+            },
+            "statements": len(self._statements),
+        }
+
+
+schema_cache = SchemaCache(["review_tasks", "agent_audit_result", "paper_sections", "reviews"])
@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+import re
+import time
+
+from config import SECTION_CACHE_PAPERS, SECTION_CACHE_TTL_SEC
+
+Section = Dict[str, Any]
+
+
+def _first_int(value: object) -> Optional[int]:
+    m = re.search(r"\d+", str(value or ""))
+    return int(m.group(0)) if m else None
+
+
+def _same_id(section_id: Any, chunk_int: int) -> bool:
+    try:
+        return section_id is not None and int(section_id) == chunk_int
+    except (TypeError, ValueError):
+        return False
+
+
+def resolve_section_content(sections: Sequence[Section], chunk_id: str, content_cols: Sequence[str]) -> Optional[str]:
+    """
+    在一篇论文的切片中找 chunk_id 对应的正文，优先级与逐条查询时一致：
+    section_id 等于 chunk_id 中的数字 > section_name 完全相同 > 去掉空格后相同；内容为空的切片跳过
+    """
+    chunk = str(chunk_id)
+    chunk_int = _first_int(chunk)
+    squashed = chunk.replace(" ", "")
+    rules = []
+    if chunk_int is not None:
+        rules += [(lambda s: _same_id(s.get("section_id"), chunk_int), col) for col in reversed(content_cols)]
+    for col in content_cols:
+        rules.append((lambda s: s.get("section_name") == chunk, col))
+        rules.append((lambda s: s.get("section_name") is not None and str(s["section_name"]).replace(" ", "") == squashed, col))
+    for match, col in rules:
+        for section in sections:
+            value = section.get(col)
+            if value and match(section):
+                return str(value)
+    return None
+
+
+class PaperSectionCache:
+    """
+    按 paper_id 缓存最近取过的整篇切片（LRU + TTL），同一论文的其它切片请求直接在内存中匹配。
+    只缓存命中过的论文；缓存里找不到某个切片时由调用方重新查库（可能是新写入的切片）。
+    本服务不写 paper_sections：切片被外部修改后最多 ttl_sec 内仍可能读到旧内容，
+    写入方可调用 invalidate（POST /admin/section_cache/invalidate）立即失效。
+    """
+
+    def __init__(self, max_papers: int = 64, ttl_sec: float = 30):
+        self.max_papers = max(0, int(max_papers))
+        self.ttl_sec = float(ttl_sec)
+        self._items: "OrderedDict[str, tuple[float, List[Section]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, paper_id: str) -> Optional[List[Section]]:
+        key = str(paper_id)
+        item = self._items.get(key)
+        if item is None or (self.ttl_sec > 0 and time.time() - item[0] > self.ttl_sec):
+            self._items.pop(key, None)
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, paper_id: str, sections: List[Section]) -> None:
+        if self.max_papers <= 0 or not sections:
+            return
+        key = str(paper_id)
+        self._items[key] = (time.time(), sections)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_papers:
+            self._items.popitem(last=False)
+
+    def invalidate(self, paper_id: str) -> bool:
+        return self._items.pop(str(paper_id), None) is not None
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "papers": len(self._items),
+            "sections": sum(len(v[1]) for v in self._items.values()),
+            "max_papers": self.max_papers,
+            "ttl_sec": self.ttl_sec,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+paper_section_cache = PaperSectionCache(max_papers=SECTION_CACHE_PAPERS, ttl_sec=SECTION_CACHE_TTL_SEC)
@@ -1,11 +1,19 @@
 from typing import List, Dict, Any, Optional, Tuple
 import asyncio
 import base64
+import bisect
 import math
 import re
 import json
-from config import LLM_TIMEOUT_SEC
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from config import LLM_TIMEOUT_SEC, SBERT_BATCH_SIZE, SBERT_MODEL_NAME
 from .llm_client import LLMClient
+from .llm_limits import ASCII_TOKENS_PER_CHAR, OTHER_TOKENS_PER_CHAR
+from .embedding_cache import embedding_cache
+from .expert_index import expert_comment_index
+from .keyword_index import KeywordFuzzyIndex
+from .term_automaton import AhoCorasick, fold_pattern, fold_text
 from sqlalchemy import select, func, or_
 from .database import db_manager, ExpertComment
 from utils.logger import setup_logger
@@ -13,6 +21,8 @@ from utils.logger import setup_logger
 logger = setup_logger(__name__)
 
 _sbert_model = None
+# fallback 哈希向量在缓存 key 中使用的“模型名”
+_FALLBACK_MODEL_NAME = "hash-fallback-768"
 
 
 def _get_sbert_model():
@@ -30,7 +40,7 @@ def _get_sbert_model():
     return _sbert_model
 
 
-def _embed_text_fallback(text: str) -> List[float]:
+def _compute_embedding_fallback(text: str) -> List[float]:
     import hashlib
     import numpy as np
 
@@ -51,7 +61,7 @@ def _embed_text_fallback(text: str) -> List[float]:
     return vec.astype(float).tolist()
 
 
-def _embed_text_sbert(text: str) -> List[float]:
+def _compute_embedding_sbert(text: str) -> List[float]:
     model = _get_sbert_model()
     if model is None:
         return _embed_text_fallback(text)
@@ -64,10 +74,87 @@ def _embed_text_sbert(text: str) -> List[float]:
     return vec_list
 
 
+def _embed_text_fallback(text: str) -> List[float]:
+    return embedding_cache.get_or_compute(_FALLBACK_MODEL_NAME, text, _compute_embedding_fallback)
+
+
+def _embed_text_sbert(text: str) -> List[float]:
+    if _get_sbert_model() is None:
+        return _embed_text_fallback(text)
+    return embedding_cache.get_or_compute(SBERT_MODEL_NAME, text, _compute_embedding_sbert)
+
+
+def _embed_texts_sbert(texts: List[str]) -> List[List[float]]:
+    """一次 encode 整批文本（只推理缓存未命中的部分）；模型不可用或维度不符时逐条退回 fallback"""
+    model = _get_sbert_model()
+    if model is None or not texts:
+        return [_embed_text_fallback(t) for t in texts]
+
+    out: List[Optional[List[float]]] = []
+    misses: List[int] = []
+    for i, text in enumerate(texts):
+        cached = embedding_cache.get(SBERT_MODEL_NAME, text)
+        out.append(cached.astype(float).tolist() if cached is not None else None)
+        if cached is None:
+            misses.append(i)
+    if misses:
+        vecs = model.encode([texts[i] for i in misses], batch_size=len(misses), normalize_embeddings=True)
+        computed: List[int] = []
+        for i, vec in zip(misses, vecs):
+            vec_list = vec.tolist() if hasattr(vec, "tolist") else list(vec)
+            if len(vec_list) != 768:
+                logger.warning(f"SBERT embedding dim mismatch: expected 768, got {len(vec_list)}. Using fallback embedding.")
+                out[i] = _embed_text_fallback(texts[i])
+                continue
+            out[i] = vec_list
+            computed.append(i)
+        # 整批写入缓存，磁盘层只落盘一次
+        embedding_cache.put_many(SBERT_MODEL_NAME, [texts[i] for i in computed], [out[i] for i in computed])
+    return out
+
+
 def _embed_text_expert_comment(text: str) -> List[float]:
     return _embed_text_sbert(text)
 
 
+class EmbeddingService:
+    """
+    批量向量化服务：按 batch_size 分批调用 SentenceTransformer.encode，
+    所有推理在同一个专用线程中串行执行，不占用默认线程池，也避免多线程同时调用模型。
+    """
+
+    def __init__(self, batch_size: int = 64):
+        self.batch_size = max(1, int(batch_size))
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sbert-embed")
+        return self._executor
+
+    def batches(self, items: List[Any], batch_size: Optional[int] = None) -> List[List[Any]]:
+        size = max(1, int(batch_size or self.batch_size))
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    async def embed(self, text: str) -> List[float]:
+        return (await self.embed_many([text]))[0]
+
+    async def embed_many(self, texts: List[str], batch_size: Optional[int] = None) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        out: List[List[float]] = []
+        for batch in self.batches(list(texts), batch_size):
+            out.extend(await loop.run_in_executor(self._get_executor(), _embed_texts_sbert, batch))
+        return out
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+embedding_service = EmbeddingService(batch_size=SBERT_BATCH_SIZE)
+
+
 def _element_get(element: Any, key: str) -> Any:
     if isinstance(element, dict):
         return element.get(key)
@@ -211,6 +298,7 @@ def _parse_author_year(citation: str) -> Optional[Dict[str, str]]:
 class TextPageMapper:
     """
     Helper class to map text indices back to page numbers.
+    片段按起始偏移有序存放，单点查询用 bisect，批量查询与区间查询用 NumPy 向量化完成。
     """
     def __init__(self, layout_data: Dict[str, Any]):
         self.elements = layout_data.get("elements", []) if isinstance(layout_data, dict) else []
@@ -233,21 +321,54 @@ class TextPageMapper:
                 current_pos += length + 1  # +1 for newline
         self.full_text = "\n".join(parts)
 
+        # 空片段不会命中任何位置，不进入查找表
+        segments = [(start, end, pg) for start, end, pg in self.mapping if end > start]
+        self._starts = [start for start, _, _ in segments]
+        self._ends = [end for _, end, _ in segments]
+        self._labels = [str(pg) if pg is not None else "?" for _, _, pg in segments]
+        self._raw_pages = [pg for _, _, pg in segments]
+        self._starts_arr = np.asarray(self._starts, dtype=np.int64)
+        self._ends_arr = np.asarray(self._ends, dtype=np.int64)
+        # 页码均为非负整数（常见情况）时，区间查询直接取 min/max；否则回退到逐页排序
+        if all(pg is None or (type(pg) is int and pg >= 0) for pg in self._raw_pages):
+            self._pages_arr = np.asarray([-1 if pg is None else pg for pg in self._raw_pages], dtype=np.int64)
+        else:
+            self._pages_arr = None
+
     def get_page_num(self, index: int) -> str:
-        # Binary search could be better but linear is fine for now
-        for start, end, pg in self.mapping:
-            if start <= index < end:
-                return str(pg) if pg is not None else "?"
+        i = bisect.bisect_right(self._starts, index) - 1
+        if i >= 0 and index < self._ends[i]:
+            return self._labels[i]
         return "?"
 
+    def get_page_nums(self, indices: Any) -> List[str]:
+        """批量查询：一次 searchsorted 映射一组偏移，顺序与输入一致"""
+        idx = np.asarray(indices, dtype=np.int64).reshape(-1)
+        if not len(idx) or not self._starts:
+            return ["?"] * len(idx)
+        pos = np.searchsorted(self._starts_arr, idx, side="right") - 1
+        safe = np.clip(pos, 0, None)
+        hit = (pos >= 0) & (idx < self._ends_arr[safe])
+        labels = self._labels
+        return [labels[p] if h else "?" for p, h in zip(safe.tolist(), hit.tolist())]
+
     def get_page_range(self, start_idx: int, end_idx: int) -> str:
-        pages = set()
-        for start, end, pg in self.mapping:
-            # Check overlap
-            if max(start, start_idx) < min(end, end_idx):
-                if pg is not None:
-                    pages.add(str(pg))
-        
+        if end_idx <= start_idx:
+            return "?"
+        # 与 [start_idx, end_idx) 相交的片段是连续的一段：end > start_idx 且 start < end_idx
+        lo = bisect.bisect_right(self._ends, start_idx)
+        hi = bisect.bisect_left(self._starts, end_idx)
+        if lo >= hi:
+            return "?"
+        if self._pages_arr is not None:
+            pages_arr = self._pages_arr[lo:hi]
+            pages_arr = pages_arr[pages_arr >= 0]
+            if not len(pages_arr):
+                return "?"
+            first, last = int(pages_arr.min()), int(pages_arr.max())
+            return str(first) if first == last else f"{first}-{last}"
+
+        pages = {str(pg) for pg in self._raw_pages[lo:hi] if pg is not None}
         if not pages:
             return "?"
         
@@ -266,8 +387,6 @@ class TextPageMapper:
             return f"{sorted_pages[0]}-{sorted_pages[-1]}"
 
 
-import difflib
-
 class TypoChecker:
     """
     语义判定 - 错别字红线判定
@@ -277,6 +396,8 @@ class TypoChecker:
         self.config = config
         self.max_typos_total = config.get("max_typos_total_warning", 10)
         self.critical_keywords = config.get("critical_keywords", [])
+        # 随规则一起构建，规则更新时 SemanticChecker 会重建本对象
+        self.keyword_index = KeywordFuzzyIndex(self.critical_keywords, cutoff=0.85)
 
     def check(self, content: str, issues: List[Dict], mapper: Optional['TextPageMapper'] = None):
         """
@@ -291,9 +412,11 @@ class TypoChecker:
         found_typos = []
 
         # 1. Critical Keywords Check (Fuzzy Matching)
-        # Find all word occurrences with their positions
-        word_matches = list(re.finditer(r"\b\w+\b", content))
-        words = [m.group() for m in word_matches]
+        # 去重词表：词 -> 出现位置（按文中顺序）
+        occurrences: Dict[str, List[int]] = {}
+        for m in re.finditer(r"\b\w+\b", content):
+            occurrences.setdefault(m.group(), []).append(m.start())
+        close_words = self.keyword_index.close_words(occurrences)
         
         # 对每个关键术语，寻找文本中相似但不完全相同的词
         for keyword in self.critical_keywords:
@@ -302,12 +425,14 @@ class TypoChecker:
             # TypoChecker 处理的是拼写错误，如 "TensorFlow" 写成 "TensorFlwo"
             
             is_english = bool(re.search(r"[A-Za-z]", keyword))
-            if is_english:
-                candidates = [w for w in words if abs(len(w) - len(keyword)) <= 2]
-            else:
-                candidates = [w for w in words if len(w) == len(keyword)]
             # 提高匹配阈值，避免将 "神经网络" 误判为 "卷积神经网络" 的错别字
-            matches = difflib.get_close_matches(keyword, candidates, n=3, cutoff=0.85)
+            # 等价于对全部候选词（含重复出现）调用 difflib.get_close_matches(n=3, cutoff=0.85)：
+            # 按 (ratio, 词) 降序取前 3 个，同一个词出现多次时可被重复选中
+            matches = []
+            for _, word in sorted(close_words.get(keyword, []), reverse=True):
+                matches.extend([word] * min(len(occurrences[word]), 3 - len(matches)))
+                if len(matches) >= 3:
+                    break
             
             for match in matches:
                 if match != keyword:
@@ -323,12 +448,9 @@ class TypoChecker:
                         continue
                     
                     # Find specific occurrences
-                    instances = [m for m in word_matches if m.group() == match]
-                    for instance in instances:
-                        pg = "?"
-                        if mapper:
-                            pg = mapper.get_page_num(instance.start())
-                            
+                    starts = occurrences[match]
+                    pages = mapper.get_page_nums(starts) if mapper else ["?"] * len(starts)
+                    for pg in pages:
                         issues.append({
                             "issue_type": "Critical_Keyword_Typo",
                             "severity": "Critical",
@@ -362,6 +484,7 @@ class TerminologyChecker:
         self.terms = config.get("terms", {})
         self.forbidden_variants = config.get("forbidden_variants", {})
         self.warn_on_mixed_allowed_forms = bool(config.get("warn_on_mixed_allowed_forms", False))
+        self._compile()
 
     def _norm_en(self, s: str) -> str:
         t = (s or "").strip().lower()
@@ -369,6 +492,112 @@ class TerminologyChecker:
         t = re.sub(r"\\s+", " ", t)
         return t
 
+    @staticmethod
+    def _form_regex(form: str, fold_spaces: bool) -> Tuple[str, int]:
+        if re.search(r"[A-Za-z]", form):
+            escaped = re.escape(form)
+            if fold_spaces:
+                escaped = escaped.replace(r"\ ", r"\s+")
+            return r"\b" + escaped + r"\b", re.IGNORECASE
+        return re.escape(form), 0
+
+    def _compile(self):
+        """
+        规则加载时把全部术语写法编译进两台 Aho–Corasick 自动机：
+        含英文字母的写法在大小写折叠、空白压缩后的文本上匹配候选，再用原有正则在原文处确认
+        （保留 \\b 词边界、\\s+ 空白折叠与 IGNORECASE 语义）；其余写法按原文逐字匹配。
+        """
+        # entry: (form, is_english, fold_spaces)
+        self._entries: List[Tuple[Any, bool, bool]] = []
+        self._allowed: List[Tuple[str, List[int]]] = []
+        self._forbidden: List[Tuple[str, List[int]]] = []
+        self._fallback: List[int] = []
+
+        def _add(form: Any, fold_spaces: bool) -> int:
+            entry_id = len(self._entries)
+            if not isinstance(form, str) or not form:
+                # 空串、非字符串等无法进入自动机的写法，检查时按原正则逐个处理
+                self._entries.append((form, False, fold_spaces))
+                self._fallback.append(entry_id)
+            else:
+                self._entries.append((form, bool(re.search(r"[A-Za-z]", form)), fold_spaces))
+            return entry_id
+
+        if self.warn_on_mixed_allowed_forms:
+            for canonical, variants in self.terms.items():
+                forms = [canonical] + list(variants or [])
+                self._allowed.append((canonical, [_add(form, True) for form in forms if form]))
+        for canonical, forbidden in self.forbidden_variants.items():
+            self._forbidden.append((canonical, [_add(form, False) for form in forbidden or []]))
+
+        english: Dict[str, List[int]] = {}
+        literal: Dict[str, List[int]] = {}
+        fallback = set(self._fallback)
+        for entry_id, (form, is_english, _) in enumerate(self._entries):
+            if entry_id in fallback:
+                continue
+            if is_english:
+                english.setdefault(fold_pattern(form), []).append(entry_id)
+            else:
+                literal.setdefault(form, []).append(entry_id)
+        self._english_ac = AhoCorasick(english)
+        self._english_targets = list(english.values())
+        self._english_regex = {
+            entry_id: re.compile(*self._form_regex(self._entries[entry_id][0], self._entries[entry_id][2]))
+            for ids in self._english_targets
+            for entry_id in ids
+        }
+        self._literal_ac = AhoCorasick(literal)
+        self._literal_targets = list(literal.values())
+
+    def _scan(self, content: str) -> Dict[int, List[Tuple[int, str]]]:
+        """
+        一次扫描收集所有写法的出现位置，返回 entry -> [(起始下标, 匹配文本)]。
+        每个写法内按 re.finditer 的语义取不重叠的最左匹配。
+        """
+        found: Dict[int, List[Tuple[int, str]]] = {}
+        if len(self._english_ac):
+            folded, offsets = fold_text(content)
+            candidates: Dict[int, set] = {}
+            for start, pattern_id in self._english_ac.iter_matches(folded):
+                orig = offsets[start]
+                for entry_id in self._english_targets[pattern_id]:
+                    candidates.setdefault(entry_id, set()).add(orig)
+            for entry_id, starts in candidates.items():
+                regex = self._english_regex[entry_id]
+                last_end = 0
+                hits = []
+                for start in sorted(starts):
+                    if start < last_end:
+                        continue
+                    m = regex.match(content, start)
+                    if m:
+                        hits.append((start, m.group()))
+                        last_end = m.end()
+                if hits:
+                    found[entry_id] = hits
+        if len(self._literal_ac):
+            literal_starts: Dict[int, List[int]] = {}
+            for start, pattern_id in self._literal_ac.iter_matches(content):
+                for entry_id in self._literal_targets[pattern_id]:
+                    literal_starts.setdefault(entry_id, []).append(start)
+            for entry_id, starts in literal_starts.items():
+                form = self._entries[entry_id][0]
+                last_end = 0
+                hits = []
+                for start in sorted(starts):
+                    if start >= last_end:
+                        hits.append((start, form))
+                        last_end = start + len(form)
+                found[entry_id] = hits
+        for entry_id in self._fallback:
+            form, _, fold_spaces = self._entries[entry_id]
+            pattern, flags = self._form_regex(form, fold_spaces)
+            hits = [(m.start(), m.group()) for m in re.finditer(pattern, content, flags=flags)]
+            if hits:
+                found[entry_id] = hits
+        return found
+
     def check(self, content: str, issues: List[Dict], mapper: Optional['TextPageMapper'] = None):
         """
         1. 提取专有名词，建立临时术语库
@@ -377,26 +606,24 @@ class TerminologyChecker:
         """
         if not content:
             return
-        
+
+        found = self._scan(content)
+
         if self.warn_on_mixed_allowed_forms:
-            for canonical, variants in self.terms.items():
-                forms = [canonical] + list(variants or [])
+            for canonical, entry_ids in self._allowed:
                 used_norm = set()
                 found_pages = set()
-                for form in forms:
-                    if not form:
+                for entry_id in entry_ids:
+                    form, is_english, _ = self._entries[entry_id]
+                    hits = found.get(entry_id, [])
+                    if not hits:
                         continue
-                    if re.search(r"[A-Za-z]", form):
-                        patt = r"\b" + re.escape(form).replace(r"\ ", r"\s+") + r"\b"
-                        for m in re.finditer(patt, content, flags=re.IGNORECASE):
-                            used_norm.add(self._norm_en(m.group()))
-                            if mapper:
-                                found_pages.add(mapper.get_page_num(m.start()))
+                    if is_english:
+                        used_norm.update(self._norm_en(text) for _, text in hits)
                     else:
-                        for m in re.finditer(re.escape(form), content):
-                            used_norm.add(form)
-                            if mapper:
-                                found_pages.add(mapper.get_page_num(m.start()))
+                        used_norm.add(form)
+                    if mapper:
+                        found_pages.update(mapper.get_page_nums([start for start, _ in hits]))
                 if len(used_norm) > 1:
                     pg_str = "?"
                     if found_pages:
@@ -413,22 +640,15 @@ class TerminologyChecker:
                     )
 
         # Check forbidden variants
-        for canonical, forbidden in self.forbidden_variants.items():
+        for canonical, entry_ids in self._forbidden:
             found_forbidden = []
             found_pages = set()
-            for form in forbidden or []:
-                if re.search(r"[A-Za-z]", form):
-                    pattern_str = r"\b" + re.escape(form) + r"\b"
-                    matches = list(re.finditer(pattern_str, content, flags=re.IGNORECASE))
-                else:
-                    pattern_str = re.escape(form)
-                    matches = list(re.finditer(pattern_str, content))
-                
-                if matches:
-                    found_forbidden.append(form)
-                    for m in matches:
-                        if mapper:
-                            found_pages.add(mapper.get_page_num(m.start()))
+            for entry_id in entry_ids:
+                hits = found.get(entry_id)
+                if hits:
+                    found_forbidden.append(self._entries[entry_id][0])
+                    if mapper:
+                        found_pages.update(mapper.get_page_nums([start for start, _ in hits]))
                             
             if found_forbidden:
                 pg_str = "?"
@@ -484,6 +704,17 @@ class PunctuationChecker:
 
         # Use elements directly to get page numbers
         elements = layout_data.get("elements", []) if isinstance(layout_data, dict) else []
+        mixed, position = self.check_elements(elements)
+        issues.extend(mixed)
+        issues.extend(position)
+
+    def check_elements(self, elements: List[Any]) -> Tuple[List[Dict], List[Dict]]:
+        """
+        逐元素检查，只依赖元素自身文本，可在流式布局解析中按页执行。
+        返回 (标点混用问题, 引用标注位置问题)。
+        """
+        mixed: List[Dict] = []
+        position: List[Dict] = []
 
         # 1. Mixed Punctuation Check
         if not self.allow_mixed:
@@ -544,7 +775,7 @@ class PunctuationChecker:
                         punct = segment[m.end() - 1] if m.end() > 0 else ""
                         if punct == "," and re.match(r"^\s*[A-Za-z][A-Za-z0-9_]*\s*=\s*[-+]?\d", segment[m.end():] or ""):
                             continue
-                        issues.append({
+                        mixed.append({
                             "issue_type": "Punctuation_Mixed",
                             "severity": "Info",
                             "evidence": _context_snippet(segment, m.start(), m.end()),
@@ -557,7 +788,7 @@ class PunctuationChecker:
                             continue
                         if self.allow_proof_dot and segment[max(0, m.start()-6):m.end()].strip().endswith(("证明.", "定理.", "引理.", "推论.", "命题.", "定义.", "注.", "例.", "已知:", "求:", "解:", "假设:")):
                             continue
-                        issues.append({
+                        mixed.append({
                             "issue_type": "Punctuation_Mixed",
                             "severity": "Info",
                             "evidence": _context_snippet(segment, m.start(), m.end()),
@@ -595,7 +826,7 @@ class PunctuationChecker:
                             if "）" not in pre_text[last_open:] and "（" not in post_text[:next_close]:
                                 continue
 
-                        issues.append({
+                        mixed.append({
                             "issue_type": "Punctuation_Mixed",
                             "severity": "Info",
                             "evidence": _context_snippet(segment, m.start(), m.end()),
@@ -616,13 +847,14 @@ class PunctuationChecker:
                 if text_val:
                     segment = str(text_val)
                     for m in punct_cite_pattern.finditer(segment):
-                        issues.append({
+                        position.append({
                             "issue_type": "Citation_Position_Inconsistent",
                             "severity": "Info",
                             "evidence": _context_snippet(segment, m.start(), m.end()),
                             "page_num": pg,
                             "message": "引用标注位置错误 (应置于标点符号之前)",
                         })
+        return mixed, position
 
 
 class CitationChecker:
@@ -714,13 +946,13 @@ class CitationChecker:
         numeric_pages = set()
         author_year_pages = set()
         if mapper:
-            for m in re.finditer(r"(?<![\w\]])\[(\d+(?:\s*,\s*\d+)*)\]", text):
-                numeric_pages.add(mapper.get_page_num(m.start()))
+            numeric_pages.update(
+                mapper.get_page_nums([m.start() for m in re.finditer(r"(?<![\w\]])\[(\d+(?:\s*,\s*\d+)*)\]", text)])
+            )
             author_year_pat = re.compile(
                 r"\(([^()]*\b[A-Za-z][A-Za-z'\-]+(?:\s+et\s+al\.)?[^()]*?,\s*\d{4}[a-z]?[^()]*)\)"
             )
-            for m in author_year_pat.finditer(text):
-                author_year_pages.add(mapper.get_page_num(m.start()))
+            author_year_pages.update(mapper.get_page_nums([m.start() for m in author_year_pat.finditer(text)]))
         
         if numeric_citations and author_year_citations:
             if not self.allow_mixed_styles:
@@ -916,6 +1148,43 @@ class CitationChecker:
                     )
 
 
+class _ChunkScale:
+    """
+    分块尺寸度量：unit="chars" 按字符数，unit="tokens" 按估算 token 数（前缀和数组，O(log n) 定位）。
+    """
+
+    def __init__(self, text: str, unit: str = "chars"):
+        self.unit = "tokens" if unit == "tokens" else "chars"
+        self._cum: Optional[np.ndarray] = None
+        self.newline = 1
+        if self.unit == "tokens":
+            codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+            weights = np.where(codes < 128, ASCII_TOKENS_PER_CHAR, OTHER_TOKENS_PER_CHAR)
+            self._cum = np.concatenate(([0.0], np.cumsum(weights)))
+            self.newline = ASCII_TOKENS_PER_CHAR
+
+    def size(self, start: int, end: int) -> float:
+        if self._cum is None:
+            return end - start
+        return float(self._cum[end] - self._cum[start])
+
+    def advance(self, start: int, budget: float, limit: int) -> int:
+        """从 start 起不超过 budget 的最远位置（不超过 limit，且至少前进 1）"""
+        if self._cum is None:
+            end = start + int(math.floor(budget))
+        else:
+            end = int(np.searchsorted(self._cum, self._cum[start] + budget, side="right")) - 1
+        return min(limit, max(end, start + 1))
+
+    def retreat(self, end: int, budget: float, floor: int) -> int:
+        """向前回退不超过 budget 的最靠前位置（不早于 floor）"""
+        if self._cum is None:
+            start = end - int(math.floor(budget))
+        else:
+            start = int(np.searchsorted(self._cum, self._cum[end] - budget, side="left"))
+        return max(floor, start)
+
+
 class SemanticChecker:
     """
     语义判定总入口
@@ -1003,6 +1272,14 @@ class SemanticChecker:
     ) -> List[str]:
         if not query_vector:
             return []
+        # 优先查进程内索引，未载入或已失效时回退到 pgvector
+        try:
+            hits = expert_comment_index.search(query_vector, top_k, require_text, require_metric_id, require_active)
+        except Exception as e:
+            logger.warning(f"expert comment index search failed, falling back to pgvector: {e}")
+            hits = None
+        if hits is not None:
+            return hits
         try:
             async with db_manager.session() as session:
                 distance = ExpertComment.embedding.op("<=>")(query_vector)
@@ -1023,15 +1300,17 @@ class SemanticChecker:
             logger.warning(f"expert comment retrieval failed: {e}")
             return []
 
-    async def generate_expert_commentary(
-        self, content: str, issues: List[Dict[str, Any]], top_k: int = 5
-    ) -> Tuple[Optional[str], Optional[str]]:
+    async def prepare_expert_context(self, content: str, top_k: int = 5) -> Optional[Dict[str, Any]]:
+        """
+        RAG 的前半段：抽取事实点、向量化并检索专家评语。只依赖正文，可与布局/语义校验并行执行。
+        返回 {"facts", "expert_texts"}；未启用或任一步失败时返回 None。
+        """
         if self.llm_client.provider == "none":
-            return None, None
+            return None
         llm_cfg = self.rules.get("rag_eval", {}) if isinstance(self.rules, dict) else {}
         enabled = bool(llm_cfg.get("enabled", True))
         if not enabled:
-            return None, None
+            return None
         top_k_val = int(llm_cfg.get("top_k", top_k) or top_k)
         top_k_val = max(1, min(20, top_k_val))
         require_text = bool(llm_cfg.get("require_text", True))
@@ -1040,13 +1319,13 @@ class SemanticChecker:
 
         facts = await self._extract_facts_llm(content)
         if not facts:
-            return None, None
+            return None
 
         try:
-            query_vector = await asyncio.to_thread(_embed_text_expert_comment, facts)
+            query_vector = await embedding_service.embed(facts)
         except Exception as e:
             logger.warning(f"facts embedding failed: {e}")
-            return None, None
+            return None
 
         expert_texts = await self._retrieve_expert_comments(
             query_vector,
@@ -1055,6 +1334,16 @@ class SemanticChecker:
             require_metric_id=require_metric_id,
             require_active=require_active,
         )
+        return {"facts": facts, "expert_texts": expert_texts}
+
+    async def compose_expert_commentary(
+        self, context: Optional[Dict[str, Any]], issues: List[Dict[str, Any]]
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """RAG 的后半段：结合问题概览生成 comment / suggestion，需要等问题列表就绪"""
+        if not context:
+            return None, None
+        facts = context.get("facts") or ""
+        expert_texts = context.get("expert_texts") or []
 
         issue_counts: Dict[str, int] = {}
         for it in issues or []:
@@ -1091,21 +1380,41 @@ class SemanticChecker:
             logger.warning(f"commentary generation failed: {e}")
         return None, None
 
-    def _split_long_paragraph(self, para: str, chunk_size: int, overlap: int) -> List[str]:
-        parts: List[str] = []
-        if not para or chunk_size <= 0:
-            return parts
-
-        s = 0
+    async def generate_expert_commentary(
+        self, content: str, issues: List[Dict[str, Any]], top_k: int = 5
+    ) -> Tuple[Optional[str], Optional[str]]:
+        context = await self.prepare_expert_context(content, top_k=top_k)
+        return await self.compose_expert_commentary(context, issues)
+
+    def _split_long_span(
+        self, text: str, para_start: int, para_end: int, chunk_size: float, overlap: float, scale: "_ChunkScale"
+    ) -> List[Tuple[int, int]]:
+        """把单个超长段落 text[para_start:para_end] 切成若干 (start, end) 区间（原文下标）"""
+        spans: List[Tuple[int, int]] = []
+        if para_end <= para_start or chunk_size <= 0:
+            return spans
+
+        s = para_start
         min_chunk_size = min(2000, chunk_size // 5)  # Soft lower limit to avoid tiny chunks
 
-        while s < len(para):
+        strong_punct = {".", "!", "?", "。", "！", "？"}
+        weak_punct = {";", ":", "；", "："}
+        clause_punct = {",", "，", "、"}
+
+        # Helper to find last occurrence in range [start, end)
+        def find_last_in_range(start_idx, end_idx, chars):
+            for i in range(end_idx - 1, start_idx - 1, -1):
+                if text[i] in chars:
+                    return i + 1 # Include the delimiter
+            return -1
+
+        while s < para_end:
             # 1. Determine maximum possible reach
-            target = min(s + chunk_size, len(para))
+            target = scale.advance(s, chunk_size, para_end)
             
             # If we reached the end, just take it
-            if target >= len(para):
-                parts.append(para[s:target])
+            if target >= para_end:
+                spans.append((s, para_end))
                 break
 
             # 2. Find the best cut point using weighted scoring
@@ -1113,21 +1422,10 @@ class SemanticChecker:
             # Strategy: Search backwards from target (+lookahead) to s + min_chunk_size.
             # Score = (Distance from s) + Priority_Bonus
             
-            strong_punct = {".", "!", "?", "。", "！", "？"}
-            weak_punct = {";", ":", "；", "："}
-            clause_punct = {",", "，", "、"}
-            
-            lookahead_limit = min(len(para), target + 100)
-            
-            # Helper to find last occurrence in range [start, end)
-            def find_last_in_range(start_idx, end_idx, chars):
-                for i in range(end_idx - 1, start_idx - 1, -1):
-                    if para[i] in chars:
-                        return i + 1 # Include the delimiter
-                return -1
+            lookahead_limit = min(para_end, target + 100)
 
             # Search range: [s + min_chunk_size, lookahead_limit]
-            search_start = min(s + min_chunk_size, target) 
+            search_start = min(scale.advance(s, min_chunk_size, para_end), target)
             search_end = lookahead_limit
             
             candidates = []
@@ -1155,7 +1453,7 @@ class SemanticChecker:
             # Bonus: 0.
             c_space = -1
             for i in range(search_end - 1, search_start - 1, -1):
-                if para[i].isspace():
+                if text[i].isspace():
                     c_space = i + 1
                     break
             if c_space != -1:
@@ -1193,47 +1491,62 @@ class SemanticChecker:
             if best_cut <= s:
                 best_cut = target
 
-            parts.append(para[s:best_cut])
+            spans.append((s, best_cut))
             
             # If we reached the end of the paragraph, stop here.
             # No need to backtrack for overlap if we are done.
-            if best_cut >= len(para):
+            if best_cut >= para_end:
                 break
             
             # Calculate next start with overlap
-            next_s = max(0, best_cut - overlap)
+            next_s = scale.retreat(best_cut, overlap, para_start)
             if next_s <= s:
                 next_s = best_cut
             s = next_s
             
-        return parts
+        return spans
 
-    def _chunk_text(self, text: str, chunk_size: int = 5000, overlap: int = 500) -> List[str]:
+    def _chunk_spans(
+        self, text: str, chunk_size: float = 5000, overlap: float = 500, unit: str = "chars"
+    ) -> List[Tuple[int, int]]:
         """
-        Split text into chunks respecting paragraph boundaries.
-        If a paragraph is too long, split it by character count.
+        Split text into chunks respecting paragraph boundaries and return (start, end) offsets into text.
+        If a paragraph is too long, split it by size.
+        unit="tokens" 时 chunk_size / overlap 按估算 token 数计，否则按字符数计。
         """
         if not text:
             return []
-            
-        paragraphs = text.split('\n')
-        chunks = []
+
+        scale = _ChunkScale(text, unit)
+        # 各段落在原文中的区间（按 '\n' 切分，不含换行符）
+        para_starts: List[int] = [0]
+        para_ends: List[int] = []
+        pos = text.find("\n")
+        while pos != -1:
+            para_ends.append(pos)
+            para_starts.append(pos + 1)
+            pos = text.find("\n", pos + 1)
+        para_ends.append(len(text))
+        para_sizes = [scale.size(a, b) + scale.newline for a, b in zip(para_starts, para_ends)] # +newline
+        n_paras = len(para_starts)
+        spans: List[Tuple[int, int]] = []
         
         start_idx = 0
-        while start_idx < len(paragraphs):
+        while start_idx < n_paras:
             current_len = 0
             end_idx = start_idx
             
             # Expand end_idx until chunk_size is reached
-            while end_idx < len(paragraphs):
-                p_len = len(paragraphs[end_idx]) + 1 # +1 for newline
+            while end_idx < n_paras:
+                p_len = para_sizes[end_idx]
                 
                 # Check if adding this paragraph exceeds limit
                 if current_len + p_len > chunk_size:
                     if current_len == 0:
-                        # Single huge paragraph - split by character count
-                        para = paragraphs[end_idx]
-                        chunks.extend(self._split_long_paragraph(para, chunk_size, overlap))
+                        # Single huge paragraph - split by size
+                        spans.extend(self._split_long_span(
+                            text, para_starts[end_idx], para_ends[end_idx], chunk_size, overlap, scale
+                        ))
                         
                         start_idx += 1
                         end_idx = start_idx # Signal processed
@@ -1247,25 +1560,24 @@ class SemanticChecker:
             
             # If we processed a huge paragraph (current_len == 0 but incremented start_idx), continue
             if current_len == 0:
-                if start_idx < len(paragraphs):
+                if start_idx < n_paras:
                     continue
                 else:
                     break
                  
             # If we formed a chunk
             if end_idx > start_idx:
-                chunk_text = "\n".join(paragraphs[start_idx:end_idx])
-                chunks.append(chunk_text)
+                spans.append((para_starts[start_idx], para_ends[end_idx - 1]))
             
-            if end_idx == len(paragraphs):
+            if end_idx == n_paras:
                 break
                 
             # Calculate next start_idx based on overlap (backtrack from end_idx)
             overlap_len = 0
             next_start = end_idx
-            # Try to keep at least 'overlap' characters from the end of current chunk
+            # Try to keep at least 'overlap' units from the end of current chunk
             while next_start > start_idx:
-                p_len = len(paragraphs[next_start-1]) + 1
+                p_len = para_sizes[next_start - 1]
                 if overlap_len + p_len > overlap:
                     break
                 overlap_len += p_len
@@ -1277,11 +1589,21 @@ class SemanticChecker:
                 
             start_idx = next_start
             
-        return chunks
+        return spans
+
+    def _chunk_text(self, text: str, chunk_size: float = 5000, overlap: float = 500, unit: str = "chars") -> List[str]:
+        return [text[a:b] for a, b in self._chunk_spans(text, chunk_size, overlap, unit)]
 
-    async def check(self, content: str, layout_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def check(
+        self,
+        content: str,
+        layout_data: Dict[str, Any],
+        punctuation_pages: Optional[List[Tuple[List[Dict], List[Dict]]]] = None,
+    ) -> Dict[str, Any]:
         """
         执行语义校验的主流程
+        punctuation_pages: 流式布局解析阶段已按页执行的 PunctuationChecker.check_elements 结果，
+        提供时不再重复执行标点检查。
         """
         # 支持规则热更新 (可选，每次请求检查更新)
         # self.rule_engine.reload() 
@@ -1313,7 +1635,14 @@ class SemanticChecker:
 
         try:
             logger.debug("Running punct_checker...")
-            self.punct_checker.check(text_content, layout_data, issues, mapper)
+            if punctuation_pages is not None:
+                if text_content:
+                    for mixed, _ in punctuation_pages:
+                        issues.extend(mixed)
+                    for _, position in punctuation_pages:
+                        issues.extend(position)
+            else:
+                self.punct_checker.check(text_content, layout_data, issues, mapper)
         except Exception as e:
             logger.error(f"punct_checker failed: {e}")
 
@@ -1331,6 +1660,13 @@ class SemanticChecker:
         llm_enabled = bool(llm_cfg.get("enabled", False))
         llm_max_text_chars = int(llm_cfg.get("max_text_chars", 60000))
         llm_max_chunks = int(llm_cfg.get("max_chunks", 2))
+        llm_concurrency = int(llm_cfg.get("concurrency", 4))
+        llm_chunk_timeout = float(llm_cfg.get("chunk_timeout_sec", LLM_TIMEOUT_SEC))
+        llm_chunk_unit = str(llm_cfg.get("chunk_unit", "chars"))
+        llm_chunk_size = float(llm_cfg.get("chunk_size", 15000))
+        llm_chunk_overlap = float(llm_cfg.get("chunk_overlap", 500))
+        llm_stream = bool(llm_cfg.get("stream", False))
+        llm_max_issues = int(llm_cfg.get("max_issues_per_chunk", 0) or 0)
 
         if not llm_enabled:
             logger.warning("LLM scan disabled by rules (llm_scan.enabled=false). Skipping LLM scan.")
@@ -1351,58 +1687,31 @@ class SemanticChecker:
                 # Increase chunk size to 15000 to reduce calls and preserve context (as requested by user)
                 # Modern LLMs (Gemini/Qwen) handle large context well.
                 # Removed limit on chunks to process full document
-                chunks = self._chunk_text(llm_text, chunk_size=15000, overlap=500)
-                logger.debug(f"Chunks created: {len(chunks)}")
-                
-                feedback_parts = []
-                last_pos = 0
-                
-                for i, chunk in enumerate(chunks):
-                    print(f"Processing chunk {i+1}/{len(chunks)}... Length: {len(chunk)}")
-                    logger.debug(f"Processing chunk {i+1}/{len(chunks)}... Length: {len(chunk)}")
-                    
-                    # Calculate page range for this chunk
-                    page_range = "?"
-                    start_pos = text_content.find(chunk, last_pos)
-                    # If not found (shouldn't happen), try from 0
-                    if start_pos == -1:
-                        start_pos = text_content.find(chunk)
-                    
-                    if start_pos != -1:
-                        end_pos = start_pos + len(chunk)
-                        page_range = mapper.get_page_range(start_pos, end_pos)
-                        # Advance last_pos, but allow for overlap (next chunk starts before this one ends)
-                        # We just need to ensure we don't find the SAME chunk instance again if there are duplicates?
-                        # Since chunks are sequential, simple find from last_pos is usually safe.
-                        # Ideally last_pos should track 'processed up to'.
-                        # But chunks overlap. Next chunk will start around 'end_pos - overlap'.
-                        # So let's update last_pos to start_pos + 1 to be safe.
-                        last_pos = start_pos + 1
-                    
-                    try:
-                        chunk_feedback = await self.llm_client.scan_document(chunk)
-                        if chunk_feedback:
-                            # Parse issues from this chunk
-                            chunk_issues, chunk_summary = self._parse_llm_response(chunk_feedback)
-                            
-                            # Use summary if available, otherwise raw feedback
-                            if chunk_summary:
-                                feedback_parts.append(chunk_summary)
-                            else:
-                                feedback_parts.append(chunk_feedback)
-                                
-                            # Tag issues as from LLM and add page range
-                            for issue in chunk_issues:
-                                issue["source"] = "LLM"
-                                if "page_num" not in issue or issue["page_num"] == "?":
-                                    issue["page_num"] = page_range
-                                    
-                            all_llm_issues.extend(chunk_issues)
-                    except Exception as e:
-                        logger.error(f"Chunk {i+1} processing failed: {e}")
+                spans = self._chunk_spans(
+                    llm_text, chunk_size=llm_chunk_size, overlap=llm_chunk_overlap, unit=llm_chunk_unit
+                )
+                logger.debug(f"Chunks created: {len(spans)}")
+                # 页码范围直接由分块区间得到，分块文本在发送时才切片
+                chunk_ranges = [mapper.get_page_range(a, b) for a, b in spans]
+
+                semaphore = asyncio.Semaphore(max(1, llm_concurrency))
+                results = await asyncio.gather(*[
+                    self._scan_chunk(
+                        i, len(spans), llm_text, span, page_range, semaphore, llm_chunk_timeout,
+                        stream=llm_stream, max_issues=llm_max_issues,
+                    )
+                    for i, (span, page_range) in enumerate(zip(spans, chunk_ranges))
+                ])
 
+                # 按分块顺序合并，单个分块超时或失败不影响其余分块
+                feedback_parts = []
+                for result in results:
+                    if result is None:
+                        continue
+                    chunk_issues, chunk_part = result
+                    feedback_parts.append(chunk_part)
+                    all_llm_issues.extend(chunk_issues)
 
-                
                 # Aggregate results
                 llm_feedback = "\n".join(feedback_parts)
                 logger.debug("LLM scan completed.")
@@ -1501,6 +1810,75 @@ class SemanticChecker:
             "score": self._calculate_score(issues)
         }
 
+    async def _scan_chunk(
+        self,
+        index: int,
+        total: int,
+        text: str,
+        span: Tuple[int, int],
+        page_range: str,
+        semaphore: asyncio.Semaphore,
+        timeout: float,
+        stream: bool = False,
+        max_issues: int = 0,
+    ) -> Optional[Tuple[List[Dict], str]]:
+        """
+        扫描单个分块 text[span[0]:span[1]]：受信号量限制并发，超过 timeout 秒视为失败。
+        返回 (issues, 反馈摘要)；失败、超时或无反馈时返回 None。timeout <= 0 表示不设截止时间。
+        stream=True 时逐个接收已闭合的问题对象，达到 max_issues（> 0）即提前结束，超时也保留已收到的问题；
+        max_issues 只用于流式提前结束，不截断完整解析出的问题。
+        """
+        streamed: List[Dict] = []
+
+        def _on_issue(issue: Dict) -> bool:
+            issue = self._filter_llm_issue(issue)
+            if issue is not None:
+                streamed.append(issue)
+            return not (max_issues > 0 and len(streamed) >= max_issues)
+
+        async with semaphore:
+            chunk = text[span[0]:span[1]]
+            logger.debug(f"Processing chunk {index+1}/{total}... Length: {len(chunk)}")
+            try:
+                if stream:
+                    request = self.llm_client.scan_document_stream(chunk, _on_issue)
+                else:
+                    request = self.llm_client.scan_document(chunk)
+                chunk_feedback = await asyncio.wait_for(request, timeout=timeout if timeout > 0 else None)
+            except asyncio.TimeoutError:
+                if not streamed:
+                    logger.error(f"Chunk {index+1} timed out after {timeout}s")
+                    return None
+                logger.warning(f"Chunk {index+1} timed out after {timeout}s, keeping {len(streamed)} streamed issues")
+                chunk_feedback = ""
+            except Exception as e:
+                logger.error(f"Chunk {index+1} processing failed: {e}")
+                return None
+        if not chunk_feedback and not streamed:
+            return None
+        chunk_issues: List[Dict] = streamed
+        chunk_summary = ""
+        if chunk_feedback:
+            try:
+                # Parse issues from this chunk
+                parsed_issues, chunk_summary = self._parse_llm_response(chunk_feedback)
+            except Exception as e:
+                logger.error(f"Chunk {index+1} processing failed: {e}")
+                return None
+            # 流式解析没有取到问题（如非标准格式）时以整段解析为准
+            if not streamed:
+                chunk_issues = parsed_issues
+        # Tag issues as from LLM and add page range
+        for issue in chunk_issues:
+            issue["source"] = "LLM"
+            if "page_num" not in issue or issue["page_num"] == "?":
+                issue["page_num"] = page_range
+        # Use summary if available, otherwise raw feedback
+        # 流式收到过问题时原文可能是提前结束的不完整 JSON，不能当作反馈返回
+        if streamed:
+            return chunk_issues, chunk_summary
+        return chunk_issues, chunk_summary or chunk_feedback
+
     def _parse_llm_response(self, response_text: str) -> Tuple[List[Dict], str]:
         """
         Parses the LLM response which is expected to be a JSON string.
@@ -1545,6 +1923,18 @@ class SemanticChecker:
         if not isinstance(issues, list):
             issues = []
             
+        filtered_issues = []
+        for issue in issues:
+            issue = self._filter_llm_issue(issue)
+            if issue is not None:
+                filtered_issues.append(issue)
+            
+        return filtered_issues, summary
+
+    def _filter_llm_issue(self, issue: Dict) -> Optional[Dict]:
+        """
+        LLM 问题的后处理：丢弃不在允许类型内的问题，修正误报；被丢弃时返回 None。
+        """
         # Post-process issues to handle false positives from LLM
         allowed_llm_issue_types = {
             "Terminology_Inconsistency",
@@ -1553,32 +1943,27 @@ class SemanticChecker:
             "Abbreviation_Definition",
             "Citation_Placeholder",
         }
-
-        filtered_issues = []
-        for issue in issues:
-            if issue.get("issue_type") not in allowed_llm_issue_types:
-                continue
-            # Fix for "Citation_Placeholder" being too aggressive on isolated lines
-            # If evidence looks like a valid citation (e.g. [12], [21,23]), it's likely a layout/parsing artifact, not a missing placeholder.
-            if issue.get("issue_type") == "Citation_Placeholder":
-                evidence = issue.get("evidence", "").strip()
-                msg = issue.get("message", "")
-                
-                # Condition 1: Evidence is a valid citation pattern
-                is_valid_citation = bool(re.match(r"^\[[\d,\s-]+\]$", evidence))
-                
-                # Condition 2: Message explicitly mentions "isolated" or "single line" citations
-                # and contains citation-like patterns
-                is_isolated_msg = ("孤立" in msg or "单独成行" in msg) and re.search(r"\[\d+(?:,\s*\d+)*\]", msg)
-                
-                if is_valid_citation or is_isolated_msg:
-                    issue["severity"] = "Info"
-                    issue["message"] += " (疑似排版或解析造成的孤立行，非内容缺失)"
-                    issue["issue_type"] = "Citation_Layout_Check"
-            
-            filtered_issues.append(issue)
-            
-        return filtered_issues, summary
+        if issue.get("issue_type") not in allowed_llm_issue_types:
+            return None
+        # Fix for "Citation_Placeholder" being too aggressive on isolated lines
+        # If evidence looks like a valid citation (e.g. [12], [21,23]), it's likely a layout/parsing artifact, not a missing placeholder.
+        if issue.get("issue_type") == "Citation_Placeholder":
+            evidence = issue.get("evidence", "").strip()
+            msg = issue.get("message", "")
+
+            # Condition 1: Evidence is a valid citation pattern
+            is_valid_citation = bool(re.match(r"^\[[\d,\s-]+\]$", evidence))
+
+            # Condition 2: Message explicitly mentions "isolated" or "single line" citations
+            # and contains citation-like patterns
+            is_isolated_msg = ("孤立" in msg or "单独成行" in msg) and re.search(r"\[\d+(?:,\s*\d+)*\]", msg)
+
+            if is_valid_citation or is_isolated_msg:
+                issue["severity"] = "Info"
+                issue["message"] += " (疑似排版或解析造成的孤立行，非内容缺失)"
+                issue["issue_type"] = "Citation_Layout_Check"
+
+        return issue
 
     def _calculate_score(self, issues: List[Dict]) -> int:
         """
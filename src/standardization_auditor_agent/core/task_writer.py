@@ -0,0 +1,369 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
+import os
+import threading
+
+from sqlalchemy.exc import DBAPIError, DisconnectionError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from config import TASK_WRITE_BATCH_SIZE, TASK_WRITE_FLUSH_SEC, TASK_WRITE_SPOOL_DIR, TASK_WRITE_STRICT
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+try:
+    import fcntl  # POSIX 文件锁；不可用时（Windows）只能保证单进程内的 spool 安全
+except ImportError:
+    fcntl = None
+
+Record = Dict[str, Any]
+
+_QUARANTINE_FILE = "quarantine.jsonl"
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """连接/超时类错误稍后重试可能成功；数据、约束、SQL 错误及记录本身的问题重试也不会成功"""
+    if isinstance(exc, (ConnectionError, OSError, asyncio.TimeoutError, PoolTimeoutError, DisconnectionError)):
+        return True
+    if isinstance(exc, DBAPIError):
+        return bool(exc.connection_invalidated) or isinstance(exc, (OperationalError, InterfaceError))
+    # 未经 SQLAlchemy 包装的 asyncpg 连接错误
+    return type(exc).__module__.startswith("asyncpg") and "Connection" in type(exc).__name__
+
+
+def _lock_file(f, blocking: bool = True) -> bool:
+    if fcntl is None:
+        return True
+    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+    try:
+        fcntl.flock(f.fileno(), flags)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _same_file(f, path: str) -> bool:
+    """持锁前文件可能已被其它进程改名认领，此时 path 指向的已不是 f"""
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def _parse_lines(f) -> List[Tuple[str, Record]]:
+    out: List[Tuple[str, Record]] = []
+    for line in f:
+        try:
+            item = json.loads(line)
+            out.append((str(item["key"]), item["record"]))
+        except (ValueError, KeyError, TypeError):
+            # 写到一半时进程退出留下的残行
+            logger.warning("skipping corrupt task status spool line")
+    return out
+
+
+class _Spool:
+    """
+    spool 目录：每个进程追加到自己的 spool-<pid>.jsonl（写入时持有 flock）。
+    重放时把目录下的 .jsonl 改名为 .inflight 并一直持有其 flock，直到这些记录写库成功或重新落盘后才删除；
+    进程中途退出时锁随之释放，其它进程（或重启后的进程）会接管遗留的 .inflight 文件。
+    数据错误被隔离的记录追加到 quarantine.jsonl，不再重放。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._claimed: Dict[str, Any] = {}
+        self._seq = 0
+
+    def _append(self, path: str, lines: List[str]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            f = open(path, "a", encoding="utf-8")
+            _lock_file(f)
+            if _same_file(f, path):
+                break
+            f.close()
+        try:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+    def append(self, items: List[Tuple[str, Record]]) -> None:
+        lines = [json.dumps({"key": k, "record": r}, ensure_ascii=False) + "\n" for k, r in items]
+        with self._lock:
+            self._append(os.path.join(self.directory, f"spool-{os.getpid()}.jsonl"), lines)
+
+    def quarantine(self, key: str, record: Record, error: str) -> None:
+        line = json.dumps({"key": key, "record": record, "error": error}, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._append(os.path.join(self.directory, _QUARANTINE_FILE), [line])
+
+    def claim(self) -> List[Tuple[str, Record]]:
+        """认领目录下全部待重放的记录（按文件修改时间先旧后新），文件保留到 release"""
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                return []
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if name.endswith(".inflight") and path not in self._claimed:
+                    # 能拿到锁说明认领它的进程已退出
+                    f = open(path, "r", encoding="utf-8")
+                    if _lock_file(f, blocking=False) and _same_file(f, path):
+                        self._claimed[path] = f
+                    else:
+                        f.close()
+                elif name.endswith(".jsonl") and name != _QUARANTINE_FILE:
+                    try:
+                        f = open(path, "r", encoding="utf-8")
+                    except FileNotFoundError:
+                        continue
+                    _lock_file(f)
+                    if not _same_file(f, path):
+                        f.close()
+                        continue
+                    self._seq += 1
+                    target = f"{path}.{os.getpid()}.{self._seq}.inflight"
+                    os.rename(path, target)
+                    self._claimed[target] = f
+            out: List[Tuple[str, Record]] = []
+            for _, f in sorted(self._claimed.items(), key=lambda kv: os.fstat(kv[1].fileno()).st_mtime):
+                f.seek(0)
+                out.extend(_parse_lines(f))
+            return out
+
+    def release(self) -> None:
+        """认领的记录已写库或已重新落盘：先删文件再释放锁，避免被其它进程再次接管"""
+        with self._lock:
+            for path, f in self._claimed.items():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                f.close()
+            self._claimed.clear()
+
+    def size(self) -> int:
+        total = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        for name in names:
+            if name == _QUARANTINE_FILE or not (name.endswith(".jsonl") or name.endswith(".inflight")):
+                continue
+            try:
+                total += os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        return total
+
+
+class TaskStatusWriter:
+    """
+    任务状态的写回（write-behind）队列：同一 key（任务）的多次状态变更在内存中合并为最新一条，
+    攒够 batch_size 条或距首条入队满 flush_sec 秒时批量写库。
+    连接类错误时记录追加到本地 spool 目录（JSON lines），按 retry_sec 起指数退避（最长 max_retry_sec）自动重放；
+    数据类错误时二分定位并隔离出错的记录，其余记录照常写入。进程关闭时 drain 全部写出。
+    strict=True 时 submit 直接同步写库，失败抛出异常（要求实时落库的部署使用）。
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 50,
+        flush_sec: float = 1.0,
+        spool_dir: Optional[str] = None,
+        strict: bool = False,
+        retry_sec: float = 1.0,
+        max_retry_sec: float = 60.0,
+    ):
+        self._flush: Optional[Callable[[List[Record]], Awaitable[None]]] = None
+        self._merge: Optional[Callable[[Record, Record], Record]] = None
+        self.batch_size = max(1, int(batch_size))
+        self.flush_sec = max(0.0, float(flush_sec))
+        self._spool = _Spool(spool_dir) if spool_dir else None
+        self.strict = strict
+        self.retry_sec = max(0.01, float(retry_sec))
+        self.max_retry_sec = max(self.retry_sec, float(max_retry_sec))
+        self._retry_delay = self.retry_sec
+        self._pending: Dict[str, Record] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.written = 0
+        self.batches = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.quarantined = 0
+        self.last_error: Optional[str] = None
+
+    def bind(
+        self,
+        flush: Callable[[List[Record]], Awaitable[None]],
+        merge: Optional[Callable[[Record, Record], Record]] = None,
+    ) -> None:
+        """注入批量写库函数；merge(old, new) 决定同一任务的两条记录如何合并，缺省时新记录直接覆盖"""
+        self._flush = flush
+        self._merge = merge
+
+    async def submit(self, key: str, record: Record) -> None:
+        """record 需可 JSON 序列化（写库失败时落 spool）"""
+        if self._flush is None:
+            raise RuntimeError("task status writer is not bound")
+        self.submitted += 1
+        if self.strict:
+            await self._flush([record])
+            self.written += 1
+            return
+        old = self._pending.pop(key, None)
+        if old is not None:
+            self.coalesced += 1
+            if self._merge is not None:
+                record = self._merge(old, record)
+        self._pending[key] = record
+        if len(self._pending) >= self.batch_size:
+            self.kick()
+        elif self._timer is None and (self._task is None or self._task.done()):
+            self._arm(self.flush_sec)
+
+    def _arm(self, delay: float) -> None:
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self.kick)
+
+    def kick(self) -> None:
+        """立即在后台开始一轮 flush（已在进行时不重复启动）"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def drain(self) -> None:
+        """写出全部待写记录（含 spool 中的历史记录）；写库失败的留在 spool 中"""
+        if self._task is not None and not self._task.done():
+            await self._task
+        if self._pending or self._spool_size():
+            self.kick()
+            await self._task
+
+    async def _run(self) -> None:
+        failed = False
+        settled = False
+        try:
+            await self._replay_spool()
+            while self._pending:
+                keys = list(self._pending)[:self.batch_size]
+                batch = [(k, self._pending.pop(k)) for k in keys]
+                done: set = set()
+                try:
+                    await self._write(batch, done)
+                except Exception as e:
+                    failed = True
+                    self.last_error = f"{type(e).__name__}: {e!r}"
+                    # 数据库不可用：本批未写入的与剩余记录全部落到 spool，退避后重放
+                    rest = [(k, r) for k, r in batch if k not in done] + list(self._pending.items())
+                    self._pending.clear()
+                    logger.error(f"task status flush failed, spooling {len(rest)} records: {self.last_error}")
+                    await asyncio.to_thread(self._spool_append, rest)
+                    settled = True
+                    return
+            settled = True
+        finally:
+            # 认领的 spool 记录只有在写库成功或重新落盘后才删除
+            if settled and self._spool is not None:
+                await asyncio.to_thread(self._spool.release)
+            # 本轮期间新入队的记录没有定时器（submit 只在空闲时设置），失败后 spool 也要有人重放
+            if failed:
+                delay = self._retry_delay
+                self._retry_delay = min(self._retry_delay * 2, self.max_retry_sec)
+                if self._pending or self._spool_size():
+                    self._arm(delay)
+            else:
+                self._retry_delay = self.retry_sec
+                if self._pending:
+                    self._arm(self.flush_sec)
+
+    async def _write(self, batch: List[Tuple[str, Record]], done: set) -> None:
+        """写入一批；数据类错误时二分定位并隔离出错的记录，连接类错误向上抛出"""
+        try:
+            await self._flush([r for _, r in batch])
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            if len(batch) > 1:
+                mid = len(batch) // 2
+                await self._write(batch[:mid], done)
+                await self._write(batch[mid:], done)
+                return
+            key, record = batch[0]
+            error = f"{type(e).__name__}: {e!r}"
+            self.quarantined += 1
+            self.last_error = error
+            logger.error(f"task status record {key} rejected by DB, quarantined: {error}")
+            if self._spool is not None:
+                await asyncio.to_thread(self._spool.quarantine, key, record, error)
+            done.add(key)
+            return
+        self.batches += 1
+        self.written += len(batch)
+        done.update(k for k, _ in batch)
+        self.last_error = None
+
+    async def _replay_spool(self) -> None:
+        if self._spool is None:
+            return
+        records = await asyncio.to_thread(self._spool.claim)
+        if not records:
+            return
+        self.replayed += len(records)
+        # spool 里的记录比内存中的旧：同一 key 以内存中的为准（合并保留最早的创建时间）
+        merged: Dict[str, Record] = {}
+        for key, record in records:
+            old = merged.pop(key, None)
+            merged[key] = self._merge(old, record) if (old is not None and self._merge) else record
+        for key, record in self._pending.items():
+            old = merged.pop(key, None)
+            merged[key] = self._merge(old, record) if (old is not None and self._merge) else record
+        self._pending = merged
+
+    def _spool_size(self) -> int:
+        return self._spool.size() if self._spool is not None else 0
+
+    def _spool_append(self, items: List[Tuple[str, Record]]) -> None:
+        if self._spool is None:
+            logger.error(f"no spool configured, dropping {len(items)} task status records")
+            return
+        self._spool.append(items)
+        self.spooled += len(items)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "strict": self.strict,
+            "pending": len(self._pending),
+            "spool_bytes": self._spool_size(),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "written": self.written,
+            "batches": self.batches,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "quarantined": self.quarantined,
+            "last_error": self.last_error,
+        }
+
+
+def _default_spool_dir() -> str:
+    # 不放在系统临时目录：spool 需要跨重启保留（容器部署时应挂载为卷）
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "var", "task_spool")
+
+
+task_status_writer = TaskStatusWriter(
+    batch_size=TASK_WRITE_BATCH_SIZE,
+    flush_sec=TASK_WRITE_FLUSH_SEC,
+    spool_dir=TASK_WRITE_SPOOL_DIR or _default_spool_dir(),
+    strict=TASK_WRITE_STRICT,
+)
@@ -0,0 +1,105 @@
+from typing import Dict, Iterable, Iterator, List, Tuple
+import re
+
+# re.IGNORECASE 额外视为等价、但 str.lower() 不会合并的字符（如 ı/i、ſ/s、µ/μ），统一映射到同一代表字符
+_CASE_EQUIVALENTS = str.maketrans(
+    "\u0131\u017f\u03bc\u1fbe\u03b9\u1fd3\u1fe3\u03d0\u03f5\u03d1\u03f0\u03d6\u03f1\u03c3\u03d5"
+    "\u1c80\u1c81\u1c82\u1c83\u1c85\u1c84\u1c86\u1c87\ua64b\u1e9b\ufb06",
+    "is\xb5\u0345\u0345\u0390\u03b0\u03b2\u03b5\u03b8\u03ba\u03c0\u03c1\u03c2\u03c6"
+    "\u0432\u0434\u043e\u0441\u0442\u0442\u044a\u0463\u1c88\u1e61\ufb05",
+)
+_WS_RUN = re.compile(r"\s+")
+
+
+def fold_case(text: str) -> str:
+    """逐字符大小写折叠，长度与原文一致（İ 的完整小写为两个字符，先按简单映射替换）。"""
+    return text.replace("\u0130", "i").lower().translate(_CASE_EQUIVALENTS)
+
+
+def fold_text(text: str) -> Tuple[str, List[int]]:
+    """
+    大小写折叠并把每段连续空白压成一个空格。
+    返回折叠后的文本与“折叠下标 -> 原文下标”的映射。
+    """
+    folded = fold_case(text)
+    offsets: List[int] = []
+    parts: List[str] = []
+    pos = 0
+    for m in _WS_RUN.finditer(folded):
+        start, end = m.span()
+        parts.append(folded[pos:start])
+        parts.append(" ")
+        offsets.extend(range(pos, start + 1))
+        pos = end
+    parts.append(folded[pos:])
+    offsets.extend(range(pos, len(folded)))
+    return "".join(parts), offsets
+
+
+def fold_pattern(pattern: str) -> str:
+    return _WS_RUN.sub(" ", fold_case(pattern))
+
+
+class AhoCorasick:
+    """
+    多模式字符串匹配自动机：构建一次，对文本只扫描一遍即可得到所有模式的全部出现位置（含重叠出现）。
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        for pattern in patterns:
+            self._add(pattern)
+        self._link()
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def _add(self, pattern: str) -> None:
+        pattern_id = len(self.patterns)
+        self.patterns.append(pattern)
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(pattern_id)
+
+    def _link(self) -> None:
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """产出 (起始下标, 模式编号)，按结束位置递增"""
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        patterns = self.patterns
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                for pattern_id in out[node]:
+                    yield i + 1 - len(patterns[pattern_id]), pattern_id
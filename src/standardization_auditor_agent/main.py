@@ -2,9 +2,11 @@ import os
 import sys
 import time
 import asyncio
+import json
 import re
 import uuid
-from typing import Any, Dict
+from datetime import datetime
+from typing import Any, Dict, Optional
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
@@ -25,16 +27,21 @@ if __name__ == "__main__":
         os.environ["LLM_PROVIDER"] = "deepseek"
 
 from models import AuditRequest, AuditResponse, AgentInfo, AuditResult, ResourceUsage, AuditLevel
-from core.layout_analysis import LayoutAnalyzer
+from core.layout_analysis import LayoutAnalyzer, shutdown_parse_pool
+from core.llm_http import llm_client_registry
 from api.layout_routes import router as layout_router
 from api.admin_routes import build_admin_router
-from core.semantic_check import SemanticChecker
-from core.pdf_utils import open_pdf
+from core.semantic_check import SemanticChecker, embedding_service
+from core.expert_index import expert_comment_index
 from core.database import db_manager, ReviewTask, TaskStatus
+from core.schema_cache import schema_cache
+from core.section_cache import paper_section_cache, resolve_section_content
+from core.task_writer import task_status_writer
 from core.rule_engine import RuleEngine
 from utils.logger import setup_logger, set_request_id, reset_request_id
-from config import AGENT_NAME, AGENT_VERSION, AGENT_CODE, AuditTag, LAYOUT_ANALYSIS_TIMEOUT, LLM_PROVIDER, DATABASE_URL, mask_database_url
-from sqlalchemy import select, text
+from config import AGENT_NAME, AGENT_VERSION, AGENT_CODE, AuditTag, LAYOUT_ANALYSIS_TIMEOUT, LAYOUT_TIMEOUT_GRACE, LLM_PROVIDER, DATABASE_URL, mask_database_url
+from sqlalchemy import bindparam, exists, insert, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import SQLAlchemyError
 
 # 初始化日志
@@ -55,6 +62,11 @@ async def lifespan(app: FastAPI):
     
     logger.info("Starting up: Connecting to database...")
     # await db_manager.engine.connect() # SQLAlchemy async engine is lazy
+    # 持久化相关表结构只在启动时读取一次；失败时在首次写库时重试
+    try:
+        await schema_cache.refresh()
+    except Exception as e:
+        logger.warning(f"Schema cache not loaded at startup: {type(e).__name__}: {e!r}")
     
     # Load rules from DB (Task A: Dynamic Rule Loading)
     loaded = await rule_engine.load_rules_from_db()
@@ -68,10 +80,18 @@ async def lifespan(app: FastAPI):
     semantic_checker.update_rules(rule_engine.rules)
 
     logger.info("Rules loaded: %s", list(rule_engine.rules.keys()))
+    # 专家评语向量索引；载入失败时 RAG 检索回退到 pgvector
+    await expert_comment_index.load()
+    # 上次运行未写入数据库的任务状态（spool）在后台重放
+    task_status_writer.kick()
     yield
-    # 关闭时：断开数据库
-    logger.info("Shutting down: Closing database connection...")
+    # 关闭时：写出队列中的任务状态，再断开数据库
+    logger.info("Shutting down: Flushing task status and closing database connection...")
+    await task_status_writer.drain()
     await db_manager.close()
+    await llm_client_registry.aclose()
+    embedding_service.close()
+    await asyncio.to_thread(shutdown_parse_pool)
 
 app = FastAPI(title=AGENT_NAME, version=AGENT_VERSION, lifespan=lifespan)
 app.include_router(layout_router)
@@ -163,78 +183,82 @@ def _extract_first_int(value: object) -> int | None:
         return None
 
 
+def _build_content_lookup_sql(section_cols: frozenset, review_cols: frozenset, with_review: bool) -> str:
+    """
+    一条 UNION ALL 取出论文的全部切片，以及（chunk_id 含数字时）对应的 reviews 内容；
+    切片在 Python 中按优先级匹配并按论文缓存，兄弟切片不再查库
+    """
+    def col(name: str) -> str:
+        return f"{name}::text" if name in section_cols else "null::text"
+
+    sid = "section_id::bigint" if "section_id" in section_cols else "null::bigint"
+    name = "section_name::text" if "section_name" in section_cols else "null::text"
+    sql = (
+        f"select 0 as src, {sid} as section_id, {name} as section_name, "
+        f"{col('content')} as content, {col('section_content')} as section_content "
+        "from paper_sections where paper_id = cast(:paper_id as uuid)"
+    )
+    review_keys = [c for c in ("review_id", "section_id") if c in review_cols]
+    if with_review and "review_content" in review_cols and "paper_id" in review_cols and review_keys:
+        match = " or ".join(f"{c} = :sid" for c in review_keys)
+        sql += (
+            " union all select 1, null, null, review_content::text, null from reviews "
+            f"where paper_id = cast(:paper_id as uuid) and ({match})"
+        )
+    return sql + " order by 1, 2"
+
+
 async def _fetch_content_from_db(session, paper_id: str, chunk_id: str) -> str | None:
     paper_id_str = str(paper_id)
     chunk_id_str = str(chunk_id)
     chunk_int = _extract_first_int(chunk_id_str)
 
-    cols: set[str] = set()
     try:
-        rows = await session.execute(
-            text(
-                """
-                select column_name
-                from information_schema.columns
-                where table_schema = 'public' and table_name = 'paper_sections'
-                """
-            )
-        )
-        cols = {str(r[0]) for r in (rows.fetchall() or []) if r and r[0]}
-    except Exception:
-        cols = set()
-
-    content_cols = [c for c in ("content", "section_content") if c in cols]
+        await schema_cache.ensure(session)
+    except Exception as e:
+        logger.warning(f"schema cache unavailable for content lookup: {type(e).__name__}: {e!r}")
+        return None
+    section_cols = schema_cache.columns("paper_sections")
+    content_cols = [c for c in ("content", "section_content") if c in section_cols]
     if not content_cols:
         return None
 
-    attempts: list[tuple[str, dict]] = []
-    for content_col in content_cols:
-        if "section_name" in cols:
-            attempts.append(
-                (
-                    f"select {content_col} from paper_sections where paper_id = cast(:paper_id as uuid) and section_name = :chunk_id limit 1",
-                    {"paper_id": paper_id_str, "chunk_id": chunk_id_str},
-                )
-            )
-            attempts.append(
-                (
-                    f"select {content_col} from paper_sections where paper_id = cast(:paper_id as uuid) and replace(section_name, ' ', '') = replace(:chunk_id, ' ', '') limit 1",
-                    {"paper_id": paper_id_str, "chunk_id": chunk_id_str},
-                )
-            )
-        if chunk_int is not None and "section_id" in cols:
-            attempts.insert(
-                0,
-                (
-                    f"select {content_col} from paper_sections where paper_id = cast(:paper_id as uuid) and section_id = :sid limit 1",
-                    {"paper_id": paper_id_str, "sid": chunk_int},
-                ),
-            )
-    if chunk_int is not None:
-        attempts.append(
-            (
-                "select review_content from reviews where paper_id = cast(:paper_id as uuid) and (review_id = :sid or section_id = :sid) limit 1",
-                {"paper_id": paper_id_str, "sid": chunk_int},
-            ),
-        )
+    cached = paper_section_cache.get(paper_id_str)
+    if cached is not None:
+        content = resolve_section_content(cached, chunk_id_str, content_cols)
+        if content:
+            return content
 
-    for sql, params in attempts:
+    with_review = chunk_int is not None
+    sql = schema_cache.statement(
+        ("content_lookup", with_review),
+        lambda: text(_build_content_lookup_sql(section_cols, schema_cache.columns("reviews"), with_review)),
+    )
+    params: Dict[str, Any] = {"paper_id": paper_id_str}
+    if with_review:
+        params["sid"] = chunk_int
+    try:
+        rows = (await session.execute(sql, params)).all()
+    except SQLAlchemyError as e:
+        logger.error(f"content lookup failed: {type(e).__name__}: {e!r}")
         try:
-            row = (await session.execute(text(sql), params)).first()
-            if row and row[0]:
-                return str(row[0])
-        except SQLAlchemyError:
-            try:
-                await session.rollback()
-            except Exception:
-                pass
-            continue
+            await session.rollback()
         except Exception:
-            try:
-                await session.rollback()
-            except Exception:
-                pass
-            continue
+            pass
+        return None
+
+    sections = [
+        {"section_id": sid, "section_name": name, "content": c, "section_content": sc}
+        for src, sid, name, c, sc in rows
+        if src == 0
+    ]
+    paper_section_cache.put(paper_id_str, sections)
+    content = resolve_section_content(sections, chunk_id_str, content_cols)
+    if content:
+        return content
+    for src, _, _, review_content, _ in rows:
+        if src == 1 and review_content:
+            return str(review_content)
     return None
 
 
@@ -352,33 +376,44 @@ def _build_agent_audit_result_payload(request: AuditRequest, debug: Dict[str, An
     return {"agent_code": AGENT_CODE, "audit_results": audit_results}
 
 
-async def _get_table_columns(session, table_name: str) -> set[str]:
-    sql = """
-    select column_name
-    from information_schema.columns
-    where table_schema = 'public' and table_name = :t
-    """
-    rows = await session.execute(text(sql), {"t": table_name})
-    cols = {str(r[0]) for r in (rows.fetchall() or []) if r and r[0]}
-    return cols
+def _sql_param(table: str, column: str) -> str:
+    col_type = schema_cache.column_type(table, column)
+    return f"cast(:{column} as {col_type})" if col_type else f":{column}"
 
 
-async def _upsert_agent_audit_result(
-    session,
-    request: AuditRequest,
-    status: TaskStatus,
-    error_msg: str | None,
-    debug: Dict[str, Any] | None,
-) -> None:
-    cols = await _get_table_columns(session, "agent_audit_result")
-    if not cols:
-        return
+def _build_agent_audit_result_upsert(columns: tuple[str, ...], key_cols: tuple[str, ...]) -> str:
+    """
+    单条语句完成 agent_audit_result 的插入或更新：
+    有覆盖键列的唯一索引时用 INSERT ... ON CONFLICT，否则用 UPDATE ... RETURNING 的 CTE 加 INSERT ... WHERE NOT EXISTS。
+    """
+    table = "agent_audit_result"
+    insert_cols = ", ".join(columns)
+    values = ", ".join(_sql_param(table, c) for c in columns)
+    if not key_cols:
+        return f"insert into {table} ({insert_cols}) values ({values})"
+
+    conflict = schema_cache.conflict_target(table, key_cols)
+    if conflict:
+        set_cols = [c for c in columns if c not in conflict]
+        action = f"update set {', '.join(f'{c} = excluded.{c}' for c in set_cols)}" if set_cols else "nothing"
+        return f"insert into {table} ({insert_cols}) values ({values}) on conflict ({', '.join(conflict)}) do {action}"
+
+    where = " and ".join(f"{c} = {_sql_param(table, c)}" for c in key_cols)
+    set_cols = [c for c in columns if c not in key_cols]
+    if not set_cols:
+        return f"insert into {table} ({insert_cols}) select {values} where not exists (select 1 from {table} where {where})"
+    sets = ", ".join(f"{c} = {_sql_param(table, c)}" for c in set_cols)
+    return (
+        f"with updated as (update {table} set {sets} where {where} returning 1) "
+        f"insert into {table} ({insert_cols}) select {values} where not exists (select 1 from updated)"
+    )
 
-    payload = _build_agent_audit_result_payload(request, debug)
 
+def _agent_audit_result_data(audit: Dict[str, Any], cols) -> Dict[str, Any]:
+    """按 agent_audit_result 实际存在的列取值"""
     data: Dict[str, Any] = {}
     if "result_json" in cols:
-        data["result_json"] = payload
+        data["result_json"] = json.dumps(audit["result_json"], ensure_ascii=False)
     if "agent_code" in cols:
         data["agent_code"] = AGENT_CODE
     if "agent_name" in cols:
@@ -386,57 +421,160 @@ async def _upsert_agent_audit_result(
     if "agent_version" in cols:
         data["agent_version"] = AGENT_VERSION
     if "status" in cols:
-        data["status"] = status.value
+        data["status"] = audit["status"]
     if "error_msg" in cols:
-        data["error_msg"] = error_msg
+        data["error_msg"] = audit["error_msg"]
     if "request_id" in cols:
-        data["request_id"] = str(request.request_id)
+        data["request_id"] = audit["request_id"]
     if "task_id" in cols:
         try:
-            data["task_id"] = uuid.UUID(str(request.request_id))
+            data["task_id"] = uuid.UUID(audit["request_id"])
         except Exception:
             pass
     if "paper_id" in cols:
         try:
-            data["paper_id"] = uuid.UUID(str(request.metadata.paper_id))
+            data["paper_id"] = uuid.UUID(audit["paper_id"])
         except Exception:
-            data["paper_id"] = str(request.metadata.paper_id)
+            data["paper_id"] = audit["paper_id"]
     if "chunk_id" in cols:
-        data["chunk_id"] = str(request.metadata.chunk_id)
-
-    key_cols = [c for c in ["request_id", "task_id", "paper_id", "chunk_id", "agent_code"] if c in cols and c in data]
-    exists = False
-    if key_cols:
-        where = " and ".join([f"{c} = :{c}" for c in key_cols])
-        check_sql = f"select 1 from agent_audit_result where {where} limit 1"
-        exists = (await session.execute(text(check_sql), {c: data[c] for c in key_cols})).first() is not None
-
-    if exists and key_cols:
-        set_cols = [c for c in data.keys() if c not in set(key_cols)]
-        if not set_cols:
-            return
-        sets = []
-        for c in set_cols:
-            if c == "result_json":
-                sets.append(f"{c} = :{c}::jsonb")
-            else:
-                sets.append(f"{c} = :{c}")
-        where = " and ".join([f"{c} = :{c}" for c in key_cols])
-        upd_sql = f"update agent_audit_result set {', '.join(sets)} where {where}"
-        await session.execute(text(upd_sql), data)
-        return
+        data["chunk_id"] = audit["chunk_id"]
+    return data
 
-    insert_cols = list(data.keys())
-    if not insert_cols:
+
+async def _upsert_agent_audit_results(session, audits: list[Dict[str, Any]]) -> None:
+    cols = schema_cache.columns("agent_audit_result")
+    if not cols:
         return
-    vals = []
-    for c in insert_cols:
-        if c == "result_json":
-            vals.append(f":{c}::jsonb")
-        else:
-            vals.append(f":{c}")
-    ins_sql = f"insert into agent_audit_result ({', '.join(insert_cols)}) values ({', '.join(vals)})"
-    await session.execute(text(ins_sql), data)
+
+    # 列集合相同的记录共用一条语句，executemany 一次发送
+    groups: Dict[tuple, list] = {}
+    for audit in audits:
+        data = _agent_audit_result_data(audit, cols)
+        if not data:
+            continue
+        columns = tuple(data.keys())
+        key_cols = tuple(c for c in ["request_id", "task_id", "paper_id", "chunk_id", "agent_code"] if c in data)
+        groups.setdefault((columns, key_cols), []).append(data)
+
+    for (columns, key_cols), rows in groups.items():
+        sql = schema_cache.statement(
+            ("agent_audit_result", columns, key_cols),
+            lambda: text(_build_agent_audit_result_upsert(columns, key_cols)),
+        )
+        await session.execute(sql, rows)
+
+
+_TASK_KEY_COLUMNS = ("task_id", "paper_id", "chunk_id", "agent_name")
+_TASK_VALUE_COLUMNS = (
+    "agent_version", "status", "score", "audit_level", "result_json",
+    "error_msg", "usage_tokens", "latency_ms", "updated_at",
+)
+
+
+def _build_review_task_upsert():
+    """
+    review_tasks 单条语句写入：(task_id, paper_id, chunk_id, agent_name) 上有唯一索引时用 ON CONFLICT；
+    否则更新该键下最新的一行，不存在时插入（与原先先查后写的语义一致）。
+    """
+    table = ReviewTask.__table__
+
+    def p(c: str):
+        return bindparam(f"p_{c}", type_=table.c[c].type)
+
+    insert_cols = list(_TASK_KEY_COLUMNS) + list(_TASK_VALUE_COLUMNS) + ["created_at"]
+    conflict = schema_cache.conflict_target("review_tasks", _TASK_KEY_COLUMNS)
+    if conflict:
+        stmt = pg_insert(table).values({c: p(c) for c in insert_cols})
+        return stmt.on_conflict_do_update(
+            index_elements=conflict,
+            set_={c: stmt.excluded[c] for c in _TASK_VALUE_COLUMNS},
+        )
+
+    latest = (
+        select(table.c.id)
+        .where(*[table.c[c] == p(c) for c in _TASK_KEY_COLUMNS])
+        .order_by(table.c.created_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    updated = (
+        update(table)
+        .where(table.c.id == latest)
+        .values({c: p(c) for c in _TASK_VALUE_COLUMNS})
+        .returning(table.c.id)
+        .cte("updated")
+    )
+    rows = select(*[p(c) for c in insert_cols]).where(~exists(select(updated.c.id)))
+    return insert(table).from_select(insert_cols, rows).add_cte(updated)
+
+
+def _task_status_record(
+    request: AuditRequest,
+    response: AuditResponse | None,
+    status: TaskStatus,
+    error_msg: str | None,
+    debug: Dict[str, Any] | None,
+) -> Dict[str, Any]:
+    """一次状态变更要写入 review_tasks 与 agent_audit_result 的内容（可 JSON 序列化，便于落 spool）"""
+    payload = response.model_dump(mode="json") if response else None
+    if isinstance(payload, dict) and debug:
+        payload["debug"] = debug
+    now = datetime.utcnow().isoformat()
+    return {
+        "task": {
+            "task_id": str(request.request_id),
+            "paper_id": str(request.metadata.paper_id),
+            "chunk_id": str(request.metadata.chunk_id),
+            "agent_name": AGENT_NAME,
+            "agent_version": AGENT_VERSION,
+            "status": status.value,
+            "score": response.result.score if response else None,
+            "audit_level": response.result.audit_level.value if response else None,
+            "result_json": payload,
+            "error_msg": error_msg,
+            "usage_tokens": response.usage.tokens if response else 0,
+            "latency_ms": response.usage.latency_ms if response else 0,
+            "updated_at": now,
+            "created_at": now,
+        },
+        "audit": {
+            "request_id": str(request.request_id),
+            "paper_id": str(request.metadata.paper_id),
+            "chunk_id": str(request.metadata.chunk_id),
+            "status": status.value,
+            "error_msg": error_msg,
+            "result_json": _build_agent_audit_result_payload(request, debug),
+        },
+    }
+
+
+def _merge_task_status_records(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """同一任务多次状态变更合并为最新一条，创建时间保留首次入队的"""
+    new["task"]["created_at"] = old["task"]["created_at"]
+    return new
+
+
+def _review_task_params(task: Dict[str, Any]) -> Dict[str, Any]:
+    params = {f"p_{k}": v for k, v in task.items()}
+    params["p_paper_id"] = uuid.UUID(task["paper_id"])
+    params["p_status"] = TaskStatus(task["status"])
+    params["p_updated_at"] = datetime.fromisoformat(task["updated_at"])
+    params["p_created_at"] = datetime.fromisoformat(task["created_at"])
+    return params
+
+
+async def _flush_task_status_records(records: list[Dict[str, Any]]) -> None:
+    """一个事务内批量写入 review_tasks 与 agent_audit_result"""
+    async with db_manager.session() as session:
+        await schema_cache.ensure(session)
+        stmt = schema_cache.statement(("review_tasks", "upsert"), _build_review_task_upsert)
+        await session.execute(stmt, [_review_task_params(r["task"]) for r in records])
+        await _upsert_agent_audit_results(session, [r["audit"] for r in records])
+        await session.commit()
+    logger.info(f"{len(records)} task status record(s) saved to DB.")
+
+
+task_status_writer.bind(_flush_task_status_records, merge=_merge_task_status_records)
 
 
 async def save_result_to_db(
@@ -447,50 +585,13 @@ async def save_result_to_db(
     debug: Dict[str, Any] | None = None,
 ):
     """
-    异步写入 review_tasks 表，符合开发规范的数据持久化要求
+    写入 review_tasks / agent_audit_result，符合开发规范的数据持久化要求。
+    默认进入写回队列批量落库；TASK_WRITE_STRICT=1 时同步写库，失败抛出异常
     """
+    record = _task_status_record(request, response, status, error_msg, debug)
+    key = f"{request.request_id}|{request.metadata.paper_id}|{request.metadata.chunk_id}"
     try:
-        async with db_manager.session() as session:
-            stmt = (
-                select(ReviewTask)
-                .where(
-                    ReviewTask.task_id == request.request_id,
-                    ReviewTask.paper_id == request.metadata.paper_id,
-                    ReviewTask.chunk_id == request.metadata.chunk_id,
-                    ReviewTask.agent_name == AGENT_NAME,
-                )
-                .order_by(ReviewTask.created_at.desc())
-                .limit(1)
-            )
-            result = await session.execute(stmt)
-            task = result.scalar_one_or_none()
-
-            if task is None:
-                task = ReviewTask(
-                    task_id=request.request_id,
-                    paper_id=request.metadata.paper_id,
-                    chunk_id=request.metadata.chunk_id,
-                    agent_name=AGENT_NAME,
-                    agent_version=AGENT_VERSION,
-                )
-                session.add(task)
-
-            task.agent_version = AGENT_VERSION
-            task.status = status
-            task.score = response.result.score if response else None
-            task.audit_level = response.result.audit_level.value if response else None
-            payload = response.model_dump(mode="json") if response else None
-            if isinstance(payload, dict) and debug:
-                payload["debug"] = debug
-            task.result_json = payload
-            task.error_msg = error_msg
-            task.usage_tokens = response.usage.tokens if response else 0
-            task.latency_ms = response.usage.latency_ms if response else 0
-
-            await _upsert_agent_audit_result(session, request, status, error_msg, debug)
-
-            await session.commit()
-            logger.info(f"Task {request.request_id} saved to DB (status={status}).")
+        await task_status_writer.submit(key, record)
     except Exception as e:
         logger.error(f"Failed to save task to DB: {type(e).__name__}: {e!r}")
         raise
@@ -503,6 +604,7 @@ async def audit_paper(request: AuditRequest):
     """
     token = set_request_id(request.request_id)
     start_time = time.time()
+    rag_task: Optional[asyncio.Task] = None
     logger.info(f"Received audit request for paper {request.metadata.paper_id}")
 
     try:
@@ -528,34 +630,38 @@ async def audit_paper(request: AuditRequest):
             # Update request payload with fetched content
             request.payload.content = content
 
+        # 审计阶段依赖关系：
+        #   content ─┬─> layout ──> semantic ──┬─> commentary
+        #            └─> rag_context ───────────┘
+        # RAG 的事实抽取、向量化与检索只依赖正文，与布局/语义校验并行；只有最终评语等待问题列表
+        rag_task = asyncio.create_task(semantic_checker.prepare_expert_context(request.payload.content))
+
         # 1. 视觉/布局分析
         logger.info("Starting layout analysis...")
+        # 解析到期后在页边界停止并返回已解析页面的结果；外层超时仅兜底校验阶段本身卡住的情况
         try:
-            layout_data = await asyncio.wait_for(layout_analyzer.analyze(request.payload.content), timeout=LAYOUT_ANALYSIS_TIMEOUT)
+            layout_data = await asyncio.wait_for(
+                layout_analyzer.analyze(
+                    request.payload.content,
+                    page_hook=semantic_checker.punct_checker.check_elements,
+                    timeout=LAYOUT_ANALYSIS_TIMEOUT,
+                ),
+                timeout=LAYOUT_ANALYSIS_TIMEOUT + LAYOUT_TIMEOUT_GRACE,
+            )
         except asyncio.TimeoutError:
-            logger.error(f"Layout analysis timeout (>{LAYOUT_ANALYSIS_TIMEOUT}s)")
-            def _count_pages_sync(pdf_payload):
-                doc = open_pdf(pdf_payload)
-                try:
-                    return len(doc)
-                finally:
-                    doc.close()
-
-            page_count = None
-            try:
-                page_count = await asyncio.to_thread(_count_pages_sync, request.payload.content)
-            except Exception:
-                page_count = None
+            logger.error(f"Layout analysis timeout (>{LAYOUT_ANALYSIS_TIMEOUT + LAYOUT_TIMEOUT_GRACE}s)")
             layout_data = {
                 "elements": [],
                 "layout_result": {"layout_issues": []},
                 "parse_errors": [{"error_type": "layout_timeout", "message": "layout analysis timeout"}],
-                "parse_report": {"page_count": page_count} if page_count else {},
+                "parse_report": {},
             }
         
         # 2. 语义校验
         logger.info("Starting semantic check...")
-        semantic_result = await semantic_checker.check(request.payload.content, layout_data)
+        semantic_result = await semantic_checker.check(
+            request.payload.content, layout_data, punctuation_pages=layout_data.get("page_hook_results")
+        )
         
         # 3. 构造返回结果
         layout_issues = layout_data.get("layout_result", {}).get("layout_issues", [])
@@ -575,9 +681,12 @@ async def audit_paper(request: AuditRequest):
             comment = f"发现 {len(issues)} 个格式问题。"
             suggestion = "建议根据详细报告进行修改。"
 
-        rag_comment, rag_suggestion = await semantic_checker.generate_expert_commentary(
-            request.payload.content, issues
-        )
+        try:
+            rag_context = await rag_task
+        except Exception as e:
+            logger.warning(f"expert context preparation failed: {e}")
+            rag_context = None
+        rag_comment, rag_suggestion = await semantic_checker.compose_expert_commentary(rag_context, issues)
         if rag_comment and rag_suggestion:
             comment = rag_comment
             suggestion = rag_suggestion
@@ -606,8 +715,8 @@ async def audit_paper(request: AuditRequest):
             )
         )
         
-        # 4. 异步写入数据库 (Fire-and-forget or await depending on requirement)
-        # 规范要求"实时写入"，这里使用 await 确保数据落库
+        # 4. 写入数据库：默认进入写回队列，与同一任务的 RUNNING 合并后批量落库；
+        # 需要"实时写入"的部署设置 TASK_WRITE_STRICT=1，此处 await 直到数据落库
         debug = {
             "issue_count": int(len(issues)),
             "issues": [_compact_issue(i) for i in (issues or [])],
@@ -624,6 +733,9 @@ async def audit_paper(request: AuditRequest):
             pass
         raise e
     finally:
+        # 前面的阶段失败时不再需要 RAG 上下文
+        if rag_task is not None and not rag_task.done():
+            rag_task.cancel()
         reset_request_id(token)
 
 @app.get("/rules")
@@ -0,0 +1,205 @@
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, List, Tuple
+
+import fitz
+
+
+AGENT_DIR = Path(__file__).resolve().parents[1]
+if str(AGENT_DIR) not in sys.path:
+    sys.path.insert(0, str(AGENT_DIR))
+
+
+from core.pdf_utils import extract_drawing_regions, open_pdf  # noqa: E402
+
+
+def _legacy_touch_or_intersect(a: fitz.Rect, b: fitz.Rect, margin: float) -> bool:
+    if a.intersects(b):
+        return True
+    ax0, ay0, ax1, ay1 = a.x0 - margin, a.y0 - margin, a.x1 + margin, a.y1 + margin
+    bx0, by0, bx1, by1 = b.x0, b.y0, b.x1, b.y1
+    if ax0 <= bx1 and ax1 >= bx0 and ay0 <= by1 and ay1 >= by0:
+        return True
+    bx0, by0, bx1, by1 = b.x0 - margin, b.y0 - margin, b.x1 + margin, b.y1 + margin
+    ax0, ay0, ax1, ay1 = a.x0, a.y0, a.x1, a.y1
+    return bx0 <= ax1 and bx1 >= ax0 and by0 <= ay1 and by1 >= ay0
+
+
+def legacy_extract_drawing_regions(
+    page: fitz.Page,
+    min_area_ratio: float = 0.02,
+    max_area_ratio: float = 0.9,
+    merge_margin: float = 4.0,
+) -> List[Tuple[float, float, float, float]]:
+    """重构前的实现：贪心合并 + while changed 的 O(n²) 反复合并，仅用于对照。"""
+    page_rect = page.rect
+    page_area = max(1.0, float(page_rect.width) * float(page_rect.height))
+    try:
+        drawings = page.get_drawings() or []
+    except Exception:
+        return []
+
+    rects: List[fitz.Rect] = []
+    for d in drawings:
+        r = d.get("rect") or d.get("bbox")
+        try:
+            rr = fitz.Rect(r)
+        except Exception:
+            continue
+        if rr.is_empty:
+            continue
+        rr = rr & page_rect
+        if rr.is_empty:
+            continue
+        if (float(rr.width) * float(rr.height)) / page_area < 0.0008:
+            continue
+        rects.append(rr)
+    if not rects:
+        return []
+
+    rects.sort(key=lambda r: float(r.width) * float(r.height), reverse=True)
+    clusters: List[fitz.Rect] = []
+    for r in rects:
+        for idx, c in enumerate(clusters):
+            if _legacy_touch_or_intersect(c, r, merge_margin):
+                clusters[idx] = c | r
+                break
+        else:
+            clusters.append(r)
+
+    changed = True
+    while changed and len(clusters) > 1:
+        changed = False
+        new_clusters: List[fitz.Rect] = []
+        for r in clusters:
+            for idx, c in enumerate(new_clusters):
+                if _legacy_touch_or_intersect(c, r, merge_margin):
+                    new_clusters[idx] = c | r
+                    changed = True
+                    break
+            else:
+                new_clusters.append(r)
+        clusters = new_clusters
+
+    out: List[Tuple[float, float, float, float]] = []
+    pw, ph = float(page_rect.width), float(page_rect.height)
+    for c in clusters:
+        c = c & page_rect
+        if c.is_empty:
+            continue
+        w, h = float(c.width), float(c.height)
+        if w <= 1.0 or h <= 1.0:
+            continue
+        area_ratio = (w * h) / page_area
+        if area_ratio < float(min_area_ratio) or area_ratio > float(max_area_ratio):
+            continue
+        slender = min(w, h) / max(w, h) < 0.06
+        if slender and (w / max(pw, 1.0) > 0.8 or h / max(ph, 1.0) > 0.8):
+            continue
+        out.append((float(c.x0), float(c.y0), float(c.x1), float(c.y1)))
+    return out
+
+
+def _make_dense_drawing_pdf(pages: int, paths: int, seed: int) -> bytes:
+    """每页若干“图”区域，每个区域内画大量小矩形/线段，模拟密集折线图与 TikZ 图。"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=595, height=842)
+        figures = [
+            fitz.Rect(x, y, x + rng.uniform(120, 260), y + rng.uniform(90, 200))
+            for x, y in ((rng.uniform(30, 300), rng.uniform(40, 600)) for _ in range(rng.randint(2, 4)))
+        ]
+        shape = page.new_shape()
+        for i in range(paths):
+            fig = figures[i % len(figures)]
+            x = rng.uniform(fig.x0, fig.x1 - 18)
+            y = rng.uniform(fig.y0, fig.y1 - 18)
+            # 每条路径单独 finish，get_drawings 才会逐条返回
+            shape.draw_rect(fitz.Rect(x, y, x + rng.uniform(18, 40), y + rng.uniform(18, 32)))
+            shape.finish(color=(0, 0, 0), width=0.5)
+            if i % 7 == 0:
+                shape.draw_line((x, y), (x + rng.uniform(-60, 60), y + rng.uniform(20, 60)))
+                shape.finish(color=(0, 0, 0), width=0.5)
+        shape.commit()
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _make_isolated_boxes_pdf(pages: int, paths: int, seed: int) -> bytes:
+    """每页大量互不接触的方框（流程图/框图），旧实现在簇数多时退化为 O(n²)。"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    cols = 20
+    for _ in range(pages):
+        page = doc.new_page(width=595, height=842)
+        shape = page.new_shape()
+        for i in range(paths):
+            row, col = divmod(i, cols)
+            x = 20 + col * 28 + rng.uniform(0, 2)
+            y = 20 + row * 28 + rng.uniform(0, 2)
+            if y + 22 > 830:
+                break
+            shape.draw_rect(fitz.Rect(x, y, x + 21, y + 21))
+            shape.finish(color=(0, 0, 0), width=0.5)
+        shape.commit()
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _bench(doc: Any, fn, repeat: int) -> Tuple[List[float], List[Any]]:
+    samples = []
+    results: List[Any] = []
+    for _ in range(repeat):
+        results = []
+        start = time.perf_counter()
+        for page in doc:
+            results.append(fn(page))
+        samples.append((time.perf_counter() - start) * 1000.0 / max(1, len(doc)))
+    return samples, results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="extract_drawing_regions benchmark: legacy O(n²) merge vs vectorized clustering")
+    parser.add_argument("--pdf", help="benchmark an existing PDF instead of synthetic dense-drawing pages")
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--paths", type=int, default=2000, help="drawing paths per synthetic page")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--isolated", action="store_true", help="many separate boxes instead of a few dense figures")
+    args = parser.parse_args()
+
+    if args.pdf:
+        payload = args.pdf
+    elif args.isolated:
+        payload = _make_isolated_boxes_pdf(args.pages, args.paths, args.seed)
+    else:
+        payload = _make_dense_drawing_pdf(args.pages, args.paths, args.seed)
+    doc = open_pdf(payload)
+    try:
+        # get_drawings 本身的开销两边相同，预热一次让其缓存/字体加载不计入首轮
+        for page in doc:
+            page.get_drawings()
+        legacy, legacy_out = _bench(doc, legacy_extract_drawing_regions, args.repeat)
+        fast, fast_out = _bench(doc, extract_drawing_regions, args.repeat)
+    finally:
+        doc.close()
+
+    identical = legacy_out == fast_out
+    legacy_ms = statistics.median(legacy)
+    fast_ms = statistics.median(fast)
+    print(f"regions per page: {[len(r) for r in fast_out]}")
+    print(f"legacy (greedy + while changed): {legacy_ms:.2f} ms/page")
+    print(f"vectorized clustering:           {fast_ms:.2f} ms/page")
+    print(f"speedup: {legacy_ms / max(fast_ms, 1e-9):.2f}x  identical: {identical}")
+    return 0 if identical else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
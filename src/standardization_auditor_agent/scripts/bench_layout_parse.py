@@ -0,0 +1,87 @@
+import argparse
+import statistics
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, List
+
+
+AGENT_DIR = Path(__file__).resolve().parents[1]
+if str(AGENT_DIR) not in sys.path:
+    sys.path.insert(0, str(AGENT_DIR))
+
+
+from core.pdf_utils import extract_blocks, extract_page_content, is_scanned_page, open_pdf  # noqa: E402
+
+
+def _make_text_heavy_pdf(pages: int, lines_per_page: int) -> bytes:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    buf = BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    _, height = A4
+    for p in range(1, pages + 1):
+        y = height - 50
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(60, y, f"{p} Chapter heading {p}")
+        c.setFont("Helvetica", 9)
+        for i in range(lines_per_page):
+            y -= 11
+            c.drawString(60, y, f"Line {i} of page {p}: deep learning models cite prior work [{i % 40 + 1}] (Smith, 2020) and more.")
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def _legacy_page_pass(page) -> None:
+    is_scanned_page(page)
+    blocks = extract_blocks(page)
+    any(b.get("type") == 1 for b in blocks)
+    page.get_images(full=True)
+
+
+def _single_page_pass(page) -> None:
+    extract_page_content(page)
+
+
+def _bench(doc, fn: Callable, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in doc:
+            fn(page)
+        samples.append((time.perf_counter() - start) * 1000.0 / max(1, len(doc)))
+    return samples
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Per-page extraction benchmark: legacy multi-pass vs single pass")
+    parser.add_argument("--pdf", help="benchmark an existing PDF instead of a synthetic one")
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--lines", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = args.pdf if args.pdf else _make_text_heavy_pdf(args.pages, args.lines)
+    doc = open_pdf(payload)
+    try:
+        # 预热一次，排除字体/资源首次加载的干扰
+        _bench(doc, _single_page_pass, 1)
+        legacy = _bench(doc, _legacy_page_pass, args.repeat)
+        single = _bench(doc, _single_page_pass, args.repeat)
+    finally:
+        doc.close()
+
+    legacy_ms = statistics.median(legacy)
+    single_ms = statistics.median(single)
+    print(f"pages: {args.pages if not args.pdf else 'n/a'}  repeat: {args.repeat}")
+    print(f"legacy (text + dict + get_images): {legacy_ms:.2f} ms/page")
+    print(f"single pass (extract_page_content): {single_ms:.2f} ms/page")
+    print(f"speedup: {legacy_ms / max(single_ms, 1e-9):.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -11,7 +11,7 @@ if AGENT_DIR not in sys.path:
     sys.path.insert(0, AGENT_DIR)
 
 from core.database import ExpertComment, db_manager  # noqa: E402
-from core.semantic_check import _embed_text_expert_comment  # noqa: E402
+from core.semantic_check import embedding_service  # noqa: E402
 
 
 def _seed_rows() -> List[Dict[str, Any]]:
@@ -104,8 +104,19 @@ async def seed(overwrite: bool = False, embed: bool = True) -> Dict[str, int]:
     skipped = 0
 
     try:
+        # 一次性批量向量化全部种子评语
+        embeddings: Dict[int, List[float]] = {}
+        if embed:
+            pending = [
+                (i, f"{str(r.get('metric_id') or '').strip()}\n{str(r.get('text') or '').strip()}")
+                for i, r in enumerate(rows)
+                if str(r.get("metric_id") or "").strip() and str(r.get("text") or "").strip()
+            ]
+            vectors = await embedding_service.embed_many([t for _, t in pending])
+            embeddings = {i: vec for (i, _), vec in zip(pending, vectors)}
+
         async with db_manager.session() as session:
-            for r in rows:
+            for i, r in enumerate(rows):
                 metric_id = str(r.get("metric_id") or "").strip()
                 text_val = str(r.get("text") or "").strip()
                 if not metric_id or not text_val:
@@ -122,9 +133,7 @@ async def seed(overwrite: bool = False, embed: bool = True) -> Dict[str, int]:
                     .first()
                 )
 
-                embedding = None
-                if embed:
-                    embedding = await asyncio.to_thread(_embed_text_expert_comment, f"{metric_id}\n{text_val}")
+                embedding = embeddings.get(i)
 
                 if existing:
                     if overwrite:
@@ -189,6 +198,7 @@ async def seed(overwrite: bool = False, embed: bool = True) -> Dict[str, int]:
             await session.commit()
         return {"inserted": inserted, "updated": updated, "skipped": skipped}
     finally:
+        embedding_service.close()
         await db_manager.close()
 
 
@@ -0,0 +1,317 @@
+import sys
+import unittest
+from io import BytesIO
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+AGENT_DIR = REPO_ROOT / "src" / "standardization_auditor_agent"
+if str(AGENT_DIR) not in sys.path:
+    sys.path.insert(0, str(AGENT_DIR))
+
+
+def _make_thesis_pdf(pages: int = 6, ref_page: int = 4) -> bytes:
+    from reportlab.pdfgen import canvas
+
+    buf = BytesIO()
+    c = canvas.Canvas(buf)
+    for p in range(1, pages + 1):
+        if p == ref_page:
+            c.drawString(72, 760, "References")
+            c.drawString(72, 740, f"[{p}] A. Author. Some paper title. Journal, 2020.")
+        else:
+            c.drawString(72, 760, f"{p} Introduction to chapter {p}")
+            c.drawString(72, 740, f"Body text on page {p} cites prior work [1] and (Smith, 2020).")
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+class TestShardedPDFParser(unittest.TestCase):
+    def test_sharded_parse_matches_serial(self):
+        from core.layout_analysis import PDFParser, shutdown_parse_pool
+
+        pdf_bytes = _make_thesis_pdf()
+        serial = PDFParser(workers=0, cache=None)._parse_sync(pdf_bytes)
+        sharded_parser = PDFParser(workers=2, shard_pages=2, cache=None)
+        sharded_parser._should_shard = lambda page_count: True
+        try:
+            sharded = sharded_parser._parse_sync(pdf_bytes)
+        finally:
+            shutdown_parse_pool()
+
+        self.assertEqual(
+            [e.model_dump() for e in serial["elements"]],
+            [e.model_dump() for e in sharded["elements"]],
+        )
+        self.assertEqual(serial["parse_report"], sharded["parse_report"])
+        regions = {e.page_num: e.region for e in sharded["elements"] if e.type == "text"}
+        self.assertEqual(regions.get(5), "reference")
+        self.assertEqual(regions.get(3), "main")
+
+    def test_shard_worker_stops_when_alive_flag_removed(self):
+        import os
+        import tempfile
+        from core.layout_analysis import _parse_shard_worker
+
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = os.path.join(tmp, "thesis.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(_make_thesis_pdf(pages=3))
+            alive = os.path.join(tmp, "shards.alive")
+            open(alive, "w").close()
+            full = _parse_shard_worker(pdf_path, [1, 2, 3], False, alive)
+            # 主进程删除标记（取消）后，worker 在页边界停止
+            os.unlink(alive)
+            stopped = _parse_shard_worker(pdf_path, [1, 2, 3], False, alive)
+
+        self.assertEqual(full["parse_report"]["last_page_parsed"], 3)
+        self.assertFalse(full["parse_report"]["partial"])
+        self.assertTrue(stopped["parse_report"]["partial"])
+        self.assertEqual(stopped["page_stats"], [])
+
+
+class TestPageContent(unittest.TestCase):
+    def test_single_pass_matches_legacy_helpers(self):
+        from core.pdf_utils import extract_blocks, extract_page_content, is_scanned_page, open_pdf
+
+        doc = open_pdf(_make_thesis_pdf(pages=2))
+        try:
+            for page in doc:
+                content = extract_page_content(page)
+                self.assertEqual(content.scanned, is_scanned_page(page))
+                legacy = extract_blocks(page)
+                self.assertEqual(len(content.blocks), len(legacy))
+                legacy_texts = [
+                    "".join(s.get("text", "") for s in line.get("spans", [])).strip()
+                    for b in legacy
+                    if b.get("type") == 0
+                    for line in b.get("lines", [])
+                ]
+                texts = [line["text"] for b in content.blocks if b.get("type") == 0 for line in b.get("lines", [])]
+                self.assertEqual(texts, legacy_texts)
+        finally:
+            doc.close()
+
+
+class TestStreamingLayoutAnalyzer(unittest.TestCase):
+    def test_streaming_matches_batch(self):
+        import asyncio
+        from core import layout_analysis
+        from core.layout_analysis import LayoutAnalyzer, PDFParser
+        from core.semantic_check import PunctuationChecker
+
+        pdf_bytes = _make_thesis_pdf()
+        punct = PunctuationChecker({})
+        analyzer = LayoutAnalyzer()
+        analyzer.parser = PDFParser(workers=0, cache=None)
+        analyzer.update_rules({"formula_check": {"require_numbering": True}})
+
+        original = layout_analysis.LAYOUT_STREAMING
+        try:
+            layout_analysis.LAYOUT_STREAMING = False
+            batch = asyncio.run(analyzer.analyze(pdf_bytes, page_hook=punct.check_elements))
+            layout_analysis.LAYOUT_STREAMING = True
+            streamed = asyncio.run(analyzer.analyze(pdf_bytes, page_hook=punct.check_elements))
+        finally:
+            layout_analysis.LAYOUT_STREAMING = original
+
+        self.assertEqual(
+            [e.model_dump() for e in batch["elements"]],
+            [e.model_dump() for e in streamed["elements"]],
+        )
+        self.assertEqual(batch["layout_result"], streamed["layout_result"])
+        self.assertEqual(batch["parse_report"], streamed["parse_report"])
+        self.assertEqual(len(streamed["page_hook_results"]), 6)
+        self.assertEqual(
+            [i for mixed, _ in batch["page_hook_results"] for i in mixed],
+            [i for mixed, _ in streamed["page_hook_results"] for i in mixed],
+        )
+
+
+class TestParseCancellation(unittest.TestCase):
+    def test_cancel_returns_parsed_prefix_and_skips_cache(self):
+        import tempfile
+        import threading
+        from unittest import mock
+        from core import layout_analysis
+        from core.layout_analysis import PDFParser
+        from core.layout_cache import LayoutParseCache
+
+        cancel = threading.Event()
+        real_parse_page = layout_analysis._parse_page
+
+        def _parse_page(page, page_num, reference_mode_global, parse_report):
+            out = real_parse_page(page, page_num, reference_mode_global, parse_report)
+            if page_num == 2:
+                cancel.set()
+            return out
+
+        pdf_bytes = _make_thesis_pdf()
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = LayoutParseCache(tmp, memory_bytes=1 << 20, disk_bytes=1 << 20)
+            parser = PDFParser(workers=0, cache=cache)
+            with mock.patch.object(layout_analysis, "_parse_page", _parse_page):
+                result = parser._parse_sync(pdf_bytes, cancel)
+            report = result["parse_report"]
+            self.assertTrue(report["partial"])
+            self.assertEqual(report["page_count"], 6)
+            self.assertEqual(report["pages_parsed"], 2)
+            self.assertEqual(report["last_page_parsed"], 2)
+            self.assertEqual({e.page_num for e in result["elements"]}, {1, 2})
+            self.assertEqual(cache.stats()["memory_items"], 0)
+
+    def test_streaming_cancel_reports_partial(self):
+        import asyncio
+        import threading
+        from core.layout_analysis import PDFParser
+
+        cancel = threading.Event()
+        cancel.set()
+
+        async def _collect():
+            return [b async for b in PDFParser(workers=0, cache=None).iter_pages(_make_thesis_pdf(), cancel)]
+
+        batches = asyncio.run(_collect())
+        self.assertEqual(len(batches), 1)
+        self.assertIsNone(batches[0]["page_num"])
+        self.assertTrue(batches[0]["parse_report"]["partial"])
+        self.assertEqual(batches[0]["parse_report"]["pages_parsed"], 0)
+
+
+class TestDrawingRegions(unittest.TestCase):
+    def test_clustering_matches_legacy_merge(self):
+        from core.pdf_utils import extract_drawing_regions, open_pdf
+        from scripts.bench_drawing_regions import (
+            _make_dense_drawing_pdf,
+            _make_isolated_boxes_pdf,
+            legacy_extract_drawing_regions,
+        )
+
+        cases = [
+            (_make_dense_drawing_pdf(pages=3, paths=300, seed=11), {}),
+            (_make_isolated_boxes_pdf(pages=1, paths=200, seed=3), {"min_area_ratio": 0.0}),
+            (_make_isolated_boxes_pdf(pages=1, paths=200, seed=5), {"min_area_ratio": 0.0, "merge_margin": 8.0}),
+        ]
+        for payload, kwargs in cases:
+            doc = open_pdf(payload)
+            try:
+                for page in doc:
+                    expected = legacy_extract_drawing_regions(page, **kwargs)
+                    self.assertTrue(expected)
+                    self.assertEqual(extract_drawing_regions(page, **kwargs), expected)
+            finally:
+                doc.close()
+
+
+class TestElementStore(unittest.TestCase):
+    def test_round_trip_and_page_split(self):
+        import pickle
+        from core.element_store import ElementStore, ElementStoreBuilder
+
+        first = ElementStoreBuilder()
+        first.add("title", "1 引言", [72, 760, 200, 772], 1, "title")
+        first.add("text", "正文见图1。", [72, 740, 300, 752], 1, "main")
+        second = ElementStoreBuilder()
+        second.add("image", "", [80, 300, 280, 500], 2, "chart")
+        second.add("text", "[1] A. Author.", [72, 740, 300, 752], 2, "reference")
+        store = ElementStore.concat([first.build(), second.build()])
+
+        self.assertEqual([e.content for e in store], ["1 引言", "正文见图1。", "", "[1] A. Author."])
+        self.assertEqual(store[3].region, "reference")
+        self.assertEqual(ElementStore.from_table(store.to_table()).to_dicts(), store.to_dicts())
+        self.assertEqual(pickle.loads(pickle.dumps(store)).to_dicts(), store.to_dicts())
+        self.assertEqual(ElementStore.from_rows(store.to_dicts()).to_dicts(), store.to_dicts())
+        self.assertEqual(store.take(store.type_mask("text")).to_dicts(), [store[1].model_dump(), store[3].model_dump()])
+        pages = store.by_page()
+        self.assertEqual(list(pages), [1, 2])
+        self.assertEqual([e.type for e in pages[2]], ["image", "text"])
+
+
+class TestVisualValidatorIndex(unittest.TestCase):
+    def test_settings_follow_rules_version(self):
+        from core.element_store import ElementStore
+        from core.layout_analysis import VisualValidator
+
+        elements = ElementStore.from_rows([
+            {"type": "title", "content": "图1 系统结构", "bbox": [100, 200, 300, 212], "page_num": 1, "region": "chart"},
+            {"type": "image", "content": "", "bbox": [100, 220, 300, 420], "page_num": 1, "region": "chart"},
+            {"type": "text", "content": "正文见图1。", "bbox": [72, 700, 500, 712], "page_num": 1, "region": "main"},
+        ])
+        validator = VisualValidator()
+        validator.update_rules({"figure_table_check": {"caption_requirement": "bottom"}})
+        issues = validator._validate_sync(elements)["layout_issues"]
+        self.assertEqual([i["message"] for i in issues], ["图标题应位于图下方 (规则要求: bottom)"])
+
+        validator.update_rules({"figure_table_check": {"caption_requirement": "top"}})
+        self.assertEqual(validator._validate_sync(elements)["layout_issues"], [])
+
+
+class TestLayoutParseCache(unittest.TestCase):
+    def test_repeat_parse_skips_pymupdf(self):
+        import tempfile
+        from unittest import mock
+        from core import layout_analysis
+        from core.layout_cache import LayoutParseCache
+
+        pdf_bytes = _make_thesis_pdf(pages=3, ref_page=3)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = LayoutParseCache(tmp, memory_bytes=1024 * 1024, disk_bytes=1024 * 1024)
+            first = layout_analysis.PDFParser(workers=0, cache=cache)._parse_sync(pdf_bytes)
+
+            # 新实例 + 清空内存层：仍应命中磁盘层，且不再调用 PyMuPDF
+            cache._memory.clear()
+            cache._memory_size = 0
+            with mock.patch.object(layout_analysis, "open_pdf", side_effect=AssertionError("parsed again")):
+                second = layout_analysis.PDFParser(workers=0, cache=cache)._parse_sync(pdf_bytes)
+
+            self.assertEqual(
+                [e.model_dump() for e in first["elements"]],
+                [e.model_dump() for e in second["elements"]],
+            )
+            self.assertEqual(first["parse_report"], second["parse_report"])
+            self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_streaming_replay_emits_per_page_reports(self):
+        import asyncio
+        import tempfile
+        from core.layout_analysis import PDFParser
+        from core.layout_cache import LayoutParseCache
+
+        pdf_bytes = _make_thesis_pdf(pages=3, ref_page=3)
+
+        def _pages(parser):
+            async def _run():
+                return [(b["page_num"], b["parse_report"]) async for b in parser.iter_pages(pdf_bytes)]
+            return asyncio.run(_run())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            live = _pages(PDFParser(workers=0, cache=None))
+            # 流式解析写入的缓存与整篇解析写入的缓存，回放结果都与现场解析一致
+            cache = LayoutParseCache(tmp, memory_bytes=1024 * 1024, disk_bytes=0)
+            _pages(PDFParser(workers=0, cache=cache))
+            self.assertEqual(_pages(PDFParser(workers=0, cache=cache)), live)
+            self.assertEqual(cache.stats()["hits"], 1)
+
+            cache = LayoutParseCache(None, memory_bytes=1024 * 1024, disk_bytes=0)
+            PDFParser(workers=0, cache=cache)._parse_sync(pdf_bytes)
+            self.assertEqual(_pages(PDFParser(workers=0, cache=cache)), live)
+            self.assertEqual(cache.stats()["hits"], 1)
+
+        self.assertEqual([r["pages_parsed"] for _, r in live], [1, 2, 3])
+
+    def test_page_set_is_part_of_key(self):
+        from core.layout_cache import make_cache_key
+
+        self.assertNotEqual(make_cache_key("abc", {1, 2}), make_cache_key("abc", None))
+        self.assertEqual(make_cache_key("abc", [2, 1]), make_cache_key("abc", {1, 2}))
+
+    def test_memory_tier_evicts_by_size(self):
+        from core.layout_cache import LayoutParseCache
+
+        cache = LayoutParseCache(None, memory_bytes=400, disk_bytes=0)
+        for i in range(20):
+            cache.put(f"k{i}", {"elements": [["text", "x" * 50 + str(i), [0, 0, 1, 1], 1, "main"]]})
+        self.assertLessEqual(cache.stats()["memory_bytes"], 400)
+        self.assertIsNone(cache.get("k0"))
+        self.assertIsNotNone(cache.get("k19"))
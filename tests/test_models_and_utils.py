@@ -76,3 +76,814 @@ class TestPdfUtils(unittest.TestCase):
 
         with self.assertRaises(ValueError):
             open_pdf("not a pdf")
+
+
+class TestTextPageMapper(unittest.TestCase):
+    def test_point_bulk_and_range_lookups(self):
+        from core.semantic_check import TextPageMapper
+
+        mapper = TextPageMapper({"elements": [
+            {"content": "abc", "page_num": 1},
+            {"content": "", "page_num": 2},
+            {"content": "defg", "page_num": 3},
+            {"content": "hi", "page_num": None},
+            {"content": "jk", "page_num": 5},
+        ]})
+        self.assertEqual(mapper.full_text, "abc\ndefg\nhi\njk")
+        offsets = [0, 2, 3, 4, 8, 9, 12, 13, 99, -1]
+        expected = ["1", "1", "?", "3", "?", "?", "5", "5", "?", "?"]
+        self.assertEqual([mapper.get_page_num(i) for i in offsets], expected)
+        self.assertEqual(mapper.get_page_nums(offsets), expected)
+        self.assertEqual(mapper.get_page_range(0, len(mapper.full_text)), "1-5")
+        self.assertEqual(mapper.get_page_range(4, 12), "3")
+        self.assertEqual(mapper.get_page_range(9, 12), "?")
+        self.assertEqual(mapper.get_page_range(5, 5), "?")
+
+
+class TestLLMResponseCache(unittest.TestCase):
+    def test_repeat_chunk_skips_provider_and_key_covers_params(self):
+        import asyncio
+        import os
+        import tempfile
+        from types import SimpleNamespace
+        from core.llm_cache import LLMResponseCache
+        from core.llm_client import LLMClient
+
+        calls = []
+
+        async def _create(**kwargs):
+            calls.append(kwargs)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"resp-{len(calls)}"))])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "llm.sqlite3")
+            client = LLMClient(cache=LLMResponseCache(path, ttl_sec=3600, max_bytes=1 << 20))
+            client.provider = "deepseek"
+            client.model_name = "deepseek-chat"
+            client.deepseek_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=_create)))
+
+            async def _run():
+                return [
+                    await client.scan_document("第一章"),
+                    await client.scan_document("第一章"),
+                    await client.scan_document("第一章", temperature=0.3),
+                    await client.generate_text("sys", "第一章", max_tokens=100),
+                    await client.generate_text("sys", "第一章", max_tokens=100),
+                ]
+
+            self.assertEqual(asyncio.run(_run()), ["resp-1", "resp-1", "resp-2", "resp-3", "resp-3"])
+            self.assertEqual(len(calls), 3)
+            self.assertEqual({k: client.cache.stats()[k] for k in ("hits", "misses", "items")}, {"hits": 2, "misses": 3, "items": 3})
+            client.cache.close()
+
+            # 新实例读取同一文件仍命中
+            reopened = LLMResponseCache(path, ttl_sec=3600, max_bytes=1 << 20)
+            client.cache = reopened
+            self.assertEqual(asyncio.run(client.scan_document("第一章")), "resp-1")
+            reopened.close()
+
+    def test_ttl_and_size_eviction(self):
+        from unittest import mock
+        from core import llm_cache
+        from core.llm_cache import LLMResponseCache
+
+        cache = LLMResponseCache(None, ttl_sec=60, max_bytes=1000)
+        with mock.patch.object(llm_cache.time, "time", return_value=1000.0):
+            cache.put("old", "x" * 100)
+        self.assertIsNone(cache.get("old"))
+        for i in range(20):
+            with mock.patch.object(llm_cache.time, "time", return_value=2000.0 + i):
+                cache.put(f"k{i}", "y" * 100)
+        stats = cache.stats()
+        self.assertLessEqual(stats["bytes"], 1000)
+        self.assertGreater(stats["evictions"], 0)
+        with mock.patch.object(llm_cache.time, "time", return_value=2030.0):
+            self.assertIsNone(cache.get("k0"))
+            self.assertEqual(cache.get("k19"), "y" * 100)
+
+
+class TestLLMClientRegistry(unittest.TestCase):
+    def test_clients_share_one_pool(self):
+        import asyncio
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from core.llm_http import LLMClientRegistry
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                body = b"ok"
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        registry = LLMClientRegistry(max_connections=2, max_keepalive=2, keepalive_expiry=30, http2=False)
+        try:
+            first = registry.openai("key", "http://127.0.0.1/v1")
+            self.assertIs(registry.openai("key", "http://127.0.0.1/v1"), first)
+            self.assertIsNot(registry.openai("other", "http://127.0.0.1/v1"), first)
+
+            url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+            async def _run():
+                client = registry.http_client()
+                responses = await asyncio.gather(*[client.get(url) for _ in range(6)])
+                return [r.text for r in responses]
+
+            self.assertEqual(asyncio.run(_run()), ["ok"] * 6)
+            stats = registry.stats()
+            self.assertEqual(stats["openai_clients"], 2)
+            self.assertEqual(stats["pool"]["requests"], 6)
+            self.assertLessEqual(stats["pool"]["created"], 2)
+            self.assertEqual(stats["pool"]["waiting"], 0)
+            self.assertEqual(stats["pool"]["in_use"], 0)
+
+            # 新的事件循环上仍可使用（底层连接池按事件循环重建）
+            self.assertEqual(asyncio.run(_run()), ["ok"] * 6)
+            asyncio.run(registry.aclose())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_pool_stats_degrade_without_httpcore_internals(self):
+        from unittest import mock
+        import httpx
+        from core.llm_http import PooledTransport
+
+        class _BareTransport(httpx.AsyncBaseTransport):
+            def __init__(self, **kwargs):
+                pass
+
+        with mock.patch("core.llm_http.httpx.AsyncHTTPTransport", _BareTransport):
+            transport = PooledTransport(httpx.Limits(max_connections=2), http2=False)
+        stats = transport.stats()
+        self.assertEqual((stats["created"], stats["requests"]), (0, 0))
+        self.assertNotIn("waiting", stats)
+
+
+class TestLLMRouter(unittest.TestCase):
+    def test_hedges_slow_primary_and_breaks_failing_one(self):
+        import asyncio
+        import time
+        from core.llm_routing import LLMRouter, LLMRoutingError
+
+        calls = []
+        behaviour = {"primary": 1.0, "secondary": 0.0}
+
+        async def _call(provider):
+            calls.append(provider)
+            delay = behaviour[provider]
+            if delay is None:
+                raise RuntimeError("boom")
+            await asyncio.sleep(delay)
+            return f"from-{provider}"
+
+        router = LLMRouter(hedge=True, min_samples=3, failure_threshold=2, cooldown_sec=0.2)
+        for _ in range(3):
+            router.latency.record("primary", 0.02)
+
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(router.run(["primary", "secondary"], _call)), ("from-secondary", "secondary"))
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(router.hedged, 1)
+
+        # 首选连续失败两次后熔断，之后直接跳过
+        behaviour["primary"] = None
+        calls.clear()
+        for _ in range(3):
+            self.assertEqual(asyncio.run(router.run(["primary", "secondary"], _call))[1], "secondary")
+        self.assertEqual(calls, ["primary", "secondary", "primary", "secondary", "secondary"])
+        self.assertEqual(router.stats(["primary"])["providers"]["primary"]["state"], "open")
+
+        # 冷却结束后放行试探，成功即恢复
+        behaviour["primary"] = 0.0
+        time.sleep(0.25)
+        self.assertEqual(asyncio.run(router.run(["primary", "secondary"], _call))[1], "primary")
+        self.assertEqual(router.breaker.state("primary"), "closed")
+
+        behaviour["secondary"] = None
+        behaviour["primary"] = None
+        with self.assertRaises(LLMRoutingError):
+            asyncio.run(router.run(["primary", "secondary"], _call))
+
+    def test_half_open_admits_a_single_probe(self):
+        import asyncio
+        from core.llm_routing import LLMRouter
+
+        now = {"t": 0.0}
+        router = LLMRouter(hedge=False, failure_threshold=1, cooldown_sec=10, clock=lambda: now["t"])
+        router.breaker.record_failure("primary")
+        now["t"] = 11.0
+        calls = []
+
+        async def _call(provider):
+            calls.append(provider)
+            await asyncio.sleep(0.05 if provider == "primary" else 0)
+            return f"from-{provider}"
+
+        async def _burst():
+            return await asyncio.gather(*[router.run(["primary", "secondary"], _call) for _ in range(5)])
+
+        results = asyncio.run(_burst())
+        self.assertEqual(calls.count("primary"), 1)
+        self.assertEqual(sorted(p for _, p in results), ["primary"] + ["secondary"] * 4)
+        self.assertEqual(router.breaker.state("primary"), "closed")
+
+        # 试探被取消（没有结论）时释放资格，下一个请求可再次试探
+        router.breaker.record_failure("primary")
+        now["t"] = 22.0
+
+        async def _cancelled_probe():
+            task = asyncio.ensure_future(router.run(["primary"], _call))
+            await asyncio.sleep(0.01)
+            self.assertFalse(router.breaker.allow("primary"))
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return router.breaker.allow("primary")
+
+        self.assertTrue(asyncio.run(_cancelled_probe()))
+
+    def test_client_fails_over_to_second_provider(self):
+        import asyncio
+        from types import SimpleNamespace
+        from core.llm_client import LLMClient
+        from core.llm_routing import LLMRouter
+
+        def _stub(reply):
+            async def _create(**kwargs):
+                if isinstance(reply, Exception):
+                    raise reply
+                return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+            return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=_create)))
+
+        client = LLMClient(cache=None, route_providers=[])
+        client.providers = ["deepseek", "qwen"]
+        client.provider = "deepseek"
+        client.deepseek_client = _stub(RuntimeError("503"))
+        client.qwen_client = _stub('{"issues": []}')
+        client.router = LLMRouter(hedge=False)
+
+        self.assertEqual(asyncio.run(client.scan_document("正文")), '{"issues": []}')
+        self.assertEqual(asyncio.run(client.generate_text("sys", "user")), '{"issues": []}')
+        self.assertEqual(client.router.stats()["failovers"], 2)
+
+
+class TestLLMRateLimiter(unittest.TestCase):
+    def test_bucket_queues_and_settles_actual_usage(self):
+        import asyncio
+        import time
+        from core.llm_limits import LLMRateLimited, ProviderLimiter
+
+        # 每分钟 600 次请求 -> 容量用完后每 0.1 秒补 1 次
+        limiter = ProviderLimiter("deepseek", rpm=600, tpm=1000, concurrency=(4, 1, 8), max_wait_sec=1.0)
+        limiter.requests._tokens = 1
+
+        async def _run():
+            async with limiter.lease(300) as lease:
+                lease.settle(100)
+            started = time.monotonic()
+            async with limiter.lease(100) as lease:
+                lease.settle(None)
+            return time.monotonic() - started
+
+        waited = asyncio.run(_run())
+        self.assertGreaterEqual(waited, 0.05)
+        self.assertEqual(limiter.completed, 2)
+        self.assertEqual(limiter.tokens_used, 200)
+        # 预估 300 实际 100，多扣的 200 已退回
+        self.assertGreater(limiter.tokens.available(), 790)
+
+        limiter.max_wait_sec = 0.05
+        limiter.tokens._tokens = -5000
+
+        async def _starved():
+            async with limiter.lease(100):
+                pass
+
+        with self.assertRaises(LLMRateLimited):
+            asyncio.run(_starved())
+        self.assertEqual(limiter.rejected, 1)
+
+    def test_throttle_halves_concurrency_and_success_ramps_up(self):
+        import asyncio
+        from core.llm_limits import ProviderLimiter
+
+        class _TooMany(Exception):
+            status_code = 429
+
+        limiter = ProviderLimiter("qwen", rpm=0, tpm=0, concurrency=(8, 1, 8), max_wait_sec=1.0)
+
+        async def _throttled():
+            async with limiter.lease(10):
+                raise _TooMany()
+
+        with self.assertRaises(_TooMany):
+            asyncio.run(_throttled())
+        self.assertEqual(limiter.concurrency.limit, 4)
+        self.assertEqual(limiter.throttled, 1)
+        self.assertGreater(limiter.paused_until, 0)
+
+        limiter.paused_until = 0.0
+
+        async def _ok():
+            async with limiter.lease(10) as lease:
+                lease.settle(10)
+
+        for _ in range(8):
+            asyncio.run(_ok())
+        self.assertGreaterEqual(limiter.concurrency.limit, 5.5)
+        self.assertEqual(limiter.concurrency.in_flight, 0)
+
+
+    def test_cancelled_request_backs_off_and_refunds_tokens(self):
+        import asyncio
+        from core.llm_limits import ProviderLimiter, ProviderLimiters
+
+        limiter = ProviderLimiter("deepseek", rpm=600, tpm=1000, concurrency=(4, 1, 8), max_wait_sec=1.0)
+
+        async def _slow():
+            async with limiter.lease(400):
+                await asyncio.sleep(5)
+
+        async def _run():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(_slow(), timeout=0.05)
+
+        asyncio.run(_run())
+        self.assertEqual(limiter.concurrency.limit, 2)
+        self.assertEqual(limiter.concurrency.in_flight, 0)
+        self.assertGreater(limiter.tokens.available(), 990)
+
+        # 等待令牌补充期间不占并发槽
+        limiter.requests._tokens = 0
+
+        async def _queued():
+            task = asyncio.create_task(_slow())
+            await asyncio.sleep(0.02)
+            in_flight = limiter.concurrency.in_flight
+            task.cancel()
+            return in_flight
+
+        self.assertEqual(asyncio.run(_queued()), 0)
+
+        # 未配置任何额度的 provider 不限流
+        self.assertIsNone(ProviderLimiters(0, 0, {}, (4, 1, 8), 1.0).get("deepseek"))
+
+
+class TestIssueStreamParser(unittest.TestCase):
+    def test_emits_each_issue_as_its_object_closes(self):
+        import json
+        from core.llm_stream import IssueStreamParser
+
+        issues = [
+            {"issue_type": "A", "evidence": "含 } 与 \\\" 的证据", "location": {"page": 1}, "tags": ["x", {"y": 1}]},
+            {"issue_type": "B", "evidence": "[12]"},
+            {"issue_type": "C", "evidence": "c"},
+        ]
+        text = "```json\n" + json.dumps({"issues": issues, "summary": "s"}, ensure_ascii=False) + "\n```"
+        seen = []
+        parser = IssueStreamParser(lambda issue: seen.append((len(parser.text), issue)) or True)
+        for i in range(0, len(text), 3):
+            parser.feed(text[i:i + 3])
+        self.assertEqual([issue for _, issue in seen], issues)
+        # 每个问题在其后续内容到达之前就已交出
+        self.assertLess(seen[0][0], text.index('"B"'))
+        self.assertLess(seen[-1][0], text.index('"summary"'))
+        self.assertFalse(parser.stopped)
+
+        capped = []
+        parser = IssueStreamParser(lambda issue: capped.append(issue) or len(capped) < 2)
+        parser.feed(json.dumps(issues))
+        self.assertEqual([i["issue_type"] for i in capped], ["A", "B"])
+        self.assertTrue(parser.stopped)
+
+
+class TestEmbeddingService(unittest.TestCase):
+    def test_encodes_in_batches_on_one_thread(self):
+        import asyncio
+        import threading
+        from unittest import mock
+        import numpy as np
+        from core import semantic_check
+        from core.embedding_cache import EmbeddingCache
+        from core.semantic_check import EmbeddingService
+
+        calls = []
+
+        class _Model:
+            def encode(self, texts, batch_size=None, normalize_embeddings=False):
+                calls.append((len(texts), threading.current_thread().name))
+                return np.ones((len(texts), 768), dtype=np.float32) / np.sqrt(768)
+
+        service = EmbeddingService(batch_size=4)
+        texts = [f"评语 {i}" for i in range(10)]
+        try:
+            with mock.patch.object(semantic_check, "_sbert_model", _Model()), \
+                    mock.patch.object(semantic_check, "embedding_cache", EmbeddingCache(max_items=0)):
+                vectors = asyncio.run(service.embed_many(texts))
+                single = asyncio.run(service.embed("评语 0"))
+        finally:
+            service.close()
+
+        self.assertEqual(len(vectors), 10)
+        self.assertEqual(len(vectors[0]), 768)
+        self.assertEqual(single, vectors[0])
+        self.assertEqual([n for n, _ in calls], [4, 4, 2, 1])
+        self.assertEqual(len({name for _, name in calls}), 1)
+        self.assertTrue(calls[0][1].startswith("sbert-embed"))
+        self.assertEqual(service.batches(list(range(5)), 2), [[0, 1], [2, 3], [4]])
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_lru_and_disk_tier_survive_restart(self):
+        import tempfile
+        import numpy as np
+        from core.embedding_cache import EmbeddingCache
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = EmbeddingCache(max_items=2, directory=tmp, disk_items=3, dim=4)
+            for i in range(4):
+                cache.put("m", f"text {i}", [i, 0, 0, 1])
+            # 空白差异归一化后命中同一条
+            self.assertEqual(cache.get("m", "  text   3 ").tolist(), [3, 0, 0, 1])
+            self.assertIsNone(cache.get("other-model", "text 3"))
+            self.assertEqual(len(cache._memory), 2)
+
+            restarted = EmbeddingCache(max_items=2, directory=tmp, disk_items=3, dim=4)
+            # 磁盘层容量 3，最早的 text 0 已被覆盖
+            self.assertIsNone(restarted.get("m", "text 0"))
+            self.assertEqual(restarted.get("m", "text 1").dtype, np.float32)
+            self.assertEqual(restarted.get("m", "text 2").tolist(), [2, 0, 0, 1])
+            self.assertEqual(restarted.stats()["disk_hits"], 2)
+
+    def test_disk_tier_shared_between_processes_never_returns_wrong_vector(self):
+        import tempfile
+        import numpy as np
+        from core.embedding_cache import _DiskTier
+
+        def vec(i):
+            return np.array([i, 0, 0, 1], dtype=np.float32)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            a = _DiskTier(tmp, capacity=3, dim=4)
+            b = _DiskTier(tmp, capacity=3, dim=4)
+            a.put_many([(b"k1".ljust(32, b"-"), vec(1)), (b"k2".ljust(32, b"-"), vec(2))])
+            # b 的写入位置以 meta.json 为准，不会覆盖 a 刚写入的行
+            b.put(b"k3".ljust(32, b"-"), vec(3))
+            self.assertEqual(b.get(b"k1".ljust(32, b"-")).tolist(), [1, 0, 0, 1])
+            self.assertEqual(a.get(b"k2".ljust(32, b"-")).tolist(), [2, 0, 0, 1])
+
+            # a 覆盖了 k1 所在的行：b 的旧索引指向的行 key 已变，视为未命中
+            a.put(b"k4".ljust(32, b"-"), vec(4))
+            self.assertIsNone(b.get(b"k1".ljust(32, b"-")))
+            self.assertEqual(a.get(b"k3".ljust(32, b"-")).tolist(), [3, 0, 0, 1])
+
+            # 向量与 CRC 不一致（写了一半）时同样视为未命中
+            row = a._rows[b"k2".ljust(32, b"-")]
+            a._vectors[row] = vec(9)
+            self.assertIsNone(a.get(b"k2".ljust(32, b"-")))
+
+    def test_sbert_embedding_is_computed_once_per_text(self):
+        from unittest import mock
+        import numpy as np
+        from core import semantic_check
+        from core.embedding_cache import EmbeddingCache
+
+        encoded = []
+
+        class _Model:
+            def encode(self, texts, batch_size=None, normalize_embeddings=False):
+                encoded.append(texts)
+                if isinstance(texts, str):
+                    return np.full(768, 0.5, dtype=np.float32)
+                return np.full((len(texts), 768), 0.5, dtype=np.float32)
+
+        with mock.patch.object(semantic_check, "_sbert_model", _Model()), \
+                mock.patch.object(semantic_check, "embedding_cache", EmbeddingCache(max_items=16)):
+            first = semantic_check._embed_text_sbert("事实 A")
+            self.assertEqual(semantic_check._embed_text_sbert("事实  A "), first)
+            batch = semantic_check._embed_texts_sbert(["事实 A", "事实 B"])
+
+        self.assertEqual(batch[0], first)
+        self.assertEqual(encoded, ["事实 A", ["事实 B"]])
+
+
+class TestExpertCommentIndex(unittest.TestCase):
+    def test_search_applies_filters_and_ranks_by_cosine(self):
+        import asyncio
+        from unittest import mock
+        from core.expert_index import ExpertCommentIndex
+
+        index = ExpertCommentIndex(enabled=True)
+        rows = [
+            {"text": "引用风格", "metric_id": "CITATION_STYLE", "active": True, "embedding": [1.0, 0.0, 0.0]},
+            {"text": "停用的评语", "metric_id": "OLD", "active": False, "embedding": [1.0, 0.1, 0.0]},
+            {"text": "无指标评语", "metric_id": "  ", "active": None, "embedding": [2.0, 1.0, 0.0]},
+            {"text": "   ", "metric_id": "EMPTY", "active": True, "embedding": [1.0, 0.05, 0.0]},
+            {"text": "标题编号", "metric_id": "HEADING", "active": True, "embedding": [0.0, 0.0, 3.0]},
+            {"text": "没有向量", "metric_id": "X", "active": True, "embedding": None},
+        ]
+
+        async def _fake_load():
+            return False
+
+        # 未载入时返回 None（调用方回退 pgvector），并触发后台载入
+        with mock.patch.object(index, "load", side_effect=_fake_load) as load:
+            async def _miss():
+                hits = index.search([1, 0, 0], 3, True, False, True)
+                await asyncio.sleep(0)
+                return hits
+            self.assertIsNone(asyncio.run(_miss()))
+            load.assert_called_once()
+
+        index.build(rows)
+        query = [1.0, 0.2, 0.0]
+        self.assertEqual(index.search(query, 3, True, False, True), ["引用风格", "无指标评语", "标题编号"])
+        self.assertEqual(index.search(query, 2, True, True, True), ["引用风格", "标题编号"])
+        self.assertEqual(index.search(query, 2, False, False, False), ["停用的评语", "   "])
+        self.assertEqual(index.stats()["vectors"], 5)
+
+        index.invalidate()
+        self.assertFalse(index.ready)
+
+    def test_load_discards_stale_build_and_refreshes_on_db_change(self):
+        import asyncio
+        import contextlib
+        from types import SimpleNamespace
+        from unittest import mock
+        from core import expert_index
+        from core.expert_index import ExpertCommentIndex
+
+        db = {"signature": (1, "t1", 1), "rows": [("引用风格", "M1", True, [1.0, 0.0])]}
+
+        class _Session:
+            async def execute(self, stmt):
+                if "count" in str(stmt).lower():
+                    return SimpleNamespace(one=lambda: db["signature"])
+                return SimpleNamespace(all=lambda: list(db["rows"]))
+
+        @contextlib.asynccontextmanager
+        async def session():
+            yield _Session()
+
+        index = ExpertCommentIndex(refresh_sec=0.01)
+        prepare = index._prepare
+
+        def invalidating_prepare(rows):
+            index.invalidate()
+            return prepare(rows)
+
+        async def scenario():
+            # 构建期间被 invalidate：不安装过期矩阵
+            with mock.patch.object(index, "_prepare", side_effect=invalidating_prepare):
+                self.assertFalse(await index.load())
+            self.assertFalse(index.ready)
+            self.assertTrue(await index.load())
+            self.assertEqual(index.search([1.0, 0.0], 5, True, False, True), ["引用风格"])
+
+            # 其它进程新增评语：签名变化后后台重新载入
+            db["signature"] = (2, "t2", 2)
+            db["rows"].append(("标题编号", "M2", True, [0.0, 1.0]))
+            await asyncio.sleep(0.02)
+            index.search([1.0, 0.0], 5, True, False, True)
+            await index._loading
+            return index.search([0.0, 1.0], 5, True, False, True)
+
+        with mock.patch.object(expert_index.db_manager, "session", session):
+            self.assertEqual(asyncio.run(scenario()), ["标题编号", "引用风格"])
+
+    def test_hnsw_filter_shortfall_falls_back_to_pgvector(self):
+        from core.expert_index import ExpertCommentIndex
+
+        class _Hnsw:
+            def set_ef(self, ef):
+                pass
+
+            def knn_query(self, query, k, filter=None):
+                raise RuntimeError("Cannot return the results in a contiguous 2D array")
+
+        index = ExpertCommentIndex()
+        index.build([{"text": "a", "metric_id": "M", "active": True, "embedding": [1.0, 0.0]}])
+        index._hnsw = _Hnsw()
+        self.assertIsNone(index.search([1.0, 0.0], 1, True, False, True))
+        self.assertEqual(index.stats()["fallbacks"], 1)
+
+
+class TestSchemaCache(unittest.TestCase):
+    def test_refresh_loads_columns_and_rebuilds_statements(self):
+        import asyncio
+        from types import SimpleNamespace
+        from core.schema_cache import SchemaCache
+
+        class _Session:
+            def __init__(self):
+                self.queries = 0
+
+            async def execute(self, stmt, params=None):
+                self.queries += 1
+                if "format_type" in str(stmt):
+                    rows = [("review_tasks", "task_id", "character varying"), ("agent_audit_result", "result_json", "jsonb")]
+                else:
+                    rows = [("agent_audit_result", ["request_id", "agent_code"])]
+                return SimpleNamespace(all=lambda: rows)
+
+        cache = SchemaCache(["review_tasks", "agent_audit_result", "paper_sections"])
+        session = _Session()
+        asyncio.run(cache.ensure(session))
+        asyncio.run(cache.ensure(session))
+        self.assertEqual(session.queries, 2)
+        self.assertEqual(cache.columns("review_tasks"), frozenset({"task_id"}))
+        self.assertEqual(cache.columns("paper_sections"), frozenset())
+        self.assertEqual(cache.column_type("agent_audit_result", "result_json"), "jsonb")
+        self.assertEqual(
+            cache.conflict_target("agent_audit_result", ["request_id", "paper_id", "agent_code"]),
+            ["request_id", "agent_code"],
+        )
+        self.assertIsNone(cache.conflict_target("agent_audit_result", ["request_id"]))
+
+        built = []
+        self.assertEqual(cache.statement("k", lambda: built.append(1) or "sql-v1"), "sql-v1")
+        self.assertEqual(cache.statement("k", lambda: built.append(1) or "other"), "sql-v1")
+        asyncio.run(cache.refresh(session))
+        self.assertEqual(cache.statement("k", lambda: built.append(1) or "sql-v2"), "sql-v2")
+        self.assertEqual((len(built), cache.version), (2, 2))
+
+
+class TestTaskStatusWriter(unittest.TestCase):
+    def test_coalesces_per_task_and_spools_when_db_down(self):
+        import asyncio
+        import os
+        import tempfile
+        from core.task_writer import TaskStatusWriter
+
+        flushed = []
+        state = {"down": True}
+
+        async def flush(records):
+            if state["down"]:
+                raise ConnectionError("db unreachable")
+            flushed.append(records)
+
+        def merge(old, new):
+            new["created"] = old["created"]
+            return new
+
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = TaskStatusWriter(batch_size=10, flush_sec=60, spool_dir=tmp)
+            writer.bind(flush, merge=merge)
+
+            async def scenario():
+                await writer.submit("t1", {"status": "RUNNING", "created": 1})
+                await writer.submit("t2", {"status": "RUNNING", "created": 2})
+                await writer.submit("t1", {"status": "SUCCESS", "created": 3})
+                await writer.drain()
+                self.assertGreater(writer.stats()["spool_bytes"], 0)
+
+                state["down"] = False
+                await writer.submit("t2", {"status": "FAILED", "created": 4})
+                await writer.drain()
+
+            asyncio.run(scenario())
+            self.assertEqual(os.listdir(tmp), [])
+
+        self.assertEqual(len(flushed), 1)
+        self.assertEqual(
+            sorted((r["status"], r["created"]) for r in flushed[0]),
+            [("FAILED", 2), ("SUCCESS", 1)],
+        )
+        stats = writer.stats()
+        self.assertEqual((stats["coalesced"], stats["spooled"], stats["written"]), (1, 2, 2))
+
+
+    def test_retries_records_submitted_during_failed_flush(self):
+        import asyncio
+        import os
+        import tempfile
+        from core.task_writer import TaskStatusWriter
+
+        flushed = []
+        state = {"down": True}
+
+        async def scenario(writer):
+            started = asyncio.Event()
+            release = asyncio.Event()
+
+            async def flush(records):
+                if state["down"]:
+                    started.set()
+                    await release.wait()
+                    raise ConnectionError("db unreachable")
+                flushed.extend(records)
+
+            writer.bind(flush)
+            await writer.submit("t1", {"status": "RUNNING"})
+            await started.wait()
+            # 第一轮写库尚未失败时入队的记录
+            await writer.submit("t2", {"status": "RUNNING"})
+            state["down"] = False
+            release.set()
+            for _ in range(200):
+                if len(flushed) == 2:
+                    break
+                await asyncio.sleep(0.01)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = TaskStatusWriter(batch_size=10, flush_sec=0.01, spool_dir=tmp, retry_sec=0.01)
+            asyncio.run(scenario(writer))
+            self.assertEqual(sorted(r["status"] for r in flushed), ["RUNNING", "RUNNING"])
+            self.assertEqual(writer.stats()["pending"], 0)
+            self.assertEqual(writer.stats()["spool_bytes"], 0)
+
+    def test_claimed_spool_survives_until_flush_commits(self):
+        import asyncio
+        import os
+        import tempfile
+        from core.task_writer import TaskStatusWriter, _Spool
+
+        flushed = []
+
+        async def flush(records):
+            flushed.extend(records)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            crashed = _Spool(tmp)
+            crashed.append([("t1", {"status": "SUCCESS"})])
+            # 认领后尚未写库的进程：文件改名为 .inflight 并持锁，其它进程不能接管
+            self.assertEqual(crashed.claim(), [("t1", {"status": "SUCCESS"})])
+            self.assertTrue(all(name.endswith(".inflight") for name in os.listdir(tmp)))
+
+            writer = TaskStatusWriter(batch_size=10, flush_sec=60, spool_dir=tmp)
+            writer.bind(flush)
+            asyncio.run(writer.drain())
+            self.assertEqual(flushed, [])
+            self.assertGreater(writer.stats()["spool_bytes"], 0)
+
+            # 进程退出后锁释放，遗留的 .inflight 被接管并在写库成功后删除
+            for f in crashed._claimed.values():
+                f.close()
+            asyncio.run(writer.drain())
+            self.assertEqual(flushed, [{"status": "SUCCESS"}])
+            self.assertEqual(os.listdir(tmp), [])
+
+    def test_quarantines_records_rejected_by_db(self):
+        import asyncio
+        import json
+        import os
+        import tempfile
+        from core.task_writer import TaskStatusWriter
+
+        flushed = []
+
+        async def flush(records):
+            if any("\x00" in r["error"] for r in records):
+                raise ValueError("unsupported Unicode escape sequence")
+            flushed.extend(records)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = TaskStatusWriter(batch_size=10, flush_sec=60, spool_dir=tmp)
+            writer.bind(flush)
+
+            async def scenario():
+                for i in range(5):
+                    await writer.submit(f"t{i}", {"error": "bad\x00" if i == 3 else "ok"})
+                await writer.drain()
+
+            asyncio.run(scenario())
+            self.assertEqual(len(flushed), 4)
+            stats = writer.stats()
+            self.assertEqual((stats["quarantined"], stats["spooled"], stats["spool_bytes"]), (1, 0, 0))
+            with open(os.path.join(tmp, "quarantine.jsonl"), encoding="utf-8") as f:
+                self.assertEqual(json.loads(f.readline())["key"], "t3")
+
+
+class TestPaperSectionCache(unittest.TestCase):
+    def test_resolves_sibling_chunks_from_cached_sections(self):
+        from core.section_cache import PaperSectionCache, resolve_section_content
+
+        sections = [
+            {"section_id": 3, "section_name": "第一章 绪论", "content": None, "section_content": "绪论正文"},
+            {"section_id": 5, "section_name": "摘要", "content": None, "section_content": "摘要正文"},
+            {"section_id": 7, "section_name": "空章节", "content": None, "section_content": ""},
+        ]
+        cols = ["section_content"]
+        self.assertEqual(resolve_section_content(sections, "chunk_seq_005", cols), "摘要正文")
+        self.assertEqual(resolve_section_content(sections, "第一章绪论", cols), "绪论正文")
+        self.assertIsNone(resolve_section_content(sections, "空章节", cols))
+        self.assertIsNone(resolve_section_content(sections, "chunk_009", cols))
+
+        cache = PaperSectionCache(max_papers=1, ttl_sec=0)
+        cache.put("p1", sections)
+        self.assertIs(cache.get("p1"), sections)
+        cache.put("p2", sections)
+        self.assertIsNone(cache.get("p1"))
+        self.assertEqual(cache.stats()["papers"], 1)
+        # 切片被修改后由写入方失效
+        self.assertTrue(cache.invalidate("p2"))
+        self.assertIsNone(cache.get("p2"))
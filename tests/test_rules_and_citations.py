@@ -78,3 +78,197 @@ class TestCitationReferenceMatch(unittest.TestCase):
         cites = [SimpleNamespace(content="[20]", page_num=1, bbox=[0, 0, 1, 1])]
         issues = check_citation_reference_match(cites, refs)
         self.assertEqual(issues, [])
+
+
+class TestTerminologyChecker(unittest.TestCase):
+    def test_automaton_keeps_case_boundary_and_whitespace_rules(self):
+        from core.semantic_check import TerminologyChecker, TextPageMapper
+
+        checker = TerminologyChecker({
+            "terms": {"深度学习": ["Deep Learning"]},
+            "forbidden_variants": {"CNN": ["C.N.N.", "cnn"], "卷积神经网络": ["卷积网络"]},
+            "warn_on_mixed_allowed_forms": True,
+        })
+        mapper = TextPageMapper({"elements": [
+            {"content": "深度学习与 DEEP\nLEARNING 的对比", "page_num": 1},
+            {"content": "使用 CNNs 与卷积网络", "page_num": 2},
+            {"content": "以及 Cnn 模型", "page_num": 3},
+        ]})
+        issues = []
+        checker.check(mapper.full_text, issues, mapper)
+
+        by_type = {i["issue_type"]: i for i in issues}
+        self.assertEqual(by_type["Terminology_Inconsistent"]["evidence"], "deep\nlearning, 深度学习")
+        self.assertEqual(by_type["Terminology_Inconsistent"]["page_num"], "1")
+        forbidden = [i for i in issues if i["issue_type"] == "Terminology_Forbidden"]
+        self.assertEqual([(i["evidence"], i["page_num"]) for i in forbidden], [("cnn", "3"), ("卷积网络", "2")])
+
+
+class TestTypoChecker(unittest.TestCase):
+    def test_indexed_matches_agree_with_difflib(self):
+        import difflib
+        from core.semantic_check import TextPageMapper, TypoChecker
+
+        checker = TypoChecker({"critical_keywords": ["TensorFlow", "PyTorch", "卷积神经网络"], "max_typos_total_warning": 2})
+        mapper = TextPageMapper({"elements": [
+            {"content": "基于 TensorFlwo 与 PyTorch 实现", "page_num": 1},
+            {"content": "TensorFlwo 的 PyTorches 以及卷积神经网洛", "page_num": 2},
+        ]})
+        issues = []
+        checker.check(mapper.full_text, issues, mapper)
+
+        typos = [(i["evidence"], i["page_num"]) for i in issues if i["issue_type"] == "Critical_Keyword_Typo"]
+        # 与 get_close_matches 一致：重复出现的误拼词会被多次选中
+        self.assertEqual(typos, [("TensorFlwo", "1"), ("TensorFlwo", "2")] * 2)
+        self.assertEqual(issues[-1]["issue_type"], "Typo_Limit_Exceeded")
+        words = ["TensorFlwo", "TensorFlow", "Tensor", "TensorFlows", "TensrFlw"]
+        close = checker.keyword_index.close_words(words)
+        self.assertEqual(
+            sorted(w for _, w in close["TensorFlow"]),
+            sorted(difflib.get_close_matches("TensorFlow", words, n=len(words), cutoff=0.85)),
+        )
+
+
+class TestLLMChunkScan(unittest.TestCase):
+    def test_chunk_spans_point_into_repeated_text(self):
+        from core.semantic_check import SemanticChecker
+
+        checker = SemanticChecker()
+        text = "重复段落。\n" * 6 + "结尾"
+        spans = checker._chunk_spans(text, chunk_size=12, overlap=6)
+        self.assertEqual(spans[0][0], 0)
+        self.assertEqual(spans[-1][1], len(text))
+        # 内容相同的分块仍各自对应不同的原文位置
+        self.assertEqual(len({a for a, _ in spans}), len(spans))
+        self.assertTrue(all(a < b for (a, _), (b, _) in zip(spans, spans[1:])))
+
+        # 按估算 token 数切分：同样 2000 个字符，英文约 500 token，中文约 1200 token
+        self.assertEqual(len(checker._chunk_spans("word " * 400, chunk_size=600, overlap=0, unit="tokens")), 1)
+        self.assertGreater(len(checker._chunk_spans("字" * 2000, chunk_size=600, overlap=0, unit="tokens")), 1)
+        self.assertGreater(len(checker._chunk_spans("word " * 400, chunk_size=600, overlap=0)), 1)
+
+    def test_chunks_run_concurrently_and_merge_in_order(self):
+        import asyncio
+        import json
+        from core.semantic_check import SemanticChecker
+
+        class _StubClient:
+            provider = "mock"
+
+            def __init__(self):
+                self.active = 0
+                self.peak = 0
+
+            async def scan_document(self, content):
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+                try:
+                    label = content[:2]
+                    # 越靠前的分块越慢，验证合并顺序与完成顺序无关；C 分块超时
+                    await asyncio.sleep({"AA": 0.06, "BB": 0.03, "CC": 5, "DD": 0.0}[label])
+                    return json.dumps({"issues": [{"issue_type": "Abbreviation_Definition", "severity": "Info", "evidence": label}], "summary": label})
+                finally:
+                    self.active -= 1
+
+        checker = SemanticChecker()
+        checker.llm_client = _StubClient()
+        checker.update_rules({"llm_scan": {
+            "enabled": True, "concurrency": 3, "chunk_timeout_sec": 0.2, "chunk_size": 9, "chunk_overlap": 0,
+        }})
+        layout = {"elements": [
+            {"content": "AA one", "page_num": 1},
+            {"content": "BB two", "page_num": 1},
+            {"content": "CC three", "page_num": 2},
+            {"content": "DD four", "page_num": 2},
+        ]}
+        self.assertEqual(
+            checker._chunk_text("AA one\nBB two\nCC three\nDD four", 9, 0),
+            ["AA one", "BB two", "CC three", "DD four"],
+        )
+        result = asyncio.run(checker.check("", layout))
+
+        llm_issues = [i for i in result["semantic_issues"] if i.get("source") == "LLM"]
+        self.assertEqual([(i["evidence"], i["page_num"]) for i in llm_issues], [("AA", "1"), ("BB", "1"), ("DD", "2")])
+        self.assertEqual(result["llm_feedback"], "AA\nBB\nDD")
+        self.assertEqual(checker.llm_client.peak, 3)
+
+    def test_streamed_chunks_keep_partial_issues_and_stop_at_cap(self):
+        import asyncio
+        import json
+        from core.semantic_check import SemanticChecker
+
+        class _StreamClient:
+            provider = "mock"
+
+            def __init__(self):
+                self.sent = {}
+
+            async def scan_document_stream(self, content, on_issue):
+                label = content[:2]
+                self.sent[label] = 0
+                for n in range(4):
+                    # CC 交出两个问题后卡住直到超时
+                    await asyncio.sleep(5 if (label, n) == ("CC", 2) else 0.01)
+                    self.sent[label] += 1
+                    issue = {"issue_type": "Abbreviation_Definition", "severity": "Info", "evidence": f"{label}{n}"}
+                    if on_issue(issue) is False:
+                        return "{\"issues\": ["
+                return json.dumps({"issues": [], "summary": label})
+
+        checker = SemanticChecker()
+        checker.llm_client = _StreamClient()
+        checker.update_rules({"llm_scan": {
+            "enabled": True, "concurrency": 2, "chunk_timeout_sec": 0.2, "chunk_size": 9, "chunk_overlap": 0,
+            "stream": True, "max_issues_per_chunk": 3,
+        }})
+        layout = {"elements": [
+            {"content": "AA one", "page_num": 1},
+            {"content": "CC three", "page_num": 2},
+        ]}
+        result = asyncio.run(checker.check("", layout))
+
+        llm_issues = [i["evidence"] for i in result["semantic_issues"] if i.get("source") == "LLM"]
+        # AA 达到上限 3 后提前结束；CC 超时但保留超时前已闭合的问题
+        self.assertEqual(llm_issues[:3], ["AA0", "AA1", "AA2"])
+        self.assertEqual(checker.llm_client.sent["AA"], 3)
+        self.assertEqual(llm_issues[3:], ["CC0", "CC1"])
+        # 提前结束时的不完整 JSON 不会进入反馈
+        self.assertNotIn("{", result["llm_feedback"])
+
+
+class TestExpertCommentary(unittest.TestCase):
+    def test_context_is_prepared_without_issues_and_composed_later(self):
+        import asyncio
+        import json
+        from unittest import mock
+        from core import semantic_check
+        from core.expert_index import ExpertCommentIndex
+        from core.semantic_check import SemanticChecker
+
+        prompts = []
+
+        class _StubClient:
+            provider = "mock"
+
+            async def generate_text(self, system_prompt, user_prompt, temperature=0.1, max_tokens=800):
+                prompts.append(user_prompt)
+                if len(prompts) == 1:
+                    return "- 引用格式混用"
+                return json.dumps({"comment": "c", "suggestion": "s"})
+
+        index = ExpertCommentIndex()
+        index.build([{"text": "统一引用风格", "metric_id": "CITATION_STYLE", "active": True, "embedding": [1.0] * 768}])
+
+        checker = SemanticChecker()
+        checker.llm_client = _StubClient()
+        with mock.patch.object(semantic_check, "expert_comment_index", index):
+            context = asyncio.run(checker.prepare_expert_context("正文"))
+        self.assertEqual(context, {"facts": "- 引用格式混用", "expert_texts": ["统一引用风格"]})
+        self.assertEqual(len(prompts), 1)
+
+        issues = [{"issue_type": "Citation_Style"}, {"issue_type": "Citation_Style"}]
+        self.assertEqual(asyncio.run(checker.compose_expert_commentary(context, issues)), ("c", "s"))
+        final = json.loads(prompts[-1])
+        self.assertEqual(final["issue_summary"], "- Citation_Style: 2")
+        self.assertEqual(final["expert_comments"], "- 统一引用风格")
+        self.assertEqual(asyncio.run(checker.compose_expert_commentary(None, issues)), (None, None))